@@ -35,6 +35,7 @@ PG_DSN = os.getenv("PG_DSN", "postgresql://ml:ml@localhost:5432/mlengine")
 PG_SCHEMA = os.getenv("PG_SCHEMA", "public")
 PG_MINCONN = int(os.getenv("PG_MINCONN", "1"))
 PG_MAXCONN = int(os.getenv("PG_MAXCONN", "5"))
+EVENT_ID_TYPE = os.getenv("EVENT_ID_TYPE", "text").lower()  # text | uuid | bigint
 
 logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
 log = logging.getLogger("serve_isoforest")
@@ -100,6 +101,7 @@ async def lifespan(app: FastAPI):
                 db_schema=PG_SCHEMA,
                 db_minconn=PG_MINCONN,
                 db_maxconn=PG_MAXCONN,
+                event_id_type=EVENT_ID_TYPE,
             )
             log.info("Initialized fresh model")
     except Exception:
@@ -117,6 +119,7 @@ async def lifespan(app: FastAPI):
             db_schema=PG_SCHEMA,
             db_minconn=PG_MINCONN,
             db_maxconn=PG_MAXCONN,
+            event_id_type=EVENT_ID_TYPE,
         )
 
     if WARMUP_FROM_DB:
@@ -151,7 +154,8 @@ app.add_middleware(
 @app.get("/healthz")
 def healthz():
     assert model is not None
-    return {"status": "ok", "trained": model._is_fitted, "actions_path": model.actions_path}
+    return {"status": "ok", "trained": model._is_fitted, "actions_path": model.actions_path,
+            "late_reordered": model._perip.late_reordered, "late_dropped": model._perip.late_dropped}
 
 @app.post("/score")
 def score_json(batch: EventsBatch = Body(...), write_actions: bool = True):
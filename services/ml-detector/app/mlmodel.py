@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-import os, json, logging, datetime as dt, statistics as stats
+import os, sys, json, logging, datetime as dt, statistics as stats
+from bisect import bisect_right
 from typing import Any, Dict, List, Tuple, Deque, Optional
 from collections import deque, defaultdict
 from contextlib import contextmanager
@@ -21,6 +22,8 @@ log = logging.getLogger("isoforest-model")
 N_ESTIMATORS = int(os.getenv("N_ESTIMATORS", "200"))
 CONTAMINATION = float(os.getenv("CONTAMINATION", "0.1"))
 WINDOW_MINUTES = int(os.getenv("WINDOW_MINUTES", "10"))
+# сколько секунд событие IP может опоздать относительно его последнего события; позже — отбрасываем
+ALLOWED_LATENESS_SEC = float(os.getenv("ALLOWED_LATENESS_SEC", "30"))
 MIN_TRAIN_ROWS = int(os.getenv("MIN_TRAIN_ROWS", "5"))
 RETRAIN_EVERY = int(os.getenv("RETRAIN_EVERY", "1"))
 HARD_FAIL_RATIO = float(os.getenv("HARD_FAIL_RATIO", "0.95"))
@@ -34,25 +37,66 @@ PG_DSN = os.getenv("PG_DSN", "postgresql://ml:ml@localhost:5432/mlengine")
 PG_SCHEMA = os.getenv("PG_SCHEMA", "public")
 PG_MINCONN = int(os.getenv("PG_MINCONN", "1"))
 PG_MAXCONN = int(os.getenv("PG_MAXCONN", "5"))
+# Тип колонки events.event_id: text (как раньше), uuid (uuid4/uuid7 из парсера) или bigint (snowflake).
+# Применяется при создании таблицы; существующую таблицу не трогаем.
+EVENT_ID_TYPE = os.getenv("EVENT_ID_TYPE", "text").lower()
+EVENT_ID_SQL_TYPES = {"text": "TEXT", "uuid": "UUID", "bigint": "BIGINT"}
 
 
 def parse_ts(iso: str) -> dt.datetime:
     return dt.datetime.fromisoformat(iso)
 
 
-class PerIPWindow:
-    """Буфер per-IP. Окно якорится на last_seen (ts текущего события)."""
+def event_epoch(ev: Dict[str, Any]) -> float:
+    """Время события в epoch-секундах: ts_epoch_ms от парсера без повторного разбора ts."""
+    ms = ev.get("ts_epoch_ms")
+    if ms is not None:
+        return ms / 1000.0
+    return parse_ts(ev["ts"]).timestamp()
+
+
+def _ts(item: Tuple) -> float:
+    return item[0]
+
 
-    def __init__(self, window: dt.timedelta):
+class PerIPWindow:
+    """
+    Буфер per-IP. Окно якорится на last_seen (самое позднее ts IP). Время — epoch-секунды.
+    Храним не весь event-dict, а только то, что нужно фичам: (ts, outcome, user, dest_port),
+    outcome/user интернированы.
+    Буфер IP всегда отсортирован по ts: событие, опоздавшее не больше чем на lateness
+    секунд относительно last_seen этого IP (несколько парсеров, рассинхрон часов сенсоров),
+    встаёт на своё место; более позднее отбрасывается и считается в late_dropped.
+    """
+
+    def __init__(self, window: dt.timedelta, lateness: float = ALLOWED_LATENESS_SEC):
         self.window = window
-        self._buf: Dict[str, Deque[Tuple[dt.datetime, Dict[str, Any]]]] = defaultdict(deque)
+        self._window_s = window.total_seconds()
+        self.lateness = lateness
+        self._buf: Dict[str, Deque[Tuple[float, str, Optional[str], Any]]] = defaultdict(deque)
+        self.late_reordered = 0
+        self.late_dropped = 0
 
     def push(self, ev: Dict[str, Any]) -> None:
         ip = ev.get("source_ip") or "0.0.0.0"
-        ts = parse_ts(ev["ts"])
+        ts = event_epoch(ev)
+        outcome = ev.get("outcome", "success")
+        user = ev.get("user")
         dq = self._buf[ip]
-        dq.append((ts, ev))
-        bound = ts - self.window
+        item = (ts,
+                sys.intern(outcome) if isinstance(outcome, str) else outcome,
+                sys.intern(user) if isinstance(user, str) else user,
+                ev.get("dest_port"))
+        if not dq or ts >= dq[-1][0]:
+            dq.append(item)
+        else:
+            last = dq[-1][0]
+            if ts < last - self.lateness or ts < last - self._window_s:
+                self.late_dropped += 1
+                return
+            dq.insert(bisect_right(dq, ts, key=_ts), item)
+            self.late_reordered += 1
+        bound = dq[-1][0] - self._window_s
         while dq and dq[0][0] < bound:
             dq.popleft()
 
@@ -71,20 +115,20 @@ class PerIPWindow:
                 "ip_inter_std": 0.0,
             }
 
-        times = [t for (t, _) in dq]
-        outcomes = [e.get("outcome", "success") for (_, e) in dq]
-        users = [e.get("user") for (_, e) in dq]
-        dports = [e.get("dest_port") for (_, e) in dq]
+        times = [t for (t, _o, _u, _p) in dq]
+        outcomes = [o for (_t, o, _u, _p) in dq]
+        users = [u for (_t, _o, u, _p) in dq]
+        dports = [p for (_t, _o, _u, p) in dq]
 
         inter = []
         if len(times) >= 2:
             for a, b in zip(times[:-1], times[1:]):
-                inter.append((b - a).total_seconds())
+                inter.append(b - a)
 
         burst_max = 0
         i = 0
         for j in range(len(times)):
-            while times[j] - times[i] > dt.timedelta(seconds=60):
+            while times[j] - times[i] > 60.0:
                 i += 1
             burst_max = max(burst_max, j - i + 1)
 
@@ -117,6 +161,7 @@ class IsoForestPerIP:
         random_state=42,
         warm_start=False,
         window_minutes=WINDOW_MINUTES,
+        allowed_lateness=ALLOWED_LATENESS_SEC,
         train_buffer_size=TRAIN_BUFFER_SIZE,
         min_train_rows=MIN_TRAIN_ROWS,
         retrain_every_batches=RETRAIN_EVERY,
@@ -127,7 +172,10 @@ class IsoForestPerIP:
         db_schema: str = PG_SCHEMA,
         db_minconn: int = PG_MINCONN,
         db_maxconn: int = PG_MAXCONN,
+        event_id_type: str = EVENT_ID_TYPE,
     ):
+        if event_id_type not in EVENT_ID_SQL_TYPES:
+            raise ValueError(f"event_id_type must be one of {sorted(EVENT_ID_SQL_TYPES)}, got {event_id_type!r}")
         self._clf = IsolationForest(
             n_estimators=n_estimators,
             contamination=contamination,
@@ -139,7 +187,7 @@ class IsoForestPerIP:
         self._vec = DictVectorizer(sparse=True)
         self._is_fitted = False
 
-        self._perip = PerIPWindow(window=dt.timedelta(minutes=window_minutes))
+        self._perip = PerIPWindow(window=dt.timedelta(minutes=window_minutes), lateness=allowed_lateness)
         self._train_rows: List[Dict[str, Any]] = []
         self._batches_seen = 0
         self._train_buffer_size = train_buffer_size
@@ -157,6 +205,7 @@ class IsoForestPerIP:
             "random_state": random_state,
             "warm_start": warm_start,
             "window_minutes": window_minutes,
+            "allowed_lateness": allowed_lateness,
             "train_buffer_size": train_buffer_size,
             "min_train_rows": min_train_rows,
             "retrain_every_batches": retrain_every_batches,
@@ -167,6 +216,7 @@ class IsoForestPerIP:
             "db_schema": db_schema,
             "db_minconn": db_minconn,
             "db_maxconn": db_maxconn,
+            "event_id_type": event_id_type,
         }
 
         # DB (PostgreSQL)
@@ -174,6 +224,7 @@ class IsoForestPerIP:
         self._db_schema = db_schema
         self._db_minconn = db_minconn
         self._db_maxconn = db_maxconn
+        self._event_id_type = event_id_type
         self._pool: Optional[SimpleConnectionPool] = None
 
     def _ensure_pool(self):
@@ -207,7 +258,7 @@ class IsoForestPerIP:
             cur.execute(f'CREATE SCHEMA IF NOT EXISTS "{self._db_schema}";')
             cur.execute(f"""
             CREATE TABLE IF NOT EXISTS "{self._db_schema}".events (
-                event_id TEXT PRIMARY KEY,
+                event_id {EVENT_ID_SQL_TYPES[self._event_id_type]} PRIMARY KEY,
                 ts TIMESTAMPTZ,
                 source_ip TEXT,
                 source_port INTEGER,
@@ -226,6 +277,15 @@ class IsoForestPerIP:
                 metadata JSONB
             );
             """)
+            cur.execute("""
+                SELECT data_type FROM information_schema.columns
+                WHERE table_schema = %s AND table_name = 'events' AND column_name = 'event_id'
+            """, (self._db_schema,))
+            row = cur.fetchone()
+            if row and row[0].upper() != EVENT_ID_SQL_TYPES[self._event_id_type]:
+                log.warning("events.event_id is %s, EVENT_ID_TYPE=%s is ignored for the existing table",
+                            row[0], self._event_id_type)
+                self._event_id_type = {"TEXT": "text", "UUID": "uuid", "BIGINT": "bigint"}.get(row[0].upper(), "text")
             cur.execute(f'CREATE INDEX IF NOT EXISTS idx_events_ts ON "{self._db_schema}".events(ts);')
             cur.execute(f'CREATE INDEX IF NOT EXISTS idx_events_ip ON "{self._db_schema}".events(source_ip);')
             cur.execute(f"""
@@ -266,9 +326,14 @@ class IsoForestPerIP:
         if not batch:
             return
         rows = []
+        skipped = 0
         for ev in batch:
+            event_id = self._event_id_value(ev.get("event_id"))
+            if event_id is None:
+                skipped += 1
+                continue
             rows.append((
-                ev.get("event_id"),
+                event_id,
                 ev.get("ts"),
                 ev.get("source_ip"),
                 ev.get("source_port"),
@@ -286,6 +351,8 @@ class IsoForestPerIP:
                 ev.get("scenario"),
                 extras.Json(ev.get("metadata", {})),
             ))
+        if skipped:
+            log.warning("Skipped %d events with event_id not fitting %s column", skipped, self._event_id_type)
         with conn.cursor() as cur:
             extras.execute_values(cur, f"""
                 INSERT INTO "{self._db_schema}".events (
@@ -296,6 +363,20 @@ class IsoForestPerIP:
                 ON CONFLICT (event_id) DO NOTHING;
             """, rows, page_size=200)
 
+    def _event_id_value(self, v: Any):
+        """event_id под тип колонки; None — не подходит (строка пропускается)."""
+        if v is None:
+            return None
+        if self._event_id_type == "bigint":
+            try:
+                return int(v)
+            except (TypeError, ValueError):
+                return None
+        if self._event_id_type == "uuid":
+            s = str(v)
+            return s if len(s) == 36 and s.count("-") == 4 else None
+        return str(v)
+
     def _db_insert_features(self, conn, ts_iso: str, ip_feats: List[Dict[str, Any]]):
         if not ip_feats:
             return
@@ -719,7 +800,7 @@ class IsoForestPerIP:
                     events = []
                     for row in rows:
                         events.append({
-                            "event_id": row[0],
+                            "event_id": str(row[0]) if row[0] is not None else None,
                             "ts": row[1].isoformat() if row[1] else None,
                             "source_ip": row[2],
                             "source_port": row[3],
@@ -0,0 +1,146 @@
+# services/parser/app/alerts.py
+"""
+Агрегация инцидентов. Вместо нового инцидента на каждое событие после порога —
+жизненный цикл на (правило, ключ):
+  open   — первое срабатывание: полный инцидент с base_event;
+  update — пока срабатывания идут, не чаще раза в update_interval: свежие счётчики;
+  close  — срабатываний нет close_after секунд (по времени событий правила — у источников
+           разные часы, см. RuleEngine.rule_clock): итог без base_event.
+У всех трёх общий incident_id, в hits — сколько раз правило сработало с момента open.
+"""
+import os
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from parser_normalizer import new_event_id
+
+ALERT_AGGREGATE = os.environ.get("ALERT_AGGREGATE", "1") == "1"          # 0 — инцидент на каждое срабатывание, как раньше
+ALERT_UPDATE_INTERVAL = float(os.environ.get("ALERT_UPDATE_INTERVAL", "60"))
+ALERT_CLOSE_AFTER = float(os.environ.get("ALERT_CLOSE_AFTER", "120"))
+ALERT_MAX_OPEN = int(os.environ.get("ALERT_MAX_OPEN", "100000"))         # сверх — закрываем самые старые
+
+
+class _Open:
+    __slots__ = ("incident_id", "head", "hits", "first", "last", "last_at", "last_emit")
+
+    def __init__(self, incident_id: str, head: dict, now: float):
+        self.incident_id = incident_id
+        self.head = head          # инцидент open без base_event — основа для close
+        self.hits = 1
+        self.first = now
+        self.last = now
+        self.last_at = head.get("at")
+        self.last_emit = now
+
+
+class AlertAggregator:
+    def __init__(self, enabled: bool = ALERT_AGGREGATE, update_interval: float = ALERT_UPDATE_INTERVAL,
+                 close_after: float = ALERT_CLOSE_AFTER, max_open: int = ALERT_MAX_OPEN):
+        self.enabled = enabled
+        self.update_interval = update_interval
+        self.close_after = close_after
+        self.max_open = max_open
+        # упорядочен по последнему срабатыванию — вытесняем по max_open с начала
+        self.open: "OrderedDict[Tuple[str, Hashable], _Open]" = OrderedDict()
+        # те же агрегаты по правилу, упорядочены по времени последнего срабатывания в часах
+        # правила — закрываем с начала каждого
+        self._by_kind: Dict[str, "OrderedDict[Hashable, _Open]"] = {}
+        self._closing: List[dict] = []
+
+        self.opened = 0
+        self.updated = 0
+        self.closed = 0
+        self.suppressed = 0
+
+    def hit(self, kind: str, key: Hashable, now: float, build: Callable[[], dict]) -> Optional[dict]:
+        """Срабатывание правила kind для key. build() собирает инцидент; вызывается, только если его надо выдать."""
+        if not self.enabled:
+            return build()
+        k = (kind, key)
+        st = self.open.get(k)
+        if st is None:
+            inc = build()
+            iid = new_event_id()
+            inc.update(incident_id=iid, phase="open", hits=1, first_at=inc.get("at"), last_at=inc.get("at"))
+            st = self.open[k] = _Open(iid, {f: v for f, v in inc.items() if f != "base_event"}, now)
+            self._lru(kind)[key] = st
+            self.opened += 1
+            if self.max_open and len(self.open) > self.max_open:
+                (old_kind, old_key), old = self.open.popitem(last=False)
+                del self._by_kind[old_kind][old_key]
+                self._closing.append(self._close(old))
+            return inc
+
+        st.hits += 1
+        if now > st.last:
+            st.last = now
+            self.open.move_to_end(k)
+            self._by_kind[kind].move_to_end(key)
+        if now - st.last_emit < self.update_interval:
+            self.suppressed += 1
+            return None
+        inc = build()
+        st.last_at = inc.get("at")
+        st.last_emit = now
+        inc.update(incident_id=st.incident_id, phase="update", hits=st.hits,
+                   first_at=st.head.get("first_at"), last_at=st.last_at)
+        self.updated += 1
+        return inc
+
+    def _lru(self, kind: str) -> "OrderedDict[Hashable, _Open]":
+        lru = self._by_kind.get(kind)
+        if lru is None:
+            lru = self._by_kind[kind] = OrderedDict()
+        return lru
+
+    def _close(self, st: _Open) -> dict:
+        self.closed += 1
+        return {**st.head, "phase": "close", "hits": st.hits, "last_at": st.last_at, "at": st.last_at,
+                "base_event": None, "extra": {**st.head.get("extra", {}), "duration_s": round(st.last - st.first, 3)}}
+
+    def expire(self, watermark: float, clocks: Optional[Dict[str, float]] = None) -> List[dict]:
+        """
+        Закрывает агрегаты без срабатываний за close_after; возвращает инциденты close.
+        Время — clocks[правило] (часы правила), для правил не из clocks — watermark.
+        """
+        out, self._closing = self._closing, []
+        for kind, lru in self._by_kind.items():
+            lim = (clocks.get(kind, watermark) if clocks is not None else watermark) - self.close_after
+            while lru:
+                key, st = next(iter(lru.items()))
+                if st.last >= lim:
+                    break
+                lru.popitem(last=False)
+                del self.open[(kind, key)]
+                out.append(self._close(st))
+        return out
+
+    def dump(self, chunk: int = 5000) -> Iterator[list]:
+        """Снимок: открытые агрегаты частями по chunk, в порядке последнего срабатывания."""
+        opened = self.open
+        keys = list(opened)
+        for i in range(0, len(keys), chunk):
+            # между частями агрегат мог закрыться — его уже не пишем
+            yield [(k, st.incident_id, st.head, st.hits, st.first, st.last, st.last_at, st.last_emit)
+                   for k in keys[i:i + chunk] for st in (opened.get(k),) if st is not None]
+
+    def pending_close(self) -> List[dict]:
+        """close, ещё не выданные через expire (вытесненные по max_open)."""
+        return list(self._closing)
+
+    def restore(self, entries: list, closing: Optional[List[dict]] = None):
+        """Обратное к dump; closing — ещё не выданные close (выдадутся при следующем expire)."""
+        for k, iid, head, hits, first, last, last_at, last_emit in entries:
+            st = _Open(iid, head, first)
+            st.hits, st.last, st.last_at, st.last_emit = hits, last, last_at, last_emit
+            self.open[k] = st
+            self.open.move_to_end(k)
+            lru = self._lru(k[0])
+            lru[k[1]] = st
+            lru.move_to_end(k[1])
+        if closing:
+            self._closing.extend(closing)
+
+    def stats(self) -> Dict[str, int]:
+        return {"open": len(self.open), "opened": self.opened, "updated": self.updated,
+                "closed": self.closed, "suppressed": self.suppressed}
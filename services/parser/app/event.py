@@ -0,0 +1,97 @@
+# services/parser/app/event.py
+import sys
+from typing import Any, Dict, Optional
+
+# Порядок полей = порядок ключей в normalized.jsonl
+FIELDS = (
+    "event_id", "ts", "ts_epoch_ms", "source_ip", "source_port", "dest_ip", "dest_port",
+    "user", "service", "sensor", "event_type", "action", "outcome", "message",
+    "protocol", "bytes", "scenario", "metadata",
+)
+
+# Поля с небольшим набором значений — храним интернированными, одна копия строки на процесс
+ENUM_FIELDS = ("service", "sensor", "event_type", "action", "outcome", "protocol")
+
+_intern = sys.intern
+
+
+def intern_opt(s: Optional[str]) -> Optional[str]:
+    return _intern(s) if s is not None else None
+
+
+class NormalizedEvent:
+    """
+    Компактное нормализованное событие: __slots__ вместо dict на 18 ключей.
+    Внутри сервиса (правила, окна, инциденты) живёт именно оно, в dict
+    превращается только на границе JSON (to_dict / from_dict).
+    Пустой metadata хранится как None.
+    Для совместимости с кодом, который работает с dict, есть .get() и ev["key"].
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, event_id, ts, ts_epoch_ms, source_ip, source_port, dest_ip, dest_port,
+                 user, service, sensor, event_type, action, outcome, message,
+                 protocol, bytes=None, scenario=None, metadata=None):
+        self.event_id = event_id
+        self.ts = ts
+        self.ts_epoch_ms = ts_epoch_ms
+        self.source_ip = source_ip
+        self.source_port = source_port
+        self.dest_ip = dest_ip
+        self.dest_port = dest_port
+        self.user = user
+        self.service = service
+        self.sensor = sensor
+        self.event_type = event_type
+        self.action = action
+        self.outcome = outcome
+        self.message = message
+        self.protocol = protocol
+        self.bytes = bytes
+        self.scenario = scenario
+        self.metadata = metadata or None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        v = getattr(self, key, default)
+        if key == "metadata" and v is None:
+            return {}
+        return v
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in FIELDS:
+            raise KeyError(key)
+        return self.get(key)
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {f: getattr(self, f) for f in FIELDS}
+        if d["metadata"] is None:
+            d["metadata"] = {}
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "NormalizedEvent":
+        ev = cls(*(d.get(f) for f in FIELDS))
+        for f in ENUM_FIELDS:
+            v = getattr(ev, f)
+            if isinstance(v, str):
+                setattr(ev, f, _intern(v))
+        return ev
+
+    def __reduce__(self):
+        # для пула процессов: кортеж значений вместо dict состояния
+        return (NormalizedEvent, tuple(getattr(self, f) for f in FIELDS))
+
+    def __eq__(self, other):
+        if not isinstance(other, NormalizedEvent):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in FIELDS)
+
+    def __repr__(self):
+        return f"NormalizedEvent({self.event_type!r}, {self.ts!r}, event_id={self.event_id!r})"
+
+
+def json_default(o: Any):
+    """default= для json.dumps: NormalizedEvent -> dict."""
+    if isinstance(o, NormalizedEvent):
+        return o.to_dict()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
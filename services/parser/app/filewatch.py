@@ -0,0 +1,175 @@
+# services/parser/app/filewatch.py
+"""
+Waiting for a tailed file to grow, for shipper.py.
+
+On Linux an inotify watch on the file's directory wakes the reader as soon as
+the file is written, created, moved or deleted (rotation). Elsewhere, or when
+inotify is unavailable (no libc symbol, watch limit reached), a plain sleep
+loop is used instead. Both expose wait(timeout) -> bool ("something changed")
+and the same as a coroutine, wait_async(), for the asyncio shipper.
+
+The directory is watched rather than the file, so rotation and a file that
+does not exist yet need no special handling: the watch survives them.
+"""
+import asyncio, ctypes, ctypes.util, errno, logging, os, select, struct, time
+from typing import Callable, Optional
+
+# even with inotify, re-check this often when idle: a missed event only costs latency
+INOTIFY_RECHECK = float(os.environ.get("SHIPPER_INOTIFY_RECHECK", "5.0"))
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; then len bytes of NUL-padded name
+
+log = logging.getLogger("filewatch")
+
+
+class PollWaiter:
+    """Fallback: sleep for min(timeout, interval)."""
+    kind = "poll"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.wakeups = 0
+
+    def wait(self, timeout: float) -> bool:
+        self.wakeups += 1
+        time.sleep(max(0.0, min(timeout, self.interval)))
+        return False
+
+    async def wait_async(self, timeout: float) -> bool:
+        self.wakeups += 1
+        await asyncio.sleep(max(0.0, min(timeout, self.interval)))
+        return False
+
+    def close(self):
+        pass
+
+
+class InotifyWaiter:
+    """
+    inotify watch on a directory. match(name) filters the entries we care
+    about (None = any). Until the directory exists, waits like PollWaiter and
+    retries the watch.
+    """
+    kind = "inotify"
+
+    def __init__(self, directory: str, match: Optional[Callable[[str], bool]] = None,
+                 poll_interval: float = 0.5, recheck: float = INOTIFY_RECHECK):
+        self.directory = os.path.abspath(directory)
+        self.match = match
+        self.poll_interval = poll_interval
+        self.recheck = recheck
+        self.wakeups = 0
+        self.events = 0
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self._add = libc.inotify_add_watch  # AttributeError on non-Linux libc
+        self._add.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, f"inotify_init1: {os.strerror(e)}")
+        self.fd = fd
+        self.wd: Optional[int] = None
+        self._poll = select.poll()
+        self._poll.register(fd, select.POLLIN)
+        self._watch()
+
+    def _watch(self) -> bool:
+        wd = self._add(self.fd, os.fsencode(self.directory), WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise OSError(e, f"inotify_add_watch {self.directory}: {os.strerror(e)}")
+        self.wd = wd
+        return True
+
+    def wait(self, timeout: float) -> bool:
+        """Blocks until a matching change or timeout; True if something changed."""
+        self.wakeups += 1
+        if self.wd is None and not self._watch():
+            time.sleep(max(0.0, min(timeout, self.poll_interval)))
+            return os.path.isdir(self.directory)
+        deadline = time.monotonic() + max(0.0, min(timeout, self.recheck))
+        while True:
+            ms = max(0, int((deadline - time.monotonic()) * 1000))
+            if not self._poll.poll(ms):
+                return False
+            if self._drain():
+                return True
+            # only other entries of the directory changed: keep waiting until the deadline
+
+    async def wait_async(self, timeout: float) -> bool:
+        """wait() for the event loop: the inotify fd is watched with add_reader instead of poll()."""
+        self.wakeups += 1
+        if self.wd is None and not self._watch():
+            await asyncio.sleep(max(0.0, min(timeout, self.poll_interval)))
+            return os.path.isdir(self.directory)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max(0.0, min(timeout, self.recheck))
+        while True:
+            if self._drain():
+                return True
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            ready = loop.create_future()
+            loop.add_reader(self.fd, lambda: ready.done() or ready.set_result(None))
+            try:
+                await asyncio.wait_for(ready, remaining)
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                loop.remove_reader(self.fd)
+
+    def _drain(self) -> bool:
+        relevant = False
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return relevant
+            off = 0
+            while off < len(buf):
+                _wd, mask, _cookie, n = _EVENT.unpack_from(buf, off)
+                name = buf[off + _EVENT.size: off + _EVENT.size + n].split(b"\0", 1)[0]
+                off += _EVENT.size + n
+                self.events += 1
+                if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    self.wd = None  # directory itself is gone; re-watch on the next wait()
+                    relevant = True
+                elif mask & IN_Q_OVERFLOW or self.match is None or self.match(os.fsdecode(name)):
+                    relevant = True
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def make_waiter(mode: str, directory: str, match: Optional[Callable[[str], bool]] = None,
+                poll_interval: float = 0.5):
+    """mode: auto | inotify | poll. auto falls back to polling if inotify cannot be set up."""
+    if mode == "poll":
+        return PollWaiter(poll_interval)
+    try:
+        return InotifyWaiter(directory, match, poll_interval)
+    except (OSError, AttributeError) as e:
+        if mode == "inotify":
+            raise
+        log.warning("inotify unavailable (%s); polling every %.2fs", e, poll_interval)
+        return PollWaiter(poll_interval)
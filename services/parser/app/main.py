@@ -1,18 +1,72 @@
 # services/parser/app/main.py
-import os, json
+import asyncio, os, json, zlib
+from collections import Counter
+from contextlib import asynccontextmanager
 from typing import List, Optional, Union
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
-from parser_normalizer import detect_and_parse
-from rules import RuleEngine  # <--- добавили
+from parser_normalizer import detect_and_parse_many, shutdown_pool, json_default, PARSE_POOL_MIN_BATCH, PARSE_SECONDS, STATS
+from metrics import CONTENT_TYPE, Exposition, by_label
+from rules import RuleEngine, RULES_RELOAD_INTERVAL  # <--- добавили
+from writer import JsonlWriter
+from syslog_listener import SyslogServer
+from segment_log import SegmentedLog
+from snapshot import Snapshotter
 
 OUT_FILE = os.environ.get("OUT_FILE", "/app/data/normalized.jsonl")
+OUT_DIR = os.environ.get("OUT_DIR", "/app/data/normalized")  # сегментированный журнал; пусто — пишем в OUT_FILE
 INC_FILE = os.environ.get("INC_FILE", "/app/data/incidents.jsonl")   # <--- добавили
+STREAM_BATCH_LINES = int(os.environ.get("STREAM_BATCH_LINES", "1000"))
+STREAM_MAX_CHUNK = int(os.environ.get("STREAM_MAX_CHUNK", str(1 << 20)))  # макс. кусок после gunzip
+STREAM_MAX_LINE = int(os.environ.get("STREAM_MAX_LINE", str(64 * 1024)))
 
-app = FastAPI(title="Log Receiver & Normalizer", version="1.2.0")
+writer = JsonlWriter(json_default=json_default)
+out_log = SegmentedLog(OUT_DIR) if OUT_DIR else None
+OUT_TARGET = OUT_DIR or OUT_FILE
+if out_log is not None:
+    writer.add_sink(OUT_TARGET, out_log)
+
+async def _watch_rules():
+    """Горячая перезагрузка правил: следим за mtime файла пакета."""
+    while True:
+        await asyncio.sleep(RULES_RELOAD_INTERVAL)
+        rule_engine.maybe_reload()
+
+async def _drain_reorder():
+    """Буфер переупорядочивания правил: если поток затих, выпускаем его, не дожидаясь новых событий."""
+    while True:
+        await asyncio.sleep(rule_engine.lateness)
+        alerts = rule_engine.drain(idle=rule_engine.lateness)
+        if alerts:
+            await writer.write(INC_FILE, alerts)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    snapshots.restore()  # окна и инциденты с прошлого запуска — до приёма событий
+    await writer.start()
+    await syslog.start()
+    await snapshots.start()
+    watcher = asyncio.create_task(_watch_rules()) if RULES_RELOAD_INTERVAL > 0 else None
+    drainer = asyncio.create_task(_drain_reorder()) if rule_engine.lateness > 0 else None
+    yield
+    for task in (watcher, drainer):
+        if task is not None:
+            task.cancel()
+    await syslog.stop()
+    alerts = rule_engine.drain()  # события из буфера переупорядочивания — в правила до снимка
+    if alerts:
+        await writer.write(INC_FILE, alerts)
+    await snapshots.stop()  # последний снимок, когда новых событий уже нет
+    await writer.stop()
+    shutdown_pool()
+
+app = FastAPI(title="Log Receiver & Normalizer", version="1.2.0", lifespan=lifespan)
 rule_engine = RuleEngine(max_keep=1000)  # <--- добавили
+LINES_RECEIVED: Counter = Counter()  # по источнику: http | syslog
+snapshots = Snapshotter(rule_engine)
 
 class IngestPayload(BaseModel):
     line: Optional[str] = None
@@ -20,7 +74,10 @@ class IngestPayload(BaseModel):
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "out_file": OUT_FILE, "inc_file": INC_FILE, "incidents_in_mem": len(rule_engine.recent_incidents)}
+    return {"status": "ok", "out_file": OUT_TARGET, "inc_file": INC_FILE, "incidents_in_mem": len(rule_engine.recent_incidents),
+            "writer": writer.stats(), "syslog": syslog.snapshot(),
+            "segments": out_log.stats() if out_log is not None else None,
+            "rules": rule_engine.stats(), "snapshot": snapshots.stats()}
 
 @app.get("/healthz")
 async def healthz():
@@ -28,9 +85,115 @@ async def healthz():
 
 @app.get("/incidents", response_class=JSONResponse)  # <--- добавили
 async def get_incidents(limit: int = 100):
-    items = list(rule_engine.recent_incidents)[-abs(limit):]
+    items = [_incident_json(a) for a in list(rule_engine.recent_incidents)[-abs(limit):]]
     return {"count": len(items), "items": items}
 
+@app.get("/rules")
+async def get_rules():
+    return {"path": rule_engine.rules_path, "error": rule_engine.rules_error,
+            "rules": [r.spec for r in rule_engine.rules]}
+
+@app.post("/rules/reload")
+async def reload_rules():
+    try:
+        return rule_engine.load_rules()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"rules reload failed: {e}")
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text format: разбор по форматам, правила, карты состояния, writer."""
+    m = Exposition()
+    m.metric("lines_received_total", "counter", "Raw lines received, by source", by_label("source", LINES_RECEIVED))
+    parsed = {f: n for f, n in STATS.items() if f != "unrecognized" and ":" not in f}
+    failed = {f.split(":")[0]: n for f, n in STATS.items() if f.endswith(":failed")}
+    m.metric("lines_parsed_total", "counter", "Lines parsed, by format", by_label("format", parsed))
+    m.metric("lines_failed_total", "counter",
+             "Lines a format sniffed but could not parse, by format; format=unrecognized - no format accepted the line",
+             by_label("format", {**failed, "unrecognized": STATS.get("unrecognized", 0)}))
+    m.histogram("parse_seconds", "Per-line parse time, by format",
+                [({"format": f}, h) for f, h in sorted(PARSE_SECONDS.items())])
+
+    rm = rule_engine.rule_metrics
+    m.metric("rule_fires_total", "counter", "Rule fires before incident aggregation",
+             [({"rule": rid}, v[2]) for rid, v in sorted(rm.items())])
+    m.metric("rule_evaluations_sampled_total", "counter",
+             f"Rule evaluations on every {rule_engine.metrics_sample}th event (timed sample)",
+             [({"rule": rid}, v[0]) for rid, v in sorted(rm.items())])
+    m.metric("rule_eval_seconds_sampled_total", "counter",
+             "Time spent evaluating the rule on sampled events; divide by evaluations for the mean",
+             [({"rule": rid}, float(v[1])) for rid, v in sorted(rm.items())])
+    st = rule_engine.stats()
+    maps = st["maps"]
+    m.metric("rule_live_keys", "gauge", "Keys held in the rule's window map",
+             [({"rule": rid}, st["live"]) for rid, st in sorted(maps.items())])
+    m.metric("rule_evicted_keys_total", "counter", "Keys evicted from the rule's window map",
+             [({"rule": rid, "reason": reason}, st[f"evicted_{reason}"])
+              for rid, st in sorted(maps.items()) for reason in ("idle", "cap")])
+    m.metric("rules_watermark_seconds", "gauge", "Max event time processed by the rules (epoch seconds)",
+             [(None, float(rule_engine.watermark))])
+    m.metric("rules_reorder_buffered", "gauge", "Events held in the reorder buffer", [(None, st["reorder_buffered"])])
+    m.metric("rules_reordered_total", "counter", "Events that arrived out of order within the allowed lateness",
+             [(None, st["reordered"])])
+    m.metric("rules_late_dropped_total", "counter", "Events dropped as later than the allowed lateness",
+             [(None, st["late_dropped"])])
+    alerts = st["alerts"]
+    m.metric("incidents_total", "counter", "Incidents emitted, by phase; suppressed - fires folded into an open incident",
+             [({"phase": p}, alerts[k]) for p, k in
+              (("open", "opened"), ("update", "updated"), ("close", "closed"), ("suppressed", "suppressed"))])
+    m.metric("incidents_open", "gauge", "Open aggregated incidents", [(None, alerts["open"])])
+
+    w = writer.stats()
+    m.metric("writer_queue_depth", "gauge", "Records waiting in the writer queue", [(None, w["queue_depth"])])
+    m.metric("writer_queue_max", "gauge", "Writer queue capacity", [(None, w["queue_max"])])
+    m.metric("writer_records_total", "counter", "Records written", [(None, w["records"])])
+    m.metric("writer_bytes_total", "counter", "Bytes written", [(None, w["bytes"])])
+    m.metric("writer_flushes_total", "counter", "Writer flushes", [(None, w["flushes"])])
+    m.metric("writer_errors_total", "counter", "Failed writes (path x flush) and unserializable records",
+             [(None, w["errors"])])
+    m.metric("writer_dropped_records_total", "counter", "Records lost to writer errors", [(None, w["dropped"])])
+    m.metric("syslog_messages_total", "counter", "Syslog messages by transport and outcome",
+             [({"transport": t, "outcome": k}, v) for t, st in sorted(syslog.stats.items())
+              for k, v in sorted(st.items()) if k != "connections"])
+    return Response(m.text(), media_type=CONTENT_TYPE)
+
+def _incident_json(inc: dict) -> dict:
+    ev = inc.get("base_event")
+    return {**inc, "base_event": ev.to_dict()} if hasattr(ev, "to_dict") else inc
+
+async def _handle_lines(raw_lines: List[str], source: str = "http"):
+    """Разбор + правила + постановка в writer. Возвращает (normalized, errors, alerts)."""
+    LINES_RECEIVED[source] += len(raw_lines)
+    # крупные пачки разбираем вне event loop (внутри — пул процессов), мелкие inline
+    if len(raw_lines) >= PARSE_POOL_MIN_BATCH:
+        parsed = await run_in_threadpool(detect_and_parse_many, raw_lines)
+    else:
+        parsed = detect_and_parse_many(raw_lines)
+
+    normalized, errors, new_alerts = [], [], []
+    for ok, obj in parsed:
+        if ok:
+            normalized.append(obj)
+            # правила – мгновенно
+            alerts = rule_engine.process(obj)
+            if alerts:
+                new_alerts.extend(alerts)
+        else:
+            errors.append(obj)
+
+    # запись на диск — фоновым writer'ом пачками
+    if normalized:
+        await writer.write(OUT_TARGET, normalized)
+    if new_alerts:
+        await writer.write(INC_FILE, new_alerts)
+    return normalized, errors, new_alerts
+
+# syslog по UDP/TCP идёт в тот же конвейер, минуя HTTP
+async def _handle_syslog(raw_lines: List[str]):
+    return await _handle_lines(raw_lines, "syslog")
+
+syslog = SyslogServer(handler=_handle_syslog)
+
 @app.post("/ingest", response_class=JSONResponse)
 async def ingest(payload: Union[IngestPayload, None] = None, request: Request = None):
     raw_lines: List[str] = []
@@ -54,37 +217,125 @@ async def ingest(payload: Union[IngestPayload, None] = None, request: Request =
         else:
             raise HTTPException(status_code=400, detail="Need 'line' or 'lines'")
 
-    normalized, errors, new_alerts = [], [], []
-    for l in raw_lines:
-        ok, obj = detect_and_parse(l)
-        if ok:
-            normalized.append(obj)
-            # правила – мгновенно
-            alerts = rule_engine.process(obj)
-            if alerts:
-                new_alerts.extend(alerts)
-        else:
-            errors.append(obj)
-
-    if normalized:
-        os.makedirs(os.path.dirname(OUT_FILE), exist_ok=True)
-        with open(OUT_FILE, "a", encoding="utf-8") as f:
-            for obj in normalized:
-                f.write(json.dumps(obj, ensure_ascii=False) + "\n")
-
-    if new_alerts:
-        os.makedirs(os.path.dirname(INC_FILE), exist_ok=True)
-        with open(INC_FILE, "a", encoding="utf-8") as f:
-            for inc in new_alerts:
-                f.write(json.dumps(inc, ensure_ascii=False) + "\n")
+    normalized, errors, new_alerts = await _handle_lines(raw_lines)
 
     return {
         "received": len(raw_lines),
         "saved": len(normalized),
         "errors": len(errors),
         "alerts": len(new_alerts),
-        "sample": normalized[:2],
+        "sample": [ev.to_dict() for ev in normalized[:2]],
         "errors_sample": errors[:2],
-        "out_file": OUT_FILE,
+        "out_file": OUT_TARGET,
         "inc_file": INC_FILE
     }
+
+def _ndjson_line(raw: str):
+    """Строка NDJSON: {"line": "..."} или просто JSON-строка. None — если не разобрали."""
+    try:
+        v = json.loads(raw)
+    except ValueError:
+        return None
+    if isinstance(v, dict):
+        v = v.get("line")
+    return v if isinstance(v, str) else None
+
+@app.post("/ingest/stream", response_class=JSONResponse)
+async def ingest_stream(request: Request):
+    """
+    Потоковый приём: text/plain (строка лога на строку) или application/x-ndjson.
+    Тело разбирается по мере поступления чанков пачками по STREAM_BATCH_LINES,
+    в памяти держим только текущую пачку. Поддерживается Content-Encoding: gzip.
+    """
+    ctype = (request.headers.get("content-type") or "").split(";")[0].strip().lower()
+    ndjson = ctype in ("application/x-ndjson", "application/jsonl", "application/json")
+    encoding = (request.headers.get("content-encoding") or "").strip().lower()
+    if encoding not in ("", "identity", "gzip"):
+        raise HTTPException(status_code=415, detail=f"unsupported content-encoding: {encoding}")
+    gz = zlib.decompressobj(16 + zlib.MAX_WBITS) if encoding == "gzip" else None
+
+    summary = {"received": 0, "saved": 0, "errors": 0, "alerts": 0, "bytes_in": 0}
+    errors_sample: List[dict] = []
+    pending: List[str] = []
+    tail = b""
+    skipping = False  # дочитываем до \n строку, превысившую STREAM_MAX_LINE
+
+    async def flush():
+        normalized, errors, alerts = await _handle_lines(pending)
+        summary["saved"] += len(normalized)
+        summary["errors"] += len(errors)
+        summary["alerts"] += len(alerts)
+        errors_sample.extend(errors[:2 - len(errors_sample)])
+        pending.clear()
+
+    def reject(kind: str, raw: bytes):
+        summary["received"] += 1
+        summary["errors"] += 1
+        if len(errors_sample) < 2:
+            errors_sample.append({"error": kind, "raw": raw[:200].decode("utf-8", errors="ignore")})
+
+    def take(line_bytes: bytes):
+        if len(line_bytes) > STREAM_MAX_LINE:
+            reject("line_too_long", line_bytes)
+            return
+        text = line_bytes.decode("utf-8", errors="ignore").rstrip("\r")
+        if not text.strip():
+            return
+        if ndjson:
+            line = _ndjson_line(text)
+            if line is None:
+                reject("invalid_ndjson", line_bytes)
+                return
+            text = line
+        summary["received"] += 1
+        pending.append(text)
+
+    def decoded(chunk: bytes):
+        # max_length не даёт маленькому gzip-чанку раздуться в память целиком
+        if gz is None:
+            yield chunk
+            return
+        data = gz.decompress(chunk, STREAM_MAX_CHUNK)
+        while data:
+            yield data
+            data = gz.decompress(gz.unconsumed_tail, STREAM_MAX_CHUNK) if gz.unconsumed_tail else b""
+
+    def split(data: bytes) -> List[bytes]:
+        """Добавляет данные к хвосту и возвращает строки, для которых уже пришёл перевод строки."""
+        nonlocal tail, skipping
+        parts = (tail + data).split(b"\n")
+        tail = parts.pop()
+        if skipping:
+            if not parts:
+                tail = b""  # всё ещё внутри слишком длинной строки
+                return []
+            parts.pop(0)
+            skipping = False
+        if len(tail) > STREAM_MAX_LINE:
+            reject("line_too_long", tail)
+            tail = b""
+            skipping = True
+        return parts
+
+    async def feed(data: bytes):
+        for p in split(data):
+            take(p)
+            if len(pending) >= STREAM_BATCH_LINES:
+                await flush()
+
+    try:
+        async for chunk in request.stream():
+            summary["bytes_in"] += len(chunk)
+            for data in decoded(chunk):
+                await feed(data)
+        if gz is not None:
+            await feed(gz.flush())
+    except zlib.error as e:
+        raise HTTPException(status_code=400, detail=f"gzip decompress failed: {e}")
+
+    if tail and not skipping:
+        take(tail)
+    if pending:
+        await flush()
+
+    return {**summary, "errors_sample": errors_sample, "out_file": OUT_TARGET, "inc_file": INC_FILE}
@@ -0,0 +1,106 @@
+# services/parser/app/metrics.py
+"""
+Метрики парсера в текстовом формате Prometheus (GET /metrics), без внешних зависимостей.
+
+Горячий путь только увеличивает счётчики и корзины гистограмм; текст собирается
+при запросе /metrics из счётчиков модулей (parser_normalizer, rules, writer).
+"""
+import os
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+# сек; разбор строки — единицы-десятки мкс, хвост — до миллисекунд
+PARSE_BUCKETS = (5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 5e-3, 1e-2)
+# время правил меряем на каждом N-м событии (0 — не меряем): perf_counter на правило заметен на фоне самого правила
+METRICS_RULE_SAMPLE = int(os.environ.get("METRICS_RULE_SAMPLE", "16"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Mapping[str, object]
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами; counts[i] — попадания в (bounds[i-1], bounds[i]], последняя — +Inf."""
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Sequence[float] = PARSE_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, v: float):
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.sum += v
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.sum = 0.0
+
+    def state(self) -> Tuple[List[int], float]:
+        return list(self.counts), self.sum
+
+    def merge(self, state: Tuple[List[int], float]):
+        """Добавляет state() другой гистограммы (из воркера пула) с теми же границами."""
+        counts, total = state
+        mine = self.counts
+        for i, c in enumerate(counts):
+            mine[i] += c
+        self.sum += total
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+
+def _escape(v: object) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Optional[Labels]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _num(v: float) -> str:
+    if isinstance(v, float):
+        if v == float("inf"):
+            return "+Inf"
+        return repr(v)
+    return str(int(v))
+
+
+class Exposition:
+    """Сборка ответа /metrics: metric() — семейство с HELP/TYPE и сэмплами."""
+
+    def __init__(self, prefix: str = "parser_"):
+        self.prefix = prefix
+        self.lines: List[str] = []
+
+    def metric(self, name: str, kind: str, help: str, samples: Iterable[Tuple[Optional[Labels], float]]):
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{_labels(labels)} {_num(value)}")
+
+    def histogram(self, name: str, help: str, hists: Iterable[Tuple[Optional[Labels], Histogram]]):
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, h in hists:
+            labels = dict(labels or {})
+            acc = 0
+            for bound, c in zip(h.bounds + (float("inf"),), h.counts):
+                acc += c
+                self.lines.append(f"{name}_bucket{_labels({**labels, 'le': _num(float(bound))})} {acc}")
+            self.lines.append(f"{name}_sum{_labels(labels)} {_num(float(h.sum))}")
+            self.lines.append(f"{name}_count{_labels(labels)} {acc}")
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def by_label(label: str, values: Mapping[str, float]) -> List[Tuple[Dict[str, str], float]]:
+    """{'auth': 3, 'fw': 5} -> [({label: 'auth'}, 3), ...] в порядке ключей."""
+    return [({label: k}, v) for k, v in sorted(values.items())]
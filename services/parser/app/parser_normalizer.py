@@ -1,6 +1,14 @@
-import re, uuid, json
+import os, re, sys, time, uuid, json, random, threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
 from datetime import datetime, timezone
-import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from event import NormalizedEvent, json_default  # noqa: F401  (реэкспорт)
+from metrics import Histogram
+
+_intern = sys.intern
 
 AUTH_RE = re.compile(
     r'^(?P<mon>[A-Z][a-z]{2})\s+(?P<day>\d{1,2})\s+(?P<time>\d{2}:\d{2}:\d{2})\s+'
@@ -24,121 +32,375 @@ APP_RE = re.compile(
     r'(?P<message>.*)$'
 )
 
+# Пакетный разбор: большие пачки режем на чанки и раздаём по процессам
+PARSE_POOL_WORKERS = int(os.environ.get("PARSE_POOL_WORKERS", str(os.cpu_count() or 1)))  # 0 = без пула
+PARSE_POOL_MIN_BATCH = int(os.environ.get("PARSE_POOL_MIN_BATCH", "5000"))  # меньше — разбираем inline
+PARSE_POOL_CHUNK = int(os.environ.get("PARSE_POOL_CHUNK", "2000"))
+
+# Генерация event_id: uuid4 (случайный, как раньше), uuid7 (UUIDv7: время в старших битах,
+# монотонный в пределах процесса) или snowflake (64-бит: время|узел|счётчик, строкой).
+EVENT_ID_MODE = os.environ.get("EVENT_ID_MODE", "uuid7")
+# Узел snowflake 0..1023. Воркеры пула разбора (PARSE_POOL_WORKERS) берут EVENT_ID_NODE+1,
+# +2, ... (_init_worker), поэтому у разных экземпляров парсера EVENT_ID_NODE должны отличаться
+# больше, чем на PARSE_POOL_WORKERS, иначе их id пересекутся (детектор молча отбросит дубли).
+EVENT_ID_NODE = int(os.environ.get("EVENT_ID_NODE", str(os.getpid() & 0x3FF)))
+
 MONTHS = {'Jan':1,'Feb':2,'Mar':3,'Apr':4,'May':5,'Jun':6,'Jul':7,'Aug':8,'Sep':9,'Oct':10,'Nov':11,'Dec':12}
 
-def _iso_ts_from_syslog(mon: str, day: str, hhmmss: str) -> str:
-    """'Sep 20 12:01:33' -> ISO-8601 UTC (берём текущий год)."""
-    year = datetime.now(timezone.utc).year
+# Кэш разбора времени с точностью до секунды: строки одной пачки почти всегда
+# приходятся на одну и ту же секунду. Значение — (ISO-8601, epoch ms).
+TS_CACHE_MAX = int(os.environ.get("TS_CACHE_MAX", "4096"))
+_ts_cache: Dict[str, Tuple[str, int]] = {}
+_syslog_year = 0
+_syslog_year_checked = 0.0
+
+def _cache_ts(key: str, value: Tuple[str, int]) -> Tuple[str, int]:
+    if len(_ts_cache) >= TS_CACHE_MAX:
+        _ts_cache.clear()
+    _ts_cache[key] = value
+    return value
+
+def _now_ts() -> Tuple[str, int]:
+    now = datetime.now(timezone.utc)
+    return now.isoformat(), int(now.timestamp() * 1000)
+
+def _current_year() -> int:
+    """Год для syslog-времени; сверяемся с часами не чаще раза в минуту."""
+    global _syslog_year, _syslog_year_checked
+    mono = time.monotonic()
+    if mono - _syslog_year_checked > 60.0:
+        year = datetime.now(timezone.utc).year
+        if year != _syslog_year:
+            _ts_cache.clear()  # ключи syslog без года — на смене года сбрасываем
+            _syslog_year = year
+        _syslog_year_checked = mono
+    return _syslog_year
+
+def _syslog_ts(mon: str, day: str, hhmmss: str) -> Tuple[str, int]:
+    """'Sep 20 12:01:33' -> (ISO-8601 UTC, epoch ms), берём текущий год."""
+    year = _current_year()
+    key = f"{mon} {day} {hhmmss}"
+    hit = _ts_cache.get(key)
+    if hit is not None:
+        return hit
     try:
         dt = datetime(year, MONTHS[mon], int(day),
                       int(hhmmss[0:2]), int(hhmmss[3:5]), int(hhmmss[6:8]),
                       tzinfo=timezone.utc)
-        return dt.isoformat()
     except Exception:
-        return datetime.now(timezone.utc).isoformat()
+        return _now_ts()
+    return _cache_ts(key, (dt.isoformat(), int(dt.timestamp()) * 1000))
+
+def _fw_ts(ts: str) -> Tuple[str, int]:
+    """'2025-09-20T12:02:10Z' -> (та же строка, epoch ms)."""
+    hit = _ts_cache.get(ts)
+    if hit is not None:
+        return hit
+    try:
+        dt = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    except Exception:
+        return _now_ts()
+    return _cache_ts(ts, (ts, int(dt.timestamp()) * 1000))
+
+def _app_ts(ts: str) -> Tuple[str, int]:
+    """'2025-09-20 12:02:10,123' -> ('2025-09-20T12:02:10.123000+00:00', epoch ms)."""
+    sec, _, frac = ts.rpartition(",")
+    hit = _ts_cache.get(sec)
+    if hit is None:
+        try:
+            dt = datetime.strptime(sec, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+        except Exception:
+            return _now_ts()
+        # в кэше ISO без смещения: миллисекунды у каждой строки свои
+        hit = _cache_ts(sec, (dt.isoformat()[:-6], int(dt.timestamp()) * 1000))
+    base, epoch_ms = hit
+    ms = int(frac)
+    if ms:
+        return f"{base}.{ms:03d}000+00:00", epoch_ms + ms
+    return base + "+00:00", epoch_ms
+
+_getrandbits = random.getrandbits
+_id_last_ms = 0
+_id_seq = 0
+_id_lock = threading.Lock()
+
+def _next_ms_seq(seq_bits: int) -> Tuple[int, int]:
+    """(ms, счётчик) монотонно внутри процесса; при переполнении счётчика занимаем следующую ms."""
+    global _id_last_ms, _id_seq
+    with _id_lock:  # detect_and_parse_many может идти из threadpool параллельно с event loop
+        ms = time.time_ns() // 1_000_000
+        if ms <= _id_last_ms:
+            ms = _id_last_ms
+            _id_seq += 1
+            if _id_seq >> seq_bits:
+                ms += 1
+                _id_seq = 0
+        else:
+            _id_seq = 0
+        _id_last_ms = ms
+        return ms, _id_seq
+
+def _uuid7() -> str:
+    """UUIDv7 (RFC 9562): 48 бит unix ms | ver | 12 бит счётчика | var | 62 случайных бита."""
+    ms, seq = _next_ms_seq(12)
+    h = "%016x%016x" % ((ms << 16) | 0x7000 | seq, 0x8000000000000000 | _getrandbits(62))
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+SNOWFLAKE_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+
+def _snowflake() -> str:
+    """41 бит ms от SNOWFLAKE_EPOCH_MS | 10 бит узла | 12 бит счётчика; строкой, чтобы JS не терял точность."""
+    ms, seq = _next_ms_seq(12)
+    return str(((ms - SNOWFLAKE_EPOCH_MS) << 22) | ((EVENT_ID_NODE & 0x3FF) << 12) | seq)
+
+def _uuid4() -> str:
+    return str(uuid.uuid4())
+
+EVENT_ID_GENERATORS: Dict[str, Callable[[], str]] = {"uuid4": _uuid4, "uuid7": _uuid7, "snowflake": _snowflake}
+if EVENT_ID_MODE not in EVENT_ID_GENERATORS:
+    raise ValueError(f"EVENT_ID_MODE must be one of {sorted(EVENT_ID_GENERATORS)}, got {EVENT_ID_MODE!r}")
+new_event_id = EVENT_ID_GENERATORS[EVENT_ID_MODE]
+
+# Маскирование секретов: правила вида "<ключ> = <значение>" -> "<ключ>=***".
+# keys — regex-альтернативы имени ключа, value — regex значения (без именованных групп),
+# literals — подстроки в нижнем регистре, без которых правило сработать не может
+# (префильтр; если не заданы, берутся keys, когда это обычные строки).
+# MASK_RULES_FILE — JSON-список таких правил: добавляются к встроенным,
+# правило с тем же name заменяет встроенное.
+MASK_RULES_FILE = os.environ.get("MASK_RULES_FILE", "")
+
+DEFAULT_MASK_RULES: List[dict] = [
+    {"name": "password", "keys": ["password", "passwd", "pwd"], "value": r"\S+"},
+    {"name": "token", "keys": ["api[_-]?key", "token", "secret"], "literals": ["api", "token", "secret"],
+     "value": r"[A-Za-z0-9_\-]{6,}"},
+]
+
+_LITERAL_RE = re.compile(r'^[a-z0-9_]+$')
+
+def compile_mask_rules(rules: List[dict]) -> Tuple[Optional["re.Pattern"], Optional[Tuple[str, ...]]]:
+    """
+    Собирает правила в одну альтернацию (один проход по строке) и набор
+    литералов для префильтра. Литералы None — префильтр невозможен, regex гоняем всегда.
+    """
+    parts: List[str] = []
+    literals: Optional[set] = set()
+    for r in rules:
+        keys, value = r.get("keys"), r.get("value")
+        if not keys or not value:
+            raise ValueError(f"mask rule {r.get('name')!r}: need 'keys' and 'value'")
+        keys_re = "|".join(keys)
+        try:
+            re.compile(f"({keys_re})\\s*=\\s*(?:{value})")
+        except re.error as e:
+            raise ValueError(f"mask rule {r.get('name')!r}: {e}") from None
+        # внешняя группа закрывается последней -> m.lastindex указывает на неё,
+        # а ключ — следующая за ней группа
+        parts.append(f"(({keys_re})\\s*=\\s*(?:{value}))")
+        lits = r.get("literals")
+        if not lits and all(_LITERAL_RE.match(k.lower()) for k in keys):
+            lits = keys
+        if lits and literals is not None:
+            literals.update(x.lower() for x in lits)
+        else:
+            literals = None
+    if not parts:
+        return None, ()
+    return re.compile("|".join(parts), re.I), (tuple(sorted(literals)) if literals is not None else None)
+
+def load_mask_rules(path: str = MASK_RULES_FILE) -> List[dict]:
+    rules = {r["name"]: r for r in DEFAULT_MASK_RULES}
+    if path:
+        with open(path, encoding="utf-8") as fh:
+            for i, r in enumerate(json.load(fh)):
+                rules[r.get("name") or f"custom_{i}"] = r
+    return list(rules.values())
+
+_MASK_RE, _MASK_LITERALS = compile_mask_rules(load_mask_rules())
+
+def set_mask_rules(rules: List[dict]):
+    """Подменяет набор правил маскирования (в т.ч. пустой — маскирование выключено)."""
+    global _MASK_RE, _MASK_LITERALS
+    _MASK_RE, _MASK_LITERALS = compile_mask_rules(rules)
+
+def _mask_repl(m: "re.Match") -> str:
+    return m.group(m.lastindex + 1) + "=***"
 
 def _mask_secrets(text: str) -> str:
     """Маскирование возможных секретов в message (на всякий)."""
-    if not text:
+    if not text or _MASK_RE is None or "=" not in text:
         return text
-    text = re.sub(r'(password|passwd|pwd)\s*=\s*\S+', r'\1=***', text, flags=re.I)
-    text = re.sub(r'(api[_-]?key|token|secret)\s*=\s*[A-Za-z0-9_\-]{6,}', r'\1=***', text, flags=re.I)
-    return text
+    lits = _MASK_LITERALS
+    if lits is not None:
+        low = text.lower()
+        for lit in lits:
+            if lit in low:
+                break
+        else:
+            return text
+    return _MASK_RE.sub(_mask_repl, text)
+
+def _parse_auth(line: str):
+    m = AUTH_RE.match(line)
+    if not m:
+        return None
+    d = m.groupdict()
+    ts, ts_ms = _syslog_ts(d['mon'], d['day'], d['time'])
+    outcome = 'failed' if d['verb'] == 'Failed' else 'success'
+    return NormalizedEvent(
+        new_event_id(), ts, ts_ms,
+        d['src_ip'], int(d['src_port']), None, 22,
+        d['user'], "auth-service", "syslog", "auth", "login", outcome,
+        _mask_secrets(line), "ssh",
+    )
+
+def _parse_fw(line: str):
+    m = FW_RE.match(line)
+    if not m:
+        return None
+    d = m.groupdict()
+    ts, ts_ms = _fw_ts(d['ts'])
+    action = _intern(d['action'].lower())
+    outcome = 'success' if action == 'allow' else 'blocked'
+    return NormalizedEvent(
+        new_event_id(), ts, ts_ms,
+        d['src_ip'], int(d['src_port']), d['dst_ip'], int(d['dst_port']),
+        None, "firewall", "firewall", "network", action, outcome,
+        _mask_secrets(line), _intern(d['proto'].lower()),
+    )
+
+def _parse_app(line: str):
+    m = APP_RE.match(line)
+    if not m:
+        return None
+    d = m.groupdict()
+    ts_iso, ts_ms = _app_ts(d['ts'])
+    level = _intern(d['level'])
+    is_err = level == 'ERROR'
+    return NormalizedEvent(
+        new_event_id(), ts_iso, ts_ms,
+        None, None, None, None,
+        None, _intern(d['service']), "app",
+        "app_error" if is_err else "app_log",
+        "exception" if is_err else _intern(level.lower()),
+        "error" if is_err else "info",
+        _mask_secrets(d['message']), None,
+        metadata={"component": _intern(d['component']), "level": level},
+    )
+
+# Дешёвые проверки "формы" строки — по ним выбираем единственную регулярку.
+def _looks_syslog(line: str) -> bool:
+    """'Sep 20 12:01:33 ...' — ведущий токен месяца (за ним любой пробельный символ, как \\s+ в AUTH_RE)."""
+    return len(line) > 4 and line[3].isspace() and line[:3] in MONTHS
+
+def _looks_iso_z(line: str) -> bool:
+    """'2025-09-20T12:02:10Z ...'"""
+    return len(line) > 20 and line[19] == 'Z' and line[10] == 'T' and line[4] == '-'
+
+def _looks_app(line: str) -> bool:
+    """'2025-09-20 12:02:10,123 ...' — только дата и пробельный символ: между датой и
+    временем APP_RE допускает \\s+ (двойной пробел, таб), остальное решает регулярка."""
+    return len(line) > 10 and line[4] == '-' and line[7] == '-' and line[10].isspace()
+
+# Реестр форматов: (имя, sniff, parse). Порядок = приоритет.
+# sniff — проверка по префиксу без регулярок, parse возвращает NormalizedEvent или None.
+FORMATS: List[Tuple[str, Callable[[str], bool], Callable[[str], Optional[NormalizedEvent]], Histogram]] = []
+
+# время разбора строки по форматам, сек (для /metrics); "unrecognized" — строки, не принятые никем
+PARSE_SECONDS: Dict[str, Histogram] = {"unrecognized": Histogram()}
+
+def register_format(name: str, sniff: Callable[[str], bool], parse: Callable[[str], Optional[NormalizedEvent]]):
+    """Добавляет формат в реестр (имя используется как ключ счётчика в STATS и метки в /metrics)."""
+    h = PARSE_SECONDS[name] = Histogram()
+    FORMATS.append((name, sniff, parse, h))
+
+# fw первым: это основной поток по объёму, его строка проходит одну проверку формы
+register_format("fw", _looks_iso_z, _parse_fw)
+register_format("auth", _looks_syslog, _parse_auth)
+register_format("app", _looks_app, _parse_app)
+
+# Счётчики разбора вместо print/logging на каждую строку: {"auth": N, ..., "unrecognized": M};
+# "<формат>:failed" — строка прошла sniff формата, но его разбор её не принял
+STATS: Counter = Counter()
+_perf = time.perf_counter
+_unrecognized_seconds = PARSE_SECONDS["unrecognized"]
+
+def parse_stats() -> Dict[str, int]:
+    return dict(STATS)
+
 
 def detect_and_parse(line: str):
     """
     Возвращает кортеж (ok: bool, obj: dict).
-    ok=True -> obj = нормализованное событие
+    ok=True -> obj = нормализованное событие (NormalizedEvent, в dict — obj.to_dict())
     ok=False -> obj = {"error":"unrecognized_format","raw":...}
     """
     line = (line or "").rstrip("\n")
+    t0 = _perf()
 
-    m = AUTH_RE.match(line)
-    if m:
-        logging.info("Auth")
-        print("auth")
-        d = m.groupdict()
-        ts = _iso_ts_from_syslog(d['mon'], d['day'], d['time'])
-        outcome = 'failed' if d['verb'] == 'Failed' else 'success'
-        return True, {
-            "event_id": str(uuid.uuid4()),
-            "ts": ts,
-            "source_ip": d['src_ip'],
-            "source_port": int(d['src_port']),
-            "dest_ip": None,
-            "dest_port": 22,
-            "user": d['user'],
-            "service": "auth-service",
-            "sensor": "syslog",
-            "event_type": "auth",
-            "action": "login",
-            "outcome": outcome,
-            "message": _mask_secrets(line),
-            "protocol": "ssh",
-            "bytes": None,
-            "scenario": None,
-            "metadata": {}
-        }
+    for name, sniff, parse, seconds in FORMATS:
+        if sniff(line):
+            obj = parse(line)
+            if obj is not None:
+                STATS[name] += 1
+                seconds.observe(_perf() - t0)
+                return True, obj
+            STATS[name + ":failed"] += 1
 
-    m = FW_RE.match(line)
-    if m:
-        logging.info("fw")
-        print("fw")
-        d = m.groupdict()
-        action = d['action'].lower()        
-        outcome = 'success' if action == 'allow' else 'blocked'
-        return True, {
-            "event_id": str(uuid.uuid4()),
-            "ts": d['ts'],
-            "source_ip": d['src_ip'],
-            "source_port": int(d['src_port']),
-            "dest_ip": d['dst_ip'],
-            "dest_port": int(d['dst_port']),
-            "user": None,
-            "service": "firewall",
-            "sensor": "firewall",
-            "event_type": "network",
-            "action": action,
-            "outcome": outcome,
-            "message": _mask_secrets(line),
-            "protocol": d['proto'].lower(),  
-            "bytes": None,
-            "scenario": None,
-            "metadata": {}
-        }
+    STATS["unrecognized"] += 1
+    _unrecognized_seconds.observe(_perf() - t0)
+    return False, {"error": "unrecognized_format", "raw": line}
 
-    m = APP_RE.match(line)
-    if m:
-        logging.info("app")
-        d = m.groupdict()
-        try:
-            ts_iso = datetime.strptime(d['ts'], "%Y-%m-%d %H:%M:%S,%f").replace(tzinfo=timezone.utc).isoformat()
-        except Exception:
-            ts_iso = datetime.now(timezone.utc).isoformat()
-        return True, {
-            "event_id": str(uuid.uuid4()),
-            "ts": ts_iso,
-            "source_ip": None,
-            "source_port": None,
-            "dest_ip": None,
-            "dest_port": None,
-            "user": None,
-            "service": d['service'],
-            "sensor": "app",
-            "event_type": "app_error" if d['level'] == 'ERROR' else "app_log",
-            "action": "exception" if d['level'] == 'ERROR' else d['level'].lower(),
-            "outcome": "error" if d['level'] == 'ERROR' else "info",
-            "message": _mask_secrets(d['message']),
-            "protocol": None,
-            "bytes": None,
-            "scenario": None,
-            "metadata": {"component": d['component'], "level": d['level']}
-        }
+_pool: Optional[ProcessPoolExecutor] = None
 
-    return False, {"error": "unrecognized_format", "raw": line}
+def _init_worker(base_node: int, started):
+    """Свой узел snowflake каждому воркеру: base_node+1, +2, ... по порядку запуска."""
+    global EVENT_ID_NODE
+    with started.get_lock():
+        started.value += 1
+        EVENT_ID_NODE = (base_node + started.value) & 0x3FF
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: форк процесса с живым event loop / потоками uvicorn небезопасен
+        ctx = mp.get_context("spawn")
+        _pool = ProcessPoolExecutor(max_workers=PARSE_POOL_WORKERS, mp_context=ctx, initializer=_init_worker,
+                                    initargs=(EVENT_ID_NODE, ctx.Value("i", 0)))
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+def _parse_chunk(lines: List[str]):
+    """Выполняется в воркере: результаты чанка + счётчики и гистограммы, набежавшие на нём."""
+    STATS.clear()
+    for h in PARSE_SECONDS.values():
+        h.reset()
+    results = [detect_and_parse(l) for l in lines]
+    return results, dict(STATS), {name: h.state() for name, h in PARSE_SECONDS.items()}
+
+def detect_and_parse_many(lines: List[str]) -> List[Tuple[bool, object]]:
+    """
+    Пакетный вариант detect_and_parse, порядок результатов совпадает с lines.
+    Пачки от PARSE_POOL_MIN_BATCH строк режутся по PARSE_POOL_CHUNK и уходят
+    в пул процессов; мелкие разбираются в текущем процессе.
+    """
+    if PARSE_POOL_WORKERS <= 0 or len(lines) < PARSE_POOL_MIN_BATCH:
+        return [detect_and_parse(l) for l in lines]
+
+    chunks = [lines[i:i + PARSE_POOL_CHUNK] for i in range(0, len(lines), PARSE_POOL_CHUNK)]
+    out: List[Tuple[bool, object]] = []
+    for results, stats, hists in _get_pool().map(_parse_chunk, chunks):
+        out.extend(results)
+        STATS.update(stats)
+        for name, state in hists.items():
+            PARSE_SECONDS[name].merge(state)
+    return out
 
 if __name__ == "__main__":
-    import sys
     for raw in sys.stdin:
         ok, obj = detect_and_parse(raw)
-        print(json.dumps(obj, ensure_ascii=False))
+        print(json.dumps(obj, ensure_ascii=False, default=json_default))
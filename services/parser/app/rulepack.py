@@ -0,0 +1,253 @@
+# services/parser/app/rulepack.py
+"""
+Декларативные правила (YAML/JSON) и их компиляция в таблицу диспетчеризации.
+
+Формат пакета:
+    version: 1
+    lists:                       # именованные списки, в условиях — "@имя"
+      critical_ports: [22, 23]
+    rules:
+      - id: ssh_bruteforce
+        type: count              # match | count | distinct
+        severity: high
+        event_types: [auth]      # по ним строится индекс; пусто — правило для всех событий
+        where: {protocol: ssh, outcome: failed}
+        key: [source_ip]         # ключ окна и агрегации инцидентов; None в поле ключа — правило пропускаем
+        window: 60               # сек (count / distinct)
+        threshold: 5             # срабатывает при значении >= threshold
+        title: "Много неудачных входов по SSH: {count} за 60с"
+        extra: {count_60s: count}
+
+Условия (where — все сразу, any — хотя бы одно из where-словарей):
+    поле: значение     — равенство (строки без учёта регистра)
+    поле: [a, b]       — одно из; "@список" — именованный список
+    поле: {contains: [..]} — подстрока (с учётом регистра); {exists: true|false}
+    поле через точку — вложенное: metadata.level
+count: count_if — какие события из where считать (по умолчанию все),
+       fire_if — на каких проверять порог (по умолчанию на посчитанных).
+distinct: distinct — поле, различные значения которого считаем за окно.
+signatures: {field: message, file: signatures/payload.txt} — после where ищем в поле
+       все сигнатуры файла (signatures.py, Ахо—Корасик); нет ни одной — правило не срабатывает.
+       Путь относительно файла пакета. Файл отслеживается и пересобирается в фоне.
+В title/extra доступны count, signatures (сработавшие имена) и поля события.
+"""
+import json, os
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from signatures import SignatureSet, signature_set
+
+RULE_TYPES = ("match", "count", "distinct")
+
+Predicate = Callable[[Any], bool]
+
+
+class RuleError(ValueError):
+    pass
+
+
+def load_pack(path: str) -> dict:
+    with open(path, encoding="utf-8") as fh:
+        text = fh.read()
+    try:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            pack = yaml.safe_load(text)
+        else:
+            pack = json.loads(text)
+    except Exception as e:  # json / yaml.YAMLError
+        raise RuleError(f"{path}: {e}") from None
+    if isinstance(pack, list):
+        pack = {"rules": pack}
+    if not isinstance(pack, dict) or not isinstance(pack.get("rules"), list):
+        raise RuleError(f"{path}: expected a mapping with a 'rules' list")
+    return pack
+
+
+def field_getter(name: str) -> Callable[[Any], Any]:
+    if "." not in name:
+        return lambda ev: ev.get(name)
+    head, *rest = name.split(".")
+
+    def get(ev):
+        v = ev.get(head)
+        for part in rest:
+            if not isinstance(v, dict):
+                return None
+            v = v.get(part)
+        return v
+    return get
+
+
+def _norm(v):
+    return v.lower() if isinstance(v, str) else v
+
+
+def _resolve(spec: Any, lists: Dict[str, Any]) -> Any:
+    """"@имя" -> именованный список."""
+    if isinstance(spec, str) and spec.startswith("@"):
+        if spec[1:] not in lists:
+            raise RuleError(f"unknown list {spec}")
+        return list(lists[spec[1:]])
+    return spec
+
+
+def _condition(field: str, spec: Any, lists: Dict[str, Any]) -> Predicate:
+    get = field_getter(field)
+    spec = _resolve(spec, lists)
+    if isinstance(spec, dict):
+        if set(spec) == {"contains"}:
+            needles = _resolve(spec["contains"], lists)
+            needles = tuple(needles) if isinstance(needles, list) else (needles,)
+
+            def contains(ev):
+                v = get(ev)
+                return v is not None and any(s in str(v) for s in needles)
+            return contains
+        if set(spec) == {"exists"}:
+            want = bool(spec["exists"])
+            return lambda ev: (get(ev) not in (None, "")) == want
+        raise RuleError(f"{field}: unknown condition {spec}")
+    if isinstance(spec, (list, tuple, set, frozenset)):
+        allowed = frozenset(_norm(x) for x in spec)
+        return lambda ev: _norm(get(ev)) in allowed
+    want = _norm(spec)
+    return lambda ev: _norm(get(ev)) == want
+
+
+def _all(preds: List[Predicate]) -> Optional[Predicate]:
+    if not preds:
+        return None
+    if len(preds) == 1:
+        return preds[0]
+
+    def pred(ev):
+        for p in preds:
+            if not p(ev):
+                return False
+        return True
+    return pred
+
+
+def compile_where(where: Optional[dict], any_of: Optional[list], lists: Dict[str, Any]) -> Optional[Predicate]:
+    preds = [_condition(f, spec, lists) for f, spec in (where or {}).items()]
+    if any_of:
+        alts = [compile_where(w, None, lists) or (lambda ev: True) for w in any_of]
+        preds.append(lambda ev: any(p(ev) for p in alts))
+    return _all(preds)
+
+
+class _Ctx(dict):
+    """Контекст шаблонов title/extra: вычисленные значения + поля события."""
+    __slots__ = ("ev",)
+
+    def __init__(self, ev, **values):
+        super().__init__(values)
+        self.ev = ev
+
+    def __missing__(self, key):
+        return self.ev.get(key)
+
+
+class CompiledRule:
+    __slots__ = ("id", "type", "severity", "event_types", "key_fields", "key_getters", "window", "threshold",
+                 "where", "count_if", "fire_if", "distinct", "distinct_get", "sig_get", "sig_set", "title", "extra", "state", "metrics", "spec")
+
+    def __init__(self, spec: dict, lists: Dict[str, Any], base_dir: str = "."):
+        self.spec = spec
+        self.id = spec.get("id")
+        if not self.id:
+            raise RuleError("rule without id")
+        self.type = spec.get("type", "match")
+        if self.type not in RULE_TYPES:
+            raise RuleError(f"{self.id}: unknown type {self.type!r}")
+        self.severity = spec.get("severity", "medium")
+        et = spec.get("event_types") or []
+        self.event_types = tuple([et] if isinstance(et, str) else et)
+        kf = spec.get("key") or []
+        self.key_fields = tuple([kf] if isinstance(kf, str) else kf)
+        self.key_getters = tuple(field_getter(f) for f in self.key_fields)
+        self.window = float(spec.get("window", 0))
+        self.threshold = spec.get("threshold", 1)
+        try:
+            self.where = compile_where(spec.get("where"), spec.get("any"), lists)
+            self.count_if = compile_where(spec.get("count_if"), None, lists)
+            self.fire_if = compile_where(spec.get("fire_if"), None, lists)
+        except RuleError as e:
+            raise RuleError(f"{self.id}: {e}") from None
+        self.distinct = spec.get("distinct")
+        self.distinct_get = field_getter(self.distinct) if self.distinct else None
+        if self.type != "match" and self.window <= 0:
+            raise RuleError(f"{self.id}: {self.type} rule needs window > 0")
+        if self.type == "distinct" and not self.distinct:
+            raise RuleError(f"{self.id}: distinct rule needs 'distinct' field")
+        self.sig_get = None
+        self.sig_set: Optional[SignatureSet] = None
+        sig = spec.get("signatures")
+        if sig is not None:
+            if not isinstance(sig, dict) or not sig.get("file"):
+                raise RuleError(f"{self.id}: signatures needs {{field, file}}")
+            path = os.path.join(base_dir, sig["file"])
+            if not os.path.isfile(path):
+                raise RuleError(f"{self.id}: signature file not found: {path}")
+            self.sig_get = field_getter(sig.get("field", "message"))
+            self.sig_set = signature_set(path)
+        self.title = spec.get("title", self.id)
+        self.extra = dict(spec.get("extra") or {})
+        self.state = None  # KeyedWindows, заводит RuleEngine
+        self.metrics = None  # [проверок, сек, срабатываний] — тоже от RuleEngine
+
+    def signature(self) -> Tuple:
+        """Параметры, от которых зависит форма состояния: при их совпадении окно переживает перезагрузку."""
+        return self.type, self.key_fields, self.window, self.distinct
+
+    def key(self, ev):
+        """Ключ события; None — если какое-то поле ключа пустое."""
+        getters = self.key_getters
+        if len(getters) == 1:
+            v = getters[0](ev)
+            return None if v is None or v == "" else v
+        vals = []
+        for g in getters:
+            v = g(ev)
+            if v is None or v == "":
+                return None
+            vals.append(v)
+        return tuple(vals)
+
+    def match_signatures(self, ev) -> List[str]:
+        v = self.sig_get(ev)
+        return self.sig_set.find(v if isinstance(v, str) else str(v)) if v is not None else []
+
+    def render(self, ev, count: Optional[int], signatures: Optional[List[str]] = None) -> Tuple[str, dict]:
+        ctx = _Ctx(ev, count=count, signatures=signatures)
+        title = self.title.format_map(ctx)
+        extra = {name: ctx[src] for name, src in self.extra.items()}
+        return title, extra
+
+
+def compile_pack(pack: dict, builtin_lists: Optional[Dict[str, Iterable]] = None,
+                 base_dir: str = ".") -> List[CompiledRule]:
+    lists = dict(builtin_lists or {})
+    lists.update(pack.get("lists") or {})
+    rules, seen = [], set()
+    for spec in pack["rules"]:
+        if spec.get("enabled", True) is False:
+            continue
+        r = CompiledRule(spec, lists, base_dir)
+        if r.id in seen:
+            raise RuleError(f"duplicate rule id {r.id}")
+        seen.add(r.id)
+        rules.append(r)
+    return rules
+
+
+def dispatch_table(rules: List[CompiledRule]) -> Tuple[Dict[str, List[CompiledRule]], List[CompiledRule]]:
+    """event_type -> правила для него (в порядке пакета) и список правил для прочих типов."""
+    wildcard = [r for r in rules if not r.event_types]
+    table: Dict[str, List[CompiledRule]] = {}
+    for et in {et for r in rules for et in r.event_types}:
+        table[et] = [r for r in rules if not r.event_types or et in r.event_types]
+    return table, wildcard
+
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rulepacks", "default.yaml")
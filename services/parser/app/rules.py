@@ -1,10 +1,35 @@
 # services/parser/app/rules.py
-from collections import defaultdict, deque
-from datetime import datetime, timedelta, timezone
-from typing import Dict, Deque, List, Tuple
+import heapq, logging, os, time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, Iterable, Iterator, List, Optional
 
+from alerts import AlertAggregator
+from metrics import METRICS_RULE_SAMPLE
+from rulepack import DEFAULT_RULES_FILE, CompiledRule, compile_pack, dispatch_table, load_pack
+from windows import BoundedDistinctWindow, CounterWindow, DistinctWindow, KeyedWindows, bucket_width
+
+# встроенные списки для пакетов правил ("@sensitive_users", "@critical_ports")
 SENSITIVE_USERS = {"root", "admin", "postgres", "elastic", "guest"}
 CRITICAL_PORTS = {22, 23, 3389, 445, 9200}
+BUILTIN_LISTS = {"sensitive_users": SENSITIVE_USERS, "critical_ports": CRITICAL_PORTS}
+
+RULES_FILE = os.environ.get("RULES_FILE", DEFAULT_RULES_FILE)
+RULES_RELOAD_INTERVAL = float(os.environ.get("RULES_RELOAD_INTERVAL", "5"))  # сек; 0 — не следить за файлом
+# порт-скан: 0 — точный подсчёт (мультимножество портов), N — хранить не больше N портов на пару
+RULE_SCAN_MAX_PORTS = int(os.environ.get("RULE_SCAN_MAX_PORTS", "0"))
+# ключей в каждой карте состояния; сверх — вытесняем самые давно не обновлявшиеся (0 = без лимита)
+RULE_MAX_KEYS = int(os.environ.get("RULE_MAX_KEYS", "200000"))
+RULE_SWEEP_INTERVAL = float(os.environ.get("RULE_SWEEP_INTERVAL", "1.0"))  # сек времени событий между чистками
+# насколько событие может опоздать (сек времени событий) относительно самого позднего из пришедших
+# от того же сенсора: столько держим события в буфере переупорядочивания; опоздавшие сильнее —
+# отбрасываем. 0 — без буфера (по умолчанию: часы хостов внутри одного сенсора, например syslog
+# из разных часовых поясов, могут расходиться больше, чем на lateness)
+RULE_ALLOWED_LATENESS = float(os.environ.get("RULE_ALLOWED_LATENESS", "0"))
+RULE_REORDER_MAX = int(os.environ.get("RULE_REORDER_MAX", "100000"))  # событий в буфере сенсора; сверх — выпускаем ранние
+
+log = logging.getLogger("rules")
+_perf = time.perf_counter
 
 def _parse_ts(ts: str | None) -> datetime:
     if not ts:
@@ -16,21 +41,245 @@ def _parse_ts(ts: str | None) -> datetime:
     except Exception:
         return datetime.now(timezone.utc)
 
+def _event_time(ev: dict) -> float:
+    """Время события в epoch-секундах: ts_epoch_ms от парсера, иначе разбираем ts."""
+    ms = ev.get("ts_epoch_ms")
+    if ms is not None:
+        return ms / 1000.0
+    return _parse_ts(ev.get("ts")).timestamp()
+
+class _Reorder:
+    """Буфер переупорядочивания одного сенсора: куча (t, seq, ev) и своя граница опоздания."""
+    __slots__ = ("heap", "max_event_time", "low", "last_arrival")
+
+    def __init__(self):
+        self.heap: List[tuple] = []
+        self.max_event_time = 0.0
+        self.low = 0.0           # граница опоздания: события раньше неё уже не примем
+        self.last_arrival = 0.0  # time.monotonic() последнего события — для drain(idle)
+
 class RuleEngine:
-    def __init__(self, max_keep: int = 1000):
-        # скользящие окна
-        self.failed_by_ip: Dict[str, Deque[datetime]] = defaultdict(deque)             # SSH fails /60s
-        self.fail_success_chain: Dict[Tuple[str,str], Deque[Tuple[str,datetime]]] = defaultdict(deque)  # (outcome,ts) /5m
-        self.scan_by_srcdst: Dict[Tuple[str,str], Deque[Tuple[datetime,int]]] = defaultdict(deque)      # (ts,port) /30s
-        self.denies_by_ip: Dict[str, Deque[datetime]] = defaultdict(deque)            # FW DENY critical ports /60s
-        self.errors_by_service: Dict[str, Deque[datetime]] = defaultdict(deque)       # app ERROR /10s
+    """
+    Правила из декларативного пакета (rulepack.py, по умолчанию rulepacks/default.yaml),
+    скомпилированные в таблицу event_type -> правила: событие проверяет только свои правила.
+
+    Время — время событий. Несколько парсеров дают события не по порядку, поэтому с lateness > 0
+    они сначала попадают в буфер переупорядочивания (куча по времени) и выпускаются в правила
+    по порядку, когда граница max_event_time - lateness их обогнала. Буфер и граница — свои
+    у каждого сенсора (поле sensor): часы источников расходятся (auth и app пишут местное время,
+    firewall — UTC), и общая граница отбрасывала бы почти всё от отстающего. По ключу правила
+    буфер не делим: одно событие идёт в правила с разными ключами. Событие раньше границы своего
+    сенсора — опоздавшее, отбрасывается (late_dropped): окна уже ушли вперёд.
+    """
+
+    def __init__(self, max_keep: int = 1000, scan_max_ports: int = RULE_SCAN_MAX_PORTS,
+                 max_keys: int = RULE_MAX_KEYS, sweep_interval: float = RULE_SWEEP_INTERVAL,
+                 aggregator: AlertAggregator | None = None, rules_path: str = RULES_FILE,
+                 lists: Optional[Dict[str, Iterable]] = None,
+                 metrics_sample: int = METRICS_RULE_SAMPLE, lateness: float = RULE_ALLOWED_LATENESS,
+                 reorder_max: int = RULE_REORDER_MAX):
+        # окна живут в правилах (CompiledRule.state): время — epoch-секунды (float),
+        # ключи без событий дольше окна вытесняются sweep'ом по watermark (макс. время события)
+        self.scan_max_ports = scan_max_ports
+        self.max_keys = max_keys
+        self.watermark = 0.0
+        self.sweep_interval = sweep_interval
+        # часы по event_type: [макс. время события, следующая чистка]. Источники пишут разное
+        # время (местное / UTC), и ключи правила чистятся по часам его event_types, а не по
+        # общему watermark: иначе отстающий сенсор теряет окна на каждой чистке
+        self._clocks: Dict[object, list] = {}
 
+        self.lateness = lateness
+        self.reorder_max = reorder_max
+        self.max_event_time = 0.0  # по всем сенсорам, для stats
+        self._streams: Dict[str, _Reorder] = {}  # sensor -> буфер
+        self._seq = 0
+        self.reordered = 0
+        self.late_dropped = 0
+
+        self.rules: List[CompiledRule] = []
+        self.dispatch: Dict[str, List[CompiledRule]] = {}
+        self.wildcard: List[CompiledRule] = []
+        self.rules_path = rules_path
+        self.rules_mtime: Optional[float] = None
+        self.rules_error: Optional[str] = None
+        self.reloads = 0
+        self.lists = dict(lists or {})  # поверх списков пакета (replay: подбор @sensitive_users и т.п.)
+        # метрики по id правила (переживают перезагрузку): [проверок, сек, срабатываний];
+        # проверки и время — только на каждом metrics_sample-м событии, срабатывания — все
+        self.rule_metrics: Dict[str, list] = {}
+        self.metrics_sample = metrics_sample
+        self._tick = 0
+
+        # один инцидент на (правило, ключ): open -> update -> close
+        self.aggregator = aggregator if aggregator is not None else AlertAggregator(max_open=max_keys)
         self.recent_incidents: Deque[dict] = deque(maxlen=max_keep)
 
-    @staticmethod
-    def _drop_old(dq: Deque, now: datetime, window: timedelta):
-        while dq and (now - dq[0]) > window:
-            dq.popleft()
+        self.load_rules(rules_path)
+
+    def _new_state(self, r: CompiledRule) -> Optional[KeyedWindows]:
+        window = r.window
+        if r.type == "count":
+            return KeyedWindows(lambda: CounterWindow(window), window + bucket_width(window), self.max_keys)
+        if r.type == "distinct":
+            cap = self.scan_max_ports
+            factory = (lambda: BoundedDistinctWindow(window, cap)) if cap > 0 else (lambda: DistinctWindow(window))
+            return KeyedWindows(factory, window, self.max_keys)
+        return None
+
+    def load_rules(self, path: Optional[str] = None) -> dict:
+        """
+        (Пере)загружает пакет правил. Окна правил с тем же id и той же формой состояния
+        (тип, ключ, окно) переносятся. При ошибке остаётся прежний набор, исключение пробрасывается.
+        """
+        path = path or self.rules_path
+        mtime = os.stat(path).st_mtime
+        pack = load_pack(path)
+        if self.lists:
+            pack["lists"] = {**(pack.get("lists") or {}), **self.lists}
+        rules = compile_pack(pack, BUILTIN_LISTS, os.path.dirname(os.path.abspath(path)))
+        old = {r.id: r for r in self.rules}
+        kept = 0
+        for r in rules:
+            prev = old.get(r.id)
+            if prev is not None and prev.state is not None and prev.signature() == r.signature():
+                r.state = prev.state
+                kept += 1
+            else:
+                r.state = self._new_state(r)
+            r.metrics = self.rule_metrics.setdefault(r.id, [0, 0.0, 0])
+        # подмена одной операцией: process() видит либо старую таблицу, либо новую
+        self.dispatch, self.wildcard = dispatch_table(rules)
+        self.rules = rules
+        self.rules_path, self.rules_mtime, self.rules_error = path, mtime, None
+        self.reloads += 1
+        log.info("loaded %d rules from %s (state kept for %d)", len(rules), path, kept)
+        return {"path": path, "rules": [r.id for r in rules], "state_kept": kept}
+
+    def maybe_reload(self) -> Optional[dict]:
+        """Перечитывает пакет, если файл изменился. Ошибка — в лог и rules_error, работают прежние правила."""
+        for r in self.rules:
+            if r.sig_set is not None:
+                r.sig_set.maybe_rebuild()  # сборка в фоне, process() работает по старому автомату
+        try:
+            mtime = os.stat(self.rules_path).st_mtime
+        except OSError:
+            return None
+        if mtime == self.rules_mtime:
+            return None
+        try:
+            return self.load_rules()
+        except Exception as e:
+            self.rules_mtime = mtime  # не повторяем ту же ошибку до следующего изменения файла
+            self.rules_error = f"{type(e).__name__}: {e}"
+            log.error("rules reload from %s failed, keeping previous rules: %s", self.rules_path, self.rules_error)
+            return None
+
+    def sweep(self, watermark: float) -> int:
+        """Удаляет ключи, окна которых к watermark уже пусты."""
+        return sum(r.state.sweep(watermark) for r in self.rules if r.state is not None)
+
+    def rule_clock(self, r: CompiledRule) -> float:
+        """Время правила: макс. время событий его event_types; правила на все типы — общий watermark."""
+        if not r.event_types:
+            return self.watermark
+        clocks = self._clocks
+        return max((clocks[et][0] for et in r.event_types if et in clocks), default=0.0)
+
+    def stats(self) -> dict:
+        maps = {r.id: r.state.stats() for r in self.rules if r.state is not None}
+        return {
+            "watermark": self.watermark,
+            "max_event_time": self.max_event_time,
+            "allowed_lateness": self.lateness,
+            "reorder_buffered": sum(len(st.heap) for st in self._streams.values()),
+            "reorder_streams": {name: {"buffered": len(st.heap), "max_event_time": st.max_event_time}
+                                for name, st in self._streams.items()},
+            "reordered": self.reordered,
+            "late_dropped": self.late_dropped,
+            "live_keys": sum(v["live"] for v in maps.values()),
+            "evicted_idle": sum(v["evicted_idle"] for v in maps.values()),
+            "evicted_cap": sum(v["evicted_cap"] for v in maps.values()),
+            "maps": maps,
+            "alerts": self.aggregator.stats(),
+            "rules": {"path": self.rules_path, "count": len(self.rules), "reloads": self.reloads,
+                      "error": self.rules_error},
+            "signatures": {r.id: r.sig_set.stats() for r in self.rules if r.sig_set is not None},
+        }
+
+    def snapshot_parts(self, chunk: int = 5000) -> Iterator[tuple]:
+        """
+        Состояние для снимка (snapshot.py) частями: между ними вызывающий отдаёт управление
+        event loop, поэтому снимок «нечёткий» — разные ключи сняты в разные моменты,
+        но каждое окно и каждый агрегат целиком.
+        """
+        yield ("meta", {"watermark": self.watermark, "clocks": [[et, c[0], c[1]] for et, c in self._clocks.items()],
+                        "max_event_time": self.max_event_time,
+                        "streams": {name: [st.max_event_time, st.low] for name, st in self._streams.items()}})
+        for r in self.rules:
+            if r.state is not None:
+                for entries in r.state.dump(chunk):
+                    yield ("rule", r.id, r.signature(), entries)
+        for entries in self.aggregator.dump(chunk):
+            yield ("alerts", entries)
+        yield ("closing", self.aggregator.pending_close())
+        yield ("recent", list(self.recent_incidents))
+        yield ("reorder", [(t, ev) for st in self._streams.values() for t, _seq, ev in st.heap])
+
+    def restore_parts(self, parts: Iterable[tuple]) -> dict:
+        """
+        Восстанавливает состояние из частей снимка. Окна правила переносятся, только если
+        правило с тем же id и той же формой состояния есть в текущем пакете.
+        """
+        by_id = {r.id: r for r in self.rules if r.state is not None}
+        keys = skipped = incidents = 0
+        for part in parts:
+            kind = part[0]
+            if kind == "meta":
+                self.watermark = max(self.watermark, part[1]["watermark"])
+                for et, clock, next_sweep in part[1].get("clocks", []):
+                    c = self._clocks.setdefault(et, [0.0, 0.0])
+                    c[0], c[1] = max(c[0], clock), max(c[1], next_sweep)
+                self.max_event_time = max(self.max_event_time, part[1].get("max_event_time", 0.0))
+                for name, (max_t, low) in part[1].get("streams", {}).items():
+                    st = self._stream(name)
+                    st.max_event_time = max(st.max_event_time, max_t)
+                    st.low = max(st.low, low)
+            elif kind == "rule":
+                _kind, rule_id, signature, entries = part
+                r = by_id.get(rule_id)
+                if r is None or r.signature() != signature:
+                    skipped += len(entries)
+                    continue
+                for key, last, pairs in entries:
+                    r.state.restore(key, last, pairs)
+                keys += len(entries)
+            elif kind == "alerts":
+                if self.aggregator.enabled:
+                    self.aggregator.restore(part[1])
+            elif kind == "closing":
+                if self.aggregator.enabled:
+                    self.aggregator.restore([], part[1])
+            elif kind == "recent":
+                self.recent_incidents.extend(part[1])
+                incidents = len(part[1])
+            elif kind == "reorder":
+                for t, ev in part[1]:
+                    heapq.heappush(self._stream(ev.get("sensor") or "").heap, (t, self._seq, ev))
+                    self._seq += 1
+        return {"keys": keys, "skipped_keys": skipped, "open_incidents": len(self.aggregator.open),
+                "recent_incidents": incidents}
+
+    def reset_state(self):
+        """Пустое состояние: окна, агрегаты, recent, буферы и часы (после неудачного restore_parts)."""
+        for r in self.rules:
+            r.state = self._new_state(r)
+        a = self.aggregator
+        self.aggregator = AlertAggregator(a.enabled, a.update_interval, a.close_after, a.max_open)
+        self.recent_incidents.clear()
+        self.watermark = self.max_event_time = 0.0
+        self._streams.clear()
+        self._clocks.clear()
 
     def _mk_incident(self, kind: str, severity: str, title: str, ev: dict, extra: dict | None = None) -> dict:
         return {
@@ -48,102 +297,130 @@ class RuleEngine:
             "extra": extra or {}
         }
 
+    def _fire(self, alerts: List[dict], r: CompiledRule, key, now: float, ev: dict, count: Optional[int],
+              hits: Optional[List[str]] = None):
+        """Срабатывание правила: через агрегатор (open/update или подавлено); title/extra — только если выдаём."""
+        def build():
+            title, extra = r.render(ev, count, hits)
+            return self._mk_incident(r.id, r.severity, title, ev, extra)
+        r.metrics[2] += 1
+        inc = self.aggregator.hit(r.id, key, now, build)
+        if inc is not None:
+            alerts.append(inc)
+
+    def _eval(self, alerts: List[dict], r: CompiledRule, ev, now: float):
+        """Одно правило на одном событии; срабатывания — в alerts."""
+        if r.where is not None and not r.where(ev):
+            return
+        key = r.key(ev)
+        if key is None:
+            return
+        hits = None
+        if r.sig_set is not None:
+            hits = r.match_signatures(ev)
+            if not hits:
+                return
+        if r.type == "match":
+            self._fire(alerts, r, key, now, ev, None, hits)
+        elif r.type == "count":
+            counted = r.count_if is None or r.count_if(ev)
+            cnt = r.state.touch(key, now).add(now, 1 if counted else 0)
+            fire = r.fire_if(ev) if r.fire_if is not None else counted
+            if fire and cnt >= r.threshold:
+                self._fire(alerts, r, key, now, ev, cnt, hits)
+        else:  # distinct
+            v = r.distinct_get(ev)
+            if v is None:
+                return
+            cnt = r.state.touch(key, now).add(now, v)
+            if cnt >= r.threshold:
+                self._fire(alerts, r, key, now, ev, cnt, hits)
+
+    def _stream(self, sensor: str) -> _Reorder:
+        st = self._streams.get(sensor)
+        if st is None:
+            st = self._streams[sensor] = _Reorder()
+        return st
+
     def process(self, ev: dict) -> List[dict]:
+        """Событие на вход; инциденты — по событиям, которые этим вызовом вышли из буфера."""
+        t = _event_time(ev)
+        if self.lateness <= 0:
+            return self._process(ev, t)
+        st = self._stream(ev.get("sensor") or "")
+        if t < st.low:
+            self.late_dropped += 1
+            return []
+        if t < st.max_event_time:
+            self.reordered += 1
+        else:
+            st.max_event_time = t
+            if t > self.max_event_time:
+                self.max_event_time = t
+        st.last_arrival = time.monotonic()
+        heapq.heappush(st.heap, (t, self._seq, ev))
+        self._seq += 1
+        return self._release(st, st.max_event_time - self.lateness)
+
+    def _release(self, st: _Reorder, upto: float) -> List[dict]:
+        heap = st.heap
+        if heap and heap[0][0] > upto and len(heap) <= self.reorder_max:
+            return []  # частый случай: выпускать нечего
+        alerts: List[dict] = []
+        while heap and (heap[0][0] <= upto or len(heap) > self.reorder_max):
+            t, _seq, ev = heapq.heappop(heap)
+            if t > st.low:
+                st.low = t
+            out = self._process(ev, t)
+            if out:
+                alerts.extend(out)
+        st.low = max(st.low, st.max_event_time - self.lateness)
+        return alerts
+
+    def drain(self, idle: Optional[float] = None) -> List[dict]:
+        """
+        Выпускает буферы: все — при остановке, или (idle) тех сенсоров, от которых не было
+        событий idle секунд по часам — источник затих, ждать опоздавших не к чему.
+        """
+        alerts: List[dict] = []
+        now = time.monotonic()
+        for st in self._streams.values():
+            if st.heap and (idle is None or now - st.last_arrival >= idle):
+                alerts.extend(self._release(st, float("inf")))
+        return alerts
+
+    def _process(self, ev, now: float) -> List[dict]:
+        # закрытые агрегаты инцидентов выдаём вместе с событием, сдвинувшим часы своего типа
         alerts: List[dict] = []
-        now = _parse_ts(ev.get("ts"))
         et = ev.get("event_type")
-        msg = str(ev.get("message") or "")
-        src = ev.get("source_ip")
-        dst = ev.get("dest_ip")
-        dpt = ev.get("dest_port")
-        user = ev.get("user")
-        service = ev.get("service")
-        action = (ev.get("action") or "").lower()
-        outcome = (ev.get("outcome") or "").lower()
-
-        # SSH
-        if et == "auth" and (ev.get("protocol") or "").lower() == "ssh":
-            # брут: ≥5 fail /60s с одного IP
-            if outcome == "failed" and src:
-                dq = self.failed_by_ip[src]
-                dq.append(now)
-                self._drop_old(dq, now, timedelta(seconds=60))
-                if len(dq) >= 5:
-                    alerts.append(self._mk_incident(
-                        "ssh_bruteforce", "high",
-                        f"Много неудачных входов по SSH: {len(dq)} за 60с", ev,
-                        {"count_60s": len(dq)}
-                    ))
-            # успех после серии фейлов: ≥3 fail → success /5m
-            if src and user:
-                key = (src, str(user))
-                chain = self.fail_success_chain[key]
-                chain.append((outcome, now))
-                while chain and (now - chain[0][1]) > timedelta(minutes=5):
-                    chain.popleft()
-                fails = sum(1 for o, _t in chain if o == "failed")
-                if outcome == "success" and fails >= 3:
-                    alerts.append(self._mk_incident(
-                        "ssh_success_after_fail", "critical",
-                        f"Успешный вход после {fails} неудачных за 5м", ev,
-                        {"fails_before": fails}
-                    ))
-            # чувствительные пользователи — любая неудача
-            if outcome == "failed" and str(user or "").lower() in SENSITIVE_USERS:
-                alerts.append(self._mk_incident(
-                    "ssh_sensitive_user_fail", "high",
-                    f"Неудачный вход чувствительного пользователя: {user}", ev
-                ))
-
-        # Firewall
-        if et == "network":
-            # порт-скан: ≥10 уникальных портов /30с по (src→dst)
-            if src and dst and dpt is not None:
-                key = (src, dst)
-                dq = self.scan_by_srcdst[key]
-                dq.append((now, int(dpt)))
-                while dq and (now - dq[0][0]) > timedelta(seconds=30):
-                    dq.popleft()
-                uniq_ports = len({p for _t, p in dq})
-                if uniq_ports >= 10:
-                    alerts.append(self._mk_incident(
-                        "port_scan", "medium",
-                        f"Похоже на сканирование: {uniq_ports} портов за 30с", ev,
-                        {"unique_ports_30s": uniq_ports}
-                    ))
-            # критичные порты: ≥5 DENY на {22,23,3389,445,9200} /60с от одного IP
-            if action == "deny" and src and (dpt in CRITICAL_PORTS):
-                dq = self.denies_by_ip[src]
-                dq.append(now)
-                self._drop_old(dq, now, timedelta(seconds=60))
-                if len(dq) >= 5:
-                    alerts.append(self._mk_incident(
-                        "critical_ports_probe", "high",
-                        f"Много DENY на чувствительные порты: {len(dq)} за 60с", ev,
-                        {"count_60s": len(dq)}
-                    ))
-
-        # App-логи
-        if et in ("app_log", "app_error"):
-            # всплеск ошибок: ≥5 ERROR /10с на один сервис
-            level = (ev.get("metadata", {}) or {}).get("level", "").upper()
-            is_err = ev.get("outcome") == "error" or level == "ERROR"
-            if is_err and service:
-                dq = self.errors_by_service[str(service)]
-                dq.append(now)
-                self._drop_old(dq, now, timedelta(seconds=10))
-                if len(dq) >= 5:
-                    alerts.append(self._mk_incident(
-                        "app_error_burst", "medium",
-                        f"Всплеск ошибок в {service}: {len(dq)} за 10с", ev,
-                        {"count_10s": len(dq)}
-                    ))
-            # простые сигнатуры опасных payload’ов
-            if any(s in msg for s in ("Unauthorized", "<script>", "evil()", "EvilClass")):
-                alerts.append(self._mk_incident(
-                    "app_suspicious_payload", "medium",
-                    "Подозрительная строка в логе приложения", ev
-                ))
+        rules = self.dispatch.get(et, self.wildcard)
+        if now > self.watermark:
+            self.watermark = now
+        c = self._clocks.get(et)
+        if c is None:
+            c = self._clocks[et] = [0.0, 0.0]
+        if now > c[0]:
+            c[0] = now
+            if now >= c[1]:
+                # правила этого типа — по их часам (у правила на несколько типов — по самым поздним)
+                for r in rules:
+                    if r.state is not None:
+                        r.state.sweep(self.rule_clock(r))
+                alerts = self.aggregator.expire(self.watermark, {x.id: self.rule_clock(x) for x in self.rules})
+                c[1] = now + self.sweep_interval
+
+        self._tick += 1
+        if self.metrics_sample and self._tick >= self.metrics_sample:
+            self._tick = 0
+            for r in rules:
+                t0 = _perf()
+                self._eval(alerts, r, ev, now)
+                m = r.metrics
+                m[0] += 1
+                m[1] += _perf() - t0
+        else:
+            for r in rules:
+                self._eval(alerts, r, ev, now)
 
         for a in alerts:
             self.recent_incidents.append(a)
@@ -0,0 +1,333 @@
+# services/parser/app/segment_log.py
+"""
+Сегментированный журнал событий вместо одного бесконечного normalized.jsonl.
+
+Каталог: 00000000000000000000.jsonl + .idx, 00000000000000000001.jsonl + .idx, ...
+ - активный сегмент один (последний); он закрывается по размеру (segment_bytes)
+   или возрасту (roll_sec), после закрытия файл больше не меняется;
+ - .idx — разреженный индекс: примерно каждые index_bytes пишется пара
+   (номер записи в сегменте, байтовое смещение её начала), struct "<II";
+ - retention: самые старые закрытые сегменты удаляются сверх retention_bytes
+   или если они старше retention_sec.
+Позиция читателя — (segment, offset), offset всегда на границе строки.
+"""
+import bisect, logging, os, struct, time
+from typing import Dict, List, Optional, Tuple
+
+SEGMENT_BYTES = int(os.environ.get("SEGMENT_BYTES", str(64 << 20)))
+SEGMENT_ROLL_SEC = float(os.environ.get("SEGMENT_ROLL_SEC", "3600"))               # 0 = только по размеру
+SEGMENT_INDEX_BYTES = int(os.environ.get("SEGMENT_INDEX_BYTES", "4096"))
+SEGMENT_RETENTION_BYTES = int(os.environ.get("SEGMENT_RETENTION_BYTES", str(2 << 30)))  # 0 = без лимита
+SEGMENT_RETENTION_SEC = float(os.environ.get("SEGMENT_RETENTION_SEC", str(7 * 86400)))  # 0 = без лимита
+RETENTION_CHECK_SEC = 60.0
+
+SEG_SUFFIX = ".jsonl"
+IDX_SUFFIX = ".idx"
+_IDX = struct.Struct("<II")
+
+Position = Tuple[int, int]
+
+log = logging.getLogger("segments")
+
+
+def segment_path(directory: str, seg: int) -> str:
+    return os.path.join(directory, f"{seg:020d}{SEG_SUFFIX}")
+
+
+def index_path(directory: str, seg: int) -> str:
+    return os.path.join(directory, f"{seg:020d}{IDX_SUFFIX}")
+
+
+def list_segments(directory: str) -> List[int]:
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    out = []
+    for n in names:
+        stem = n[:-len(SEG_SUFFIX)]
+        if n.endswith(SEG_SUFFIX) and stem.isdigit():
+            out.append(int(stem))
+    out.sort()
+    return out
+
+
+def read_index(directory: str, seg: int) -> List[Tuple[int, int]]:
+    try:
+        with open(index_path(directory, seg), "rb") as fh:
+            data = fh.read()
+    except FileNotFoundError:
+        return []
+    return [_IDX.unpack_from(data, i) for i in range(0, len(data) - _IDX.size + 1, _IDX.size)]
+
+
+def floor_offset(directory: str, seg: int, limit: int) -> int:
+    """Ближайшее снизу к limit начало записи по индексу (0, если индекса нет)."""
+    offsets = [off for _rec, off in read_index(directory, seg)]
+    i = bisect.bisect_right(offsets, limit) - 1
+    return offsets[i] if i >= 0 else 0
+
+
+def _complete_size(fh, size: int) -> int:
+    """Размер файла без недописанного хвоста (после последнего \\n)."""
+    pos = size
+    while pos > 0:
+        start = max(0, pos - 65536)
+        fh.seek(start)
+        i = fh.read(pos - start).rfind(b"\n")
+        if i != -1:
+            return start + i + 1
+        pos = start
+    return 0
+
+
+class SegmentedLog:
+    """Пишущая сторона журнала. Вызывается из одного потока (JsonlWriter._flush)."""
+
+    def __init__(self, directory: str, segment_bytes: int = SEGMENT_BYTES, roll_sec: float = SEGMENT_ROLL_SEC,
+                 index_bytes: int = SEGMENT_INDEX_BYTES, retention_bytes: int = SEGMENT_RETENTION_BYTES,
+                 retention_sec: float = SEGMENT_RETENTION_SEC):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.roll_sec = roll_sec
+        self.index_bytes = index_bytes
+        self.retention_bytes = retention_bytes
+        self.retention_sec = retention_sec
+
+        self.seg = 0
+        self.size = 0
+        self.records = 0
+        self._fh = None
+        self._idx = None
+        self._next_index_at = 0
+        self._opened_at = 0.0
+        self._closed: Dict[int, Tuple[int, float]] = {}   # seg -> (размер, время закрытия)
+        self._retention_checked = 0.0
+        self.deleted_segments = 0
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        segs = list_segments(self.directory)
+        for seg in segs[:-1]:
+            st = os.stat(segment_path(self.directory, seg))
+            self._closed[seg] = (st.st_size, st.st_mtime)
+        if segs:
+            self._recover(segs[-1])
+        else:
+            self._create(0)
+        self.enforce_retention()
+
+    def _create(self, seg: int):
+        self.seg = seg
+        self._fh = open(segment_path(self.directory, seg), "ab")
+        self._idx = open(index_path(self.directory, seg), "ab")
+        self.size = 0
+        self.records = 0
+        self._next_index_at = 0
+        self._opened_at = time.time()
+
+    def _recover(self, seg: int):
+        """Переоткрывает последний сегмент после рестарта: отрезает недописанную строку и досчитывает записи."""
+        path = segment_path(self.directory, seg)
+        size = os.path.getsize(path)
+        with open(path, "rb+") as fh:
+            good = _complete_size(fh, size)
+            if good < size:
+                log.warning("segment %d: dropping %d bytes of a torn last record", seg, size - good)
+                fh.truncate(good)
+            entries = [e for e in read_index(self.directory, seg) if e[1] < good]
+            rec, off = entries[-1] if entries else (0, 0)
+            fh.seek(off)
+            tail = fh.read(good - off)
+        with open(index_path(self.directory, seg), "wb") as ih:
+            ih.write(b"".join(_IDX.pack(*e) for e in entries))
+        self._create(seg)
+        self.size = good
+        self.records = rec + tail.count(b"\n")
+        self._next_index_at = off + self.index_bytes if entries else 0
+
+    def _roll(self):
+        self._fh.close()
+        self._idx.close()
+        self._closed[self.seg] = (self.size, time.time())
+        self._create(self.seg + 1)
+        self.enforce_retention()
+
+    def _should_roll(self) -> bool:
+        if not self.records:
+            return False
+        return self.size >= self.segment_bytes or (
+            self.roll_sec > 0 and time.time() - self._opened_at >= self.roll_sec)
+
+    def append(self, lines: List[str]) -> int:
+        """Дописывает строки (с \\n на конце), при переполнении сегмента — переходит на новый. Возвращает байты."""
+        if self._fh is None:
+            self.open()
+        if self._should_roll():
+            self._roll()
+        written = 0
+        buf: List[bytes] = []
+        idx: List[bytes] = []
+        for line in lines:
+            if self.records and self.size >= self.segment_bytes:
+                self._write(buf, idx)
+                buf, idx = [], []
+                self._roll()
+            b = line.encode("utf-8")
+            if self.size >= self._next_index_at:
+                idx.append(_IDX.pack(self.records, self.size))
+                self._next_index_at = self.size + self.index_bytes
+            buf.append(b)
+            self.size += len(b)
+            self.records += 1
+            written += len(b)
+        self._write(buf, idx)
+        if time.monotonic() - self._retention_checked >= RETENTION_CHECK_SEC:
+            self.enforce_retention()
+        return written
+
+    def _write(self, buf: List[bytes], idx: List[bytes]):
+        # сначала данные, потом индекс: индекс не должен указывать за конец сегмента
+        if buf:
+            self._fh.write(b"".join(buf))
+            self._fh.flush()
+        if idx:
+            self._idx.write(b"".join(idx))
+            self._idx.flush()
+
+    def enforce_retention(self):
+        self._retention_checked = time.monotonic()
+        now = time.time()
+        total = self.size + sum(size for size, _ in self._closed.values())
+        for seg in sorted(self._closed):
+            size, closed_at = self._closed[seg]
+            too_big = self.retention_bytes > 0 and total > self.retention_bytes
+            too_old = self.retention_sec > 0 and now - closed_at > self.retention_sec
+            if not (too_big or too_old):
+                break
+            for path in (segment_path(self.directory, seg), index_path(self.directory, seg)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            del self._closed[seg]
+            total -= size
+            self.deleted_segments += 1
+            log.info("retention: removed segment %d (%d bytes)", seg, size)
+
+    def sync(self):
+        if self._fh is not None:
+            os.fsync(self._fh.fileno())
+            os.fsync(self._idx.fileno())
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._idx.close()
+            self._fh = self._idx = None
+
+    def stats(self) -> dict:
+        return {
+            "dir": self.directory,
+            "segment": self.seg,
+            "segment_size": self.size,
+            "segment_records": self.records,
+            "segments": len(self._closed) + 1,
+            "disk_bytes": self.size + sum(size for size, _ in self._closed.values()),
+            "deleted_segments": self.deleted_segments,
+        }
+
+
+class SegmentReader:
+    """Читающая сторона (shipper, офлайн-разбор): строки с позиции (segment, offset)."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.skipped_segments = 0
+        self.rewinds = 0
+        self.partial_tails = 0  # закрытые сегменты с недописанной последней строкой (пропущена)
+        # открытый сегмент между вызовами read(): (номер, файл, (st_dev, st_ino))
+        self._open: Optional[Tuple[int, object, Tuple[int, int]]] = None
+
+    def resolve(self, pos: Position) -> Optional[Position]:
+        """
+        Сверяет позицию с диском. Сегмент удалён retention'ом — идём в самый старый;
+        сегмент обрезан — откатываемся к ближайшей границе записи по индексу.
+        None — журнал пока пуст.
+        """
+        seg, off = pos
+        try:
+            st = os.stat(segment_path(self.directory, seg))
+        except FileNotFoundError:
+            self.close()
+            segs = list_segments(self.directory)
+            if not segs:
+                return None
+            if seg < segs[0]:
+                log.warning("segment %d already removed by retention; skipping %d segment(s) to %d",
+                            seg, segs[0] - seg, segs[0])
+                self.skipped_segments += segs[0] - seg
+            else:
+                log.warning("segment %d not found (log has %d..%d); restarting from %d",
+                            seg, segs[0], segs[-1], segs[0])
+            return segs[0], 0
+        if self._open is not None and self._open[0] == seg and self._open[2] != (st.st_dev, st.st_ino):
+            self.close()  # сегмент с этим номером пересоздан — открытый файл уже не он
+        size = st.st_size
+        if off > size:
+            new_off = floor_offset(self.directory, seg, size)
+            log.warning("segment %d truncated to %d bytes (position %d); rewinding to %d",
+                        seg, size, off, new_off)
+            self.rewinds += 1
+            return seg, new_off
+        return pos
+
+    def read(self, pos: Position, max_lines: int) -> Tuple[List[bytes], Position]:
+        """До max_lines полных строк начиная с pos; переходит в следующий сегмент, когда текущий закрыт."""
+        seg, off = pos
+        out: List[bytes] = []
+        while len(out) < max_lines:
+            path = segment_path(self.directory, seg)
+            fh = self._handle(seg, path)
+            if fh is None:
+                break
+            fh.seek(off)
+            while len(out) < max_lines:
+                line = fh.readline()
+                if not line.endswith(b"\n"):
+                    break  # конец или строка ещё дописывается
+                off += len(line)
+                out.append(line)
+            if len(out) >= max_lines or not os.path.exists(segment_path(self.directory, seg + 1)):
+                break
+            # следующий сегмент уже создан => текущий закрыт; дочитываем остаток и переходим
+            size = os.fstat(fh.fileno()).st_size
+            if size > off:
+                fh.seek(off)
+                if b"\n" in fh.read(size - off):
+                    continue  # строки дописаны перед переходом — читаем их
+                # хвост без \n уже не допишут (ошибка записи, затем _roll): без пропуска read() крутился бы вечно
+                log.warning("segment %d ends with a partial line (%d bytes at offset %d); skipping to segment %d",
+                            seg, size - off, off, seg + 1)
+                self.partial_tails += 1
+            seg, off = seg + 1, 0
+        return out, (seg, off)
+
+    def _handle(self, seg: int, path: str):
+        """Файл сегмента seg: держим открытым между вызовами, а не открываем на каждый read()."""
+        if self._open is not None:
+            if self._open[0] == seg:
+                return self._open[1]
+            self.close()
+        try:
+            fh = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        st = os.fstat(fh.fileno())
+        self._open = (seg, fh, (st.st_dev, st.st_ino))
+        return fh
+
+    def close(self):
+        if self._open is not None:
+            self._open[1].close()
+            self._open = None
@@ -1,15 +1,39 @@
 import argparse
+import asyncio
+import gzip
 import json
 import os
+import threading
 import time
 import logging
-from typing import List
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+import httpx
 import requests
 
+from filewatch import INOTIFY_RECHECK, make_waiter
+from metrics import CONTENT_TYPE, Exposition, Histogram
+from segment_log import SEG_SUFFIX, SegmentReader, list_segments, segment_path
+from spill import SpillQueue
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger("shipper")
+logging.getLogger("httpx").setLevel(logging.WARNING)  # one INFO line per request otherwise
 
 DEFAULT_CHECKPOINT = "shipper.checkpoint"
+NDJSON_HEADERS = {"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+# with a spill queue a batch goes to disk after this many failed retries (~7 s of backoff) instead of blocking the reader
+SPILL_AFTER_RETRIES = 2
+SPILL_RETRY_MAX = 30.0  # max seconds between attempts to replay the spill queue
+SPILL_REPLAY_BATCHES = 16  # per pass of the synchronous loop, so reading and metrics keep going
+LAG_REPORT_SEC = 60.0
+# --slo: batch size / flush interval controller
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LATENCY_EWMA = 0.2
+MIN_FLUSH_INTERVAL = 0.05
+SLO_GROW_SHARE = 0.8  # a full batch grows only while its call + MIN_FLUSH_INTERVAL took under this share of --slo
+
+Observe = Optional[Callable[[int, float], None]]  # (events, seconds) of an accepted request
 
 def read_checkpoint(cp_path: str) -> int:
     try:
@@ -22,55 +46,104 @@ def read_checkpoint(cp_path: str) -> int:
         logger.exception("Failed to read checkpoint, starting at 0")
         return 0
 
-def write_checkpoint(cp_path: str, offset: int):
+def read_segment_checkpoint(cp_path: str) -> Tuple[int, int]:
+    """Checkpoint of the segmented log: "<segment> <offset>"."""
+    try:
+        with open(cp_path, "r") as fh:
+            parts = fh.read().split()
+    except FileNotFoundError:
+        return 0, 0
+    if len(parts) == 2 and all(p.isdigit() for p in parts):
+        return int(parts[0]), int(parts[1])
+    if parts:
+        logger.warning("Checkpoint %s is not a (segment, offset) pair: %r; starting from the oldest segment", cp_path, parts)
+    return 0, 0
+
+def write_checkpoint(cp_path: str, offset):
+    """offset is a byte offset (single file) or a (segment, offset) pair."""
     tmp = cp_path + ".tmp"
     with open(tmp, "w") as fh:
-        fh.write(str(offset))
+        fh.write(" ".join(map(str, offset)) if isinstance(offset, tuple) else str(offset))
         fh.flush()
         os.fsync(fh.fileno())
     os.replace(tmp, cp_path)
 
-def tail_batch(file_path: str, start_offset: int, max_lines: int):
-    """Read up to max_lines JSON objects from file starting at byte offset start_offset.
-    Returns (events, new_offset)."""
-    if max_lines <= 0:
-        return [], start_offset
-
-    events = []
-    new_offset = start_offset
+def take_line(line: bytes, out: list, raw: bool, where: str, at):
+    """Appends the event of one input line to out: the decoded object, or in raw
+    mode the line itself. Raw lines only get a shape check ("{...}" on one line);
+    anything subtler is caught when the detector rejects the batch (salvage_lines)."""
+    if raw:
+        if line[:1] == b"{" and line[-2:] == b"}\n":
+            out.append(line)
+            return
+        line = line.strip()
+        if not line:
+            return
+        if line[:1] == b"{" and line[-1:] == b"}":
+            out.append(line + b"\n")
+            return
+    else:
+        line = line.strip()
+        if not line:
+            return
+        try:
+            out.append(json.loads(line))
+            return
+        except ValueError:
+            pass
+    logger.warning("Failed to parse JSON at %s %s; skipping", where, at)
 
-    with open(file_path, "r", encoding="utf-8") as fh:
-        fh.seek(start_offset)
-        lines_read = 0
-        while lines_read < max_lines:
-            pos_before = fh.tell()
-            line = fh.readline()
-            if not line:
-                new_offset = pos_before
-                break
+def ndjson_body(lines: List[bytes], level: int) -> bytes:
+    return gzip.compress(b"".join(lines), compresslevel=level)
 
-            new_offset = fh.tell()  
-            s = line.strip()
-            if s:
-                try:
-                    events.append(json.loads(s))
-                except Exception:
-                    logging.exception("Failed to parse JSON at offset %d; skipping", pos_before)
-            lines_read += 1
+def salvage_lines(batch: List[bytes], detail: str) -> Optional[List[bytes]]:
+    """A raw batch was rejected with 400: decode every line and keep the JSON objects.
+    None if all of them are fine (the rejection is about something else)."""
+    kept = []
+    for line in batch:
+        try:
+            if isinstance(json.loads(line), dict):
+                kept.append(line)
+        except ValueError:
+            pass
+    if len(kept) == len(batch):
+        return None
+    logger.warning("Detector rejected the batch (%s); dropping %d malformed line(s) and resending",
+                   detail[:200], len(batch) - len(kept))
+    return kept
 
-    return events, new_offset
+def ship_batch(ml_url: str, batch: list, max_retries: int = 6, initial_backoff: float = 0.5,
+               session: Optional[requests.Session] = None, raw: bool = False, gzip_level: int = 1,
+               observe: Observe = None) -> bool:
+    """Send batch to ML. Return True on success, False on failure.
 
-def ship_batch(ml_url: str, batch: List[dict], max_retries: int = 6, initial_backoff: float = 0.5) -> bool:
-    """Send batch to ML. Return True on success, False on failure."""
+    raw: batch is a list of JSONL lines, sent as gzip NDJSON (to /score-ndjson).
+    observe: called with (events, seconds) of the request that was accepted."""
     if not batch:
         return True
-    payload = {"events": batch}
+    http = session or requests
+    payload = {"events": batch} if not raw else None
+    body = ndjson_body(batch, gzip_level) if raw else None
     attempt = 0
     backoff = initial_backoff
     while attempt <= max_retries:
         try:
-            r = requests.post(ml_url, json=payload, timeout=8.0)
+            t0 = time.perf_counter()
+            if raw:
+                r = http.post(ml_url, data=body, headers=NDJSON_HEADERS, timeout=8.0)
+                if r.status_code == 400:
+                    kept = salvage_lines(batch, r.text)
+                    if kept is not None:
+                        batch = kept
+                        if not batch:
+                            return True
+                        body = ndjson_body(batch, gzip_level)
+                        continue
+            else:
+                r = http.post(ml_url, json=payload, timeout=8.0)
             r.raise_for_status()
+            if observe is not None:
+                observe(len(batch), time.perf_counter() - t0)
             logger.info("Shipped batch size=%d success (status=%s)", len(batch), r.status_code)
             return True
         except requests.exceptions.RequestException as e:
@@ -81,71 +154,729 @@ def ship_batch(ml_url: str, batch: List[dict], max_retries: int = 6, initial_bac
     logger.error("Giving up after %d attempts for batch size=%d", max_retries, len(batch))
     return False
 
-def run_loop(file_path: str, ml_url: str, checkpoint_path: str, batch_size: int, flush_interval: float, poll_interval: float):
-    offset = read_checkpoint(checkpoint_path)
-    logger.info("Starting shipper: file=%s ml=%s checkpoint=%s offset=%d", file_path, ml_url, checkpoint_path, offset)
-    buffer = []
-    last_flush = time.time()
-
-    if not os.path.exists(file_path):
-        logger.warning("Input file %s does not exist yet. Waiting...", file_path)
+async def ship_batch_async(client: httpx.AsyncClient, ml_url: str, batch: list, initial_backoff: float = 0.5,
+                           raw: bool = False, gzip_level: int = 1, max_retries: Optional[int] = None,
+                           observe: Observe = None) -> bool:
+    """Send batch to ML, retrying with backoff until it is accepted.
 
+    Without a spill queue a batch cannot be given up on in the pipeline
+    (max_retries None): the checkpoint only moves past it once it is
+    acknowledged, so the later in-flight batches wait for it.
+    """
+    payload = {"events": batch} if not raw else None
+    body = ndjson_body(batch, gzip_level) if raw else None
+    attempt = 0
+    backoff = initial_backoff
     while True:
         try:
-            size = os.path.getsize(file_path)
-            if offset > size:
-                logger.warning("Checkpoint offset %d > file size %d; rewinding to 0", offset, size)
-                offset = 0
-                write_checkpoint(checkpoint_path, offset)
-        except FileNotFoundError:
+            t0 = time.perf_counter()
+            if raw:
+                r = await client.post(ml_url, content=body, headers=NDJSON_HEADERS)
+                if r.status_code == 400:
+                    kept = salvage_lines(batch, r.text)
+                    if kept is not None:
+                        batch = kept
+                        if not batch:
+                            return True
+                        body = ndjson_body(batch, gzip_level)
+                        continue
+            else:
+                r = await client.post(ml_url, json=payload)
+            r.raise_for_status()
+            if observe is not None:
+                observe(len(batch), time.perf_counter() - t0)
+            logger.info("Shipped batch size=%d success (status=%s)", len(batch), r.status_code)
+            return True
+        except httpx.HTTPError as e:
+            attempt += 1
+            logger.warning("Failed to ship batch size=%d (attempt %d): %s", len(batch), attempt, e)
+            if max_retries is not None and attempt > max_retries:
+                return False
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 8.0)
+
+def batch_lines(batch: list, raw: bool) -> List[bytes]:
+    """Batch as JSONL lines, for the spill queue."""
+    if raw:
+        return batch
+    return [json.dumps(ev, ensure_ascii=False).encode("utf-8") + b"\n" for ev in batch]
+
+def lines_batch(lines: List[bytes], raw: bool) -> list:
+    return lines if raw else [json.loads(line) for line in lines]
+
+class BatchController:
+    """Batch size and flush interval, adapted to the detector's latency when --slo is set.
+
+    A line waits in the buffer for up to the flush interval and then for the
+    detector, so the flush interval is what the SLO leaves after the detector's
+    latency (EWMA), between MIN_FLUSH_INTERVAL and half the SLO.
+
+    Batch size is AIMD. A batch cut full means input is waiting, i.e. the
+    detector is not keeping up; every /score call has a fixed cost (it
+    re-featurizes all IPs), so fewer, larger calls catch up faster: +min_batch.
+    The SLO bounds that growth: a full batch waits only MIN_FLUSH_INTERVAL
+    before it is sent, so once a call plus that reaches SLO_GROW_SHARE of
+    the SLO the batch stops growing (a larger call alone would take the line
+    past it). It does not shrink under load either - that would multiply the
+    fixed cost and the backlog with it; if the SLO cannot be met at the input
+    rate, the lag metrics show it. Only a batch
+    cut by the timer at under half the limit (input is idle) halves it, so
+    the next burst starts with small, quick calls.
+
+    Without an SLO the batch and interval stay fixed; latency is still measured.
+    """
+
+    def __init__(self, batch: int, flush_interval: float, slo: float = 0.0, min_batch: int = 50,
+                 max_batch: int = 5000):
+        self.slo = slo
+        self.min_batch = min(min_batch, batch)
+        self.max_batch = max(max_batch, batch)
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.latency: Optional[float] = None  # EWMA of accepted requests, s
+        self.hist = Histogram(LATENCY_BUCKETS)
+        self.grown = self.shrunk = 0
+
+    def observe(self, events: int, seconds: float, full: bool):
+        self.hist.observe(seconds)
+        self.latency = seconds if self.latency is None else self.latency + LATENCY_EWMA * (seconds - self.latency)
+        if not self.slo:
+            return
+        if full and seconds + MIN_FLUSH_INTERVAL < SLO_GROW_SHARE * self.slo:  # this call, not the lagging EWMA
+            batch = min(self.max_batch, self.batch + self.min_batch)
+            self.grown += batch > self.batch
+        elif full:
+            batch = self.batch  # at the SLO's limit: more events per call would break it
+        elif events < self.batch / 2:
+            batch = max(self.min_batch, self.batch // 2)
+            self.shrunk += batch < self.batch
+        else:
+            batch = self.batch
+        self.batch = batch
+        self.flush_interval = min(self.slo / 2, max(MIN_FLUSH_INTERVAL, self.slo - self.latency))
+
+    def describe(self) -> str:
+        latency = f"{self.latency * 1000:.0f}ms" if self.latency is not None else "-"
+        return f"batch {self.batch}, flush {self.flush_interval:.2f}s, detector latency {latency}"
+
+    def expose(self, exp: Exposition):
+        exp.metric("batch_size", "gauge", "Current batch size limit", [(None, self.batch)])
+        exp.metric("flush_interval_seconds", "gauge", "Current flush interval", [(None, self.flush_interval)])
+        exp.metric("detector_latency_ewma_seconds", "gauge", "Detector response time, EWMA",
+                   [(None, self.latency or 0.0)])
+        exp.histogram("detector_latency_seconds", "Detector response time of accepted requests", [(None, self.hist)])
+        if self.slo:
+            exp.metric("latency_slo_seconds", "gauge", "End-to-end latency target (--slo)", [(None, self.slo)])
+            exp.metric("batch_resizes_total", "counter", "Batch size changes by direction",
+                       [({"direction": "grow"}, self.grown), ({"direction": "shrink"}, self.shrunk)])
+
+class Lag:
+    """How far behind the shipper is, for the periodic log line and /metrics.
+
+    bytes_behind: input not read yet (refreshed by the shipping loop, which owns the
+    open files). oldest_age(): how long the oldest line that has been read but not
+    yet accepted by the detector (in the buffer, in flight or in the spill queue)
+    has been waiting since it was read.
+    """
+
+    def __init__(self, source, spill: Optional[SpillQueue] = None, controller: Optional[BatchController] = None):
+        self.source = source
+        self.spill = spill
+        self.controller = controller
+        self.unacked: Dict[object, float] = {}  # "buffer" / batch seq -> read time of its first line
+        self.bytes_behind = 0
+        self.shipped_batches = 0
+        self.shipped_events = 0
+        self.failed_batches = 0
+        self._next_refresh = 0.0
+        self._next_report = time.time() + LAG_REPORT_SEC
+
+    def shipped(self, events: int):
+        self.shipped_batches += 1
+        self.shipped_events += events
+
+    def oldest_age(self, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        times = list(self.unacked.values())
+        if self.spill is not None and len(self.spill):
+            times.append(self.spill.oldest())
+        return max(0.0, now - min(times)) if times else 0.0
+
+    def tick(self, now: float, force: bool = False):
+        """Once a second (or before the loop goes to sleep): stat the input;
+        every LAG_REPORT_SEC: log the lag if there is any."""
+        if now < self._next_refresh and not force:
+            return
+        self._next_refresh = now + 1.0
+        try:
+            self.bytes_behind = self.source.bytes_behind()
+        except (OSError, ValueError):
+            pass
+        if now >= self._next_report:
+            self._next_report = now + LAG_REPORT_SEC
+            spilled = len(self.spill) if self.spill is not None else 0
+            if self.bytes_behind or spilled or (self.controller is not None and self.controller.slo):
+                logger.info("Lag: %d bytes behind, oldest unshipped %.1fs, spill %d batch(es)%s",
+                            self.bytes_behind, self.oldest_age(now), spilled,
+                            f"; {self.controller.describe()}" if self.controller is not None else "")
+
+    def exposition(self) -> str:
+        exp = Exposition(prefix="shipper_")
+        exp.metric("bytes_behind", "gauge", "Input bytes not read yet", [(None, self.bytes_behind)])
+        exp.metric("oldest_unshipped_age_seconds", "gauge",
+                   "Age of the oldest read line not yet accepted by the detector", [(None, self.oldest_age())])
+        exp.metric("shipped_batches_total", "counter", "Batches accepted by the detector", [(None, self.shipped_batches)])
+        exp.metric("shipped_events_total", "counter", "Events accepted by the detector", [(None, self.shipped_events)])
+        exp.metric("failed_batches_total", "counter", "Batches neither accepted nor spilled; the checkpoint stays before the first",
+                   [(None, self.failed_batches)])
+        if self.controller is not None:
+            self.controller.expose(exp)
+        if self.spill is not None:
+            st = self.spill.stats()
+            exp.metric("spill_batches", "gauge", "Batches in the spill queue", [(None, st["batches"])])
+            exp.metric("spill_bytes", "gauge", "Bytes in the spill queue", [(None, st["bytes"])])
+            exp.metric("spill_max_bytes", "gauge", "Spill queue bound; reading pauses above it", [(None, st["max_bytes"])])
+            exp.metric("spilled_batches_total", "counter", "Batches written to the spill queue", [(None, st["spilled"])])
+            exp.metric("replayed_batches_total", "counter", "Spilled batches accepted by the detector",
+                       [(None, st["replayed"])])
+        return exp.text()
+
+def serve_metrics(port: int, lag: Lag) -> ThreadingHTTPServer:
+    """GET /metrics in a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = lag.exposition().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
             pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Serving /metrics on port %d", port)
+    return server
+
+class OrderedCheckpoint:
+    """Checkpoint for batches acknowledged out of order.
+
+    Batches are numbered as they are cut; the checkpoint moves only over the
+    contiguous prefix of acknowledged ones, so after a crash nothing before it
+    is unshipped (batches after it may be shipped twice). A batch settled as
+    failed (position None) still lets next_seq move on, so later batches are
+    not held up, but the checkpoint stays before it for good: a restart
+    re-reads it.
+    """
+
+    def __init__(self, cp_path: str, position):
+        self.cp_path = cp_path
+        self.position = position
+        self.next_seq = 0
+        self.acked: Dict[int, object] = {}  # seq -> input position after that batch, None if it failed
+        self.held = False
+
+    def ack(self, seq: int, position) -> bool:
+        """True if the checkpoint file was rewritten."""
+        self.acked[seq] = position
+        if seq != self.next_seq:
+            return False
+        moved = False
+        while self.next_seq in self.acked:
+            position = self.acked.pop(self.next_seq)
+            self.next_seq += 1
+            if position is None:
+                self.held = True
+            elif not self.held:
+                self.position, moved = position, True
+        if moved:
+            write_checkpoint(self.cp_path, self.position)
+        return moved
+
+class FileTail:
+    """Single JSONL file; the position is a byte offset.
+
+    The file stays open between reads. Rotation is noticed at EOF when the path
+    points to a different inode: the old file has been read to the end by then,
+    so the tail switches to the new one from offset 0. A file truncated in place
+    (copytruncate) is re-read from 0.
+    """
+
+    def __init__(self, file_path: str, checkpoint_path: str, raw: bool = False):
+        self.path = file_path
+        self.checkpoint_path = checkpoint_path
+        self.raw = raw
+        self.position = read_checkpoint(checkpoint_path)
+        self.fh = None
+        self.inode = None
+        self.rotations = 0
+
+    def describe(self) -> str:
+        return f"file={self.path} offset={self.position}"
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def watch_target(self):
+        """(directory, name filter) for filewatch."""
+        name = os.path.basename(self.path)
+        return os.path.dirname(os.path.abspath(self.path)), lambda n: n == name
+
+    def _open(self) -> bool:
+        try:
+            fh = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        st = os.fstat(fh.fileno())
+        if self.position > st.st_size:
+            logger.warning("Checkpoint offset %d > file size %d; rewinding to 0", self.position, st.st_size)
+            self.position = 0
+            write_checkpoint(self.checkpoint_path, 0)
+        fh.seek(self.position)
+        self.fh, self.inode = fh, (st.st_dev, st.st_ino)
+        return True
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def bytes_behind(self) -> int:
+        if self.fh is None:
+            try:
+                return max(0, os.path.getsize(self.path) - self.position)
+            except FileNotFoundError:
+                return 0
+        behind = max(0, os.fstat(self.fh.fileno()).st_size - self.position)
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return behind
+        if (st.st_dev, st.st_ino) != self.inode:
+            behind += st.st_size  # rotated: the rest of the old file plus all of the new one
+        return behind
+
+    def _read_lines(self, max_lines: int, events: list) -> bool:
+        """Appends up to max_lines complete lines; True if it stopped at EOF (or a partial line)."""
+        fh = self.fh
+        lines_read = 0
+        while lines_read < max_lines:
+            line = fh.readline()
+            if not line.endswith(b"\n"):
+                if line:
+                    fh.seek(self.position)  # still being written; re-read it whole next time
+                return True
+            take_line(line, events, self.raw, "offset", self.position)
+            self.position += len(line)
+            lines_read += 1
+        return False
+
+    def read(self, max_lines: int) -> list:
+        if max_lines <= 0:
+            return []
+        if self.fh is None and not self._open():
+            return []
+        events: list = []
+        if not self._read_lines(max_lines, events):
+            return events
         try:
-            events, new_offset = tail_batch(file_path, offset, max_lines=batch_size - len(buffer) if batch_size > len(buffer) else 0)
+            st = os.stat(self.path)
         except FileNotFoundError:
-            events, new_offset = [], offset
-        except Exception:
-            logger.exception("Error while reading file; will retry")
-            events, new_offset = [], offset
+            return events  # moved away, new file not created yet: keep the old handle
+        if (st.st_dev, st.st_ino) != self.inode:
+            logger.info("%s rotated (inode %d -> %d) at offset %d; following the new file",
+                        self.path, self.inode[1], st.st_ino, self.position)
+            self.rotations += 1
+            self.close()
+            self.position = 0
+            if self._open():
+                self._read_lines(max_lines - len(events), events)
+        elif st.st_size < self.position:
+            logger.warning("%s truncated to %d bytes (offset %d); rewinding to 0", self.path, st.st_size, self.position)
+            self.position = 0
+            self.fh.seek(0)
+            self._read_lines(max_lines - len(events), events)
+        return events
+
+class SegmentTail:
+    """Segmented log directory written by the parser; the position is (segment, offset)."""
+
+    def __init__(self, directory: str, checkpoint_path: str, raw: bool = False):
+        self.reader = SegmentReader(directory)
+        self.checkpoint_path = checkpoint_path
+        self.raw = raw
+        self.position = read_segment_checkpoint(checkpoint_path)
+
+    def describe(self) -> str:
+        return f"dir={self.reader.directory} segment={self.position[0]} offset={self.position[1]}"
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.reader.directory)
+
+    def watch_target(self):
+        return self.reader.directory, lambda n: n.endswith(SEG_SUFFIX)
+
+    def close(self):
+        self.reader.close()
+
+    def bytes_behind(self) -> int:
+        seg, off = self.position
+        behind = 0
+        for s in list_segments(self.reader.directory):
+            if s >= seg:
+                try:
+                    size = os.path.getsize(segment_path(self.reader.directory, s))
+                except FileNotFoundError:
+                    continue  # removed by retention meanwhile
+                behind += max(0, size - off) if s == seg else size
+        return behind
+
+    def read(self, max_lines: int) -> list:
+        """Decoded events, or in raw mode the lines themselves (see take_line)."""
+        if max_lines <= 0:
+            return []
+        pos = self.reader.resolve(self.position)
+        if pos is None:
+            return []
+        lines, self.position = self.reader.read(pos, max_lines)
+        events = []
+        for line in lines:
+            take_line(line, events, self.raw, "segment", pos[0])
+        return events
+
+def replay_spill(spill: SpillQueue, ml_url: str, lag: Lag, session: requests.Session, raw: bool,
+                 gzip_level: int) -> bool:
+    """Ships queued batches oldest first while the detector takes them; False on the first failure."""
+    for _ in range(SPILL_REPLAY_BATCHES):
+        item = spill.peek()
+        if item is None:
+            return True
+        batch = lines_batch(item[0], raw)
+        if not ship_batch(ml_url, batch, max_retries=0, initial_backoff=0.0, session=session, raw=raw,
+                          gzip_level=gzip_level):
+            return False
+        spill.pop()
+        lag.shipped(len(batch))
+        if not len(spill):
+            logger.info("Spill queue drained")
+    return True
+
+def run_loop(source, ml_url: str, checkpoint_path: str, batch_size: int, flush_interval: float, poll_interval: float,
+             watch: str = "auto", gzip_level: int = 1, spill: Optional[SpillQueue] = None, lag: Optional[Lag] = None):
+    """Read, ship, checkpoint, one batch at a time.
+
+    With a spill queue, a batch the detector does not take after SPILL_AFTER_RETRIES
+    goes to disk and the checkpoint moves on; while the queue is not empty new
+    batches queue behind it (order is kept) and it is replayed with backoff.
+    Reading pauses while the queue is over its bound. Batch size and flush
+    interval come from lag.controller (fixed at batch_size/flush_interval unless
+    it has an SLO).
+    """
+    directory, match = source.watch_target()
+    waiter = make_waiter(watch, directory, match, poll_interval)
+    session = requests.Session()  # keep-alive: one connection instead of one per batch
+    lag = lag or Lag(source, spill)
+    control = lag.controller = lag.controller or BatchController(batch_size, flush_interval)
+    logger.info("Starting shipper: %s ml=%s checkpoint=%s wait=%s raw=%s spill=%s", source.describe(), ml_url,
+                checkpoint_path, waiter.kind, source.raw, spill.directory if spill is not None else None)
+    buffer = []
+    position = source.position
+    last_flush = time.time()
+    retry_at = 0.0
+    backoff = 0.5
+    hold = 1.0  # pause before retrying a batch that could be neither shipped nor spilled
+
+    if not source.exists():
+        logger.warning("Input %s does not exist yet. Waiting...", source.describe())
+
+    while True:
+        paused = spill is not None and spill.full()
+        events = []
+        if not paused:
+            try:
+                events = source.read(control.batch - len(buffer) if control.batch > len(buffer) else 0)
+            except Exception:
+                logger.exception("Error while reading input; will retry")
 
         if events:
+            if not buffer:
+                lag.unacked["buffer"] = time.time()
             buffer.extend(events)
-            offset = new_offset
+            position = source.position
 
         now = time.time()
+        lag.tick(now)
         should_flush = False
-        if len(buffer) >= batch_size:
+        full = len(buffer) >= control.batch
+        if full:
             should_flush = True
-        elif (now - last_flush) >= flush_interval and len(buffer) > 0:
+        elif (now - last_flush) >= control.flush_interval and len(buffer) > 0:
             should_flush = True
 
         if should_flush:
-            ok = ship_batch(ml_url, buffer)
+            if spill is not None and len(spill):
+                ok = False  # older batches are queued: this one goes behind them
+            else:
+                ok = ship_batch(ml_url, buffer, max_retries=SPILL_AFTER_RETRIES if spill is not None else 6,
+                                session=session, raw=source.raw, gzip_level=gzip_level,
+                                observe=lambda n, sec: control.observe(n, sec, full))
+                if ok:
+                    lag.shipped(len(buffer))
+            if not ok and spill is not None:
+                if not len(spill):
+                    logger.warning("Detector unavailable; spilling batches to %s", spill.directory)
+                    retry_at, backoff = time.time() + 0.5, 0.5
+                try:
+                    spill.push(batch_lines(buffer, source.raw), lag.unacked["buffer"])
+                    ok = True
+                except OSError as e:  # e.g. ENOSPC: keep the batch in memory, do not move the checkpoint
+                    logger.error("Cannot write to the spill queue: %s", e)
             if ok:
-                write_checkpoint(checkpoint_path, offset)
-                logger.info("Wrote checkpoint offset=%d", offset)
+                write_checkpoint(checkpoint_path, position)
+                logger.info("Wrote checkpoint %s", position)
                 buffer = []
+                lag.unacked.pop("buffer", None)
                 last_flush = time.time()
+                hold = 1.0
             else:
-                logger.warning("Shipping failed; will retry after delay")
-                time.sleep(1.0)
+                logger.warning("Shipping failed; will retry in %.0fs", hold)
+                time.sleep(hold)
+                if spill is not None:
+                    hold = min(hold * 2, SPILL_RETRY_MAX)
+
+        if spill is not None and len(spill) and time.time() >= retry_at:
+            if replay_spill(spill, ml_url, lag, session, source.raw, gzip_level):
+                backoff = 0.5
+            else:
+                retry_at = time.time() + backoff
+                backoff = min(backoff * 2, SPILL_RETRY_MAX)
 
         if not events:
-            time.sleep(poll_interval)
+            # with inotify this returns as soon as the input is written; a pending
+            # buffer still has to go out by its flush deadline
+            timeout = control.flush_interval - (time.time() - last_flush) if buffer else INOTIFY_RECHECK
+            if spill is not None and len(spill):
+                timeout = min(timeout, retry_at - time.time())
+            lag.tick(time.time(), force=True)
+            if paused:
+                time.sleep(max(timeout, 0.0))  # not reading anyway until the queue drains
+            else:
+                waiter.wait(max(timeout, 0.0))
+
+async def run_pipelined(source, ml_url: str, checkpoint_path: str, batch_size: int, flush_interval: float,
+                        poll_interval: float, watch: str = "auto", inflight: int = 4, gzip_level: int = 1,
+                        spill: Optional[SpillQueue] = None, lag: Optional[Lag] = None):
+    """run_loop with up to `inflight` batches on the wire at once over keep-alive connections.
+
+    Reading and cutting batches go on while earlier batches are being scored;
+    when all slots are busy the reader waits for one to free up. With a spill
+    queue a batch that fails SPILL_AFTER_RETRIES times is moved there and
+    counts as acknowledged; a separate task replays the queue in order.
+    """
+    directory, match = source.watch_target()
+    waiter = make_waiter(watch, directory, match, poll_interval)
+    lag = lag or Lag(source, spill)
+    control = lag.controller = lag.controller or BatchController(batch_size, flush_interval)
+    logger.info("Starting pipelined shipper: %s ml=%s checkpoint=%s wait=%s inflight=%d raw=%s spill=%s",
+                source.describe(), ml_url, checkpoint_path, waiter.kind, inflight, source.raw,
+                spill.directory if spill is not None else None)
+    checkpoint = OrderedCheckpoint(checkpoint_path, source.position)
+    slots = asyncio.Semaphore(inflight)
+    spilled = asyncio.Event()
+    acked = asyncio.Condition()
+    tasks = set()
+    limits = httpx.Limits(max_connections=inflight + 1, max_keepalive_connections=inflight + 1)
+
+    async with httpx.AsyncClient(timeout=8.0, limits=limits) as client:
+        def to_spill(batch: list, read_at: float):
+            if not len(spill):
+                logger.warning("Detector unavailable; spilling batches to %s", spill.directory)
+            spill.push(batch_lines(batch, source.raw), read_at)
+            spilled.set()
+
+        async def settle(seq: int, position):
+            """Acknowledges batch seq; position None marks it failed (see OrderedCheckpoint)."""
+            async with acked:
+                if checkpoint.ack(seq, position):
+                    logger.info("Wrote checkpoint %s", checkpoint.position)
+                acked.notify_all()
+
+        async def after_earlier(seq: int):
+            """Waits until every earlier batch is shipped or queued, so the spill queue stays in read order."""
+            async with acked:
+                await acked.wait_for(lambda: checkpoint.next_seq >= seq)
+
+        async def ship(seq: int, batch: list, position, full: bool):
+            done = False
+            try:
+                ok = await ship_batch_async(client, ml_url, batch, raw=source.raw, gzip_level=gzip_level,
+                                            max_retries=SPILL_AFTER_RETRIES if spill is not None else None,
+                                            observe=lambda n, sec: control.observe(n, sec, full))
+                if ok:
+                    lag.shipped(len(batch))
+                else:
+                    await after_earlier(seq)
+                    to_spill(batch, lag.unacked[seq])
+                done = True
+            except Exception:
+                logger.exception("Batch %d (%d events) was neither shipped nor spilled; "
+                                 "the checkpoint stays before it", seq, len(batch))
+            finally:
+                # settle even on an error or cancellation: later batches wait on this seq in after_earlier
+                if not done:
+                    lag.failed_batches += 1
+                await settle(seq, position if done else None)
+                lag.unacked.pop(seq, None)
+                slots.release()
+
+        async def replay():
+            backoff = 0.5
+            while True:
+                try:
+                    item = spill.peek()
+                except OSError:
+                    logger.exception("Cannot read the spill queue; retrying in %.0fs", SPILL_RETRY_MAX)
+                    await asyncio.sleep(SPILL_RETRY_MAX)
+                    continue
+                if item is None:
+                    spilled.clear()
+                    await spilled.wait()
+                    continue
+                batch = lines_batch(item[0], source.raw)
+                if await ship_batch_async(client, ml_url, batch, initial_backoff=0.0, raw=source.raw,
+                                          gzip_level=gzip_level, max_retries=0):
+                    spill.pop()
+                    lag.shipped(len(batch))
+                    backoff = 0.5
+                    if not len(spill):
+                        logger.info("Spill queue drained")
+                else:
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, SPILL_RETRY_MAX)
+
+        if spill is not None:
+            replayer = asyncio.create_task(replay())
+            tasks.add(replayer)
+            if len(spill):
+                spilled.set()
+
+        buffer = []
+        seq = 0
+        last_flush = time.time()
+        hold = 1.0  # pause before retrying a batch the spill queue could not take
+
+        if not source.exists():
+            logger.warning("Input %s does not exist yet. Waiting...", source.describe())
+
+        while True:
+            paused = spill is not None and spill.full()
+            events = []
+            if not paused:
+                try:
+                    events = source.read(control.batch - len(buffer) if control.batch > len(buffer) else 0)
+                except Exception:
+                    logger.exception("Error while reading input; will retry")
+
+            if events:
+                if not buffer:
+                    lag.unacked["buffer"] = time.time()
+                buffer.extend(events)
+
+            now = time.time()
+            lag.tick(now)
+            full = len(buffer) >= control.batch
+            if buffer and (full or (now - last_flush) >= control.flush_interval):
+                read_at = lag.unacked.pop("buffer")
+                acquired = False
+                if spill is None or not len(spill):
+                    await slots.acquire()
+                    acquired = True
+                if spill is not None and len(spill):
+                    # keep the order: behind what is already queued (possibly since we waited for a slot)
+                    if acquired:
+                        slots.release()
+                    position = source.position
+                    await after_earlier(seq)
+                    try:
+                        to_spill(buffer, read_at)
+                    except OSError as e:  # e.g. ENOSPC: keep the batch and try again
+                        logger.error("Cannot write to the spill queue: %s; will retry in %.0fs", e, hold)
+                        lag.unacked["buffer"] = read_at
+                        await asyncio.sleep(hold)
+                        hold = min(hold * 2, SPILL_RETRY_MAX)
+                        continue
+                    hold = 1.0
+                    await settle(seq, position)
+                else:
+                    lag.unacked[seq] = read_at
+                    task = asyncio.create_task(ship(seq, buffer, source.position, full))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                seq += 1
+                buffer = []
+                last_flush = time.time()
+
+            if not events:
+                timeout = control.flush_interval - (time.time() - last_flush) if buffer else INOTIFY_RECHECK
+                lag.tick(time.time(), force=True)
+                if paused:
+                    await asyncio.sleep(min(timeout, 1.0))
+                else:
+                    await waiter.wait_async(max(timeout, 0.0))
 
 def main():
     ap = argparse.ArgumentParser(description="Ship normalized JSONL events to ML /score endpoint with checkpointing")
-    ap.add_argument("--file", "-f", default="normalized.jsonl", help="JSONL input file (one JSON per line)")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--file", "-f", default="normalized.jsonl", help="JSONL input file (one JSON per line)")
+    src.add_argument("--dir", "-d", help="Segmented log directory written by the parser (OUT_DIR)")
     ap.add_argument("--ml", default="http://localhost:8001/score", help="ML scorer URL")
     ap.add_argument("--checkpoint", "-c", default=DEFAULT_CHECKPOINT, help="Checkpoint file path")
-    ap.add_argument("--batch", type=int, default=200, help="Batch size (max events to send)")
+    ap.add_argument("--batch", type=int, default=200, help="Batch size (max events to send); initial size with --slo")
     ap.add_argument("--flush-interval", type=float, default=0.5, help="Max seconds to wait before flushing a non-empty batch")
-    ap.add_argument("--poll-interval", type=float, default=0.5, help="Poll interval when no new lines")
+    ap.add_argument("--poll-interval", type=float, default=0.5, help="Poll interval when no new lines (poll mode)")
+    ap.add_argument("--watch", choices=("auto", "inotify", "poll"), default="auto",
+                    help="How to wait for new lines: inotify (Linux), poll, or auto (inotify, else poll)")
+    ap.add_argument("--inflight", type=int, default=1,
+                    help="Batches in flight at once; >1 ships asynchronously, the checkpoint advancing in order")
+    ap.add_argument("--raw", action="store_true",
+                    help="Forward lines undecoded as gzip NDJSON; an --ml URL ending in /score becomes /score-ndjson")
+    ap.add_argument("--gzip-level", type=int, default=1, help="gzip level for --raw (1 is ~7x on normalized JSONL)")
+    ap.add_argument("--spill-dir", help="Queue batches here while the detector is down and keep reading (off if unset)")
+    ap.add_argument("--spill-max-mb", type=float, default=256, help="Spill queue bound; reading pauses above it")
+    ap.add_argument("--slo", type=float, default=0.0,
+                    help="End-to-end latency target, s: adapt batch size and flush interval to the detector (0 = fixed)")
+    ap.add_argument("--batch-min", type=int, default=50, help="Smallest batch with --slo")
+    ap.add_argument("--batch-max", type=int, default=5000, help="Largest batch with --slo")
+    ap.add_argument("--metrics-port", type=int, default=0, help="Serve lag metrics on :PORT/metrics (0 = off)")
     args = ap.parse_args()
 
+    ml = args.ml
+    if args.raw and ml.rstrip("/").endswith("/score"):
+        ml = ml.rstrip("/") + "-ndjson"
+    source = (SegmentTail(args.dir, args.checkpoint, args.raw) if args.dir
+              else FileTail(args.file, args.checkpoint, args.raw))
+    spill = SpillQueue(args.spill_dir, int(args.spill_max_mb * (1 << 20))) if args.spill_dir else None
+    control = BatchController(args.batch, args.flush_interval, args.slo, args.batch_min, args.batch_max)
+    lag = Lag(source, spill, control)
+    if args.metrics_port:
+        serve_metrics(args.metrics_port, lag)
     try:
-        run_loop(args.file, args.ml, args.checkpoint, args.batch, args.flush_interval, args.poll_interval)
+        if args.inflight > 1:
+            asyncio.run(run_pipelined(source, ml, args.checkpoint, args.batch, args.flush_interval,
+                                      args.poll_interval, args.watch, args.inflight, args.gzip_level, spill, lag))
+        else:
+            run_loop(source, ml, args.checkpoint, args.batch, args.flush_interval, args.poll_interval,
+                     args.watch, args.gzip_level, spill, lag)
     except KeyboardInterrupt:
         logger.info("Interrupted by user, exiting")
+    finally:
+        source.close()
 
 if __name__ == "__main__":
     main()
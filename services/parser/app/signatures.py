@@ -0,0 +1,169 @@
+# services/parser/app/signatures.py
+"""
+Сигнатуры (IOC, маркеры web-shell'ов, строки эксплойтов) и автомат Ахо—Корасик:
+все шаблоны ищутся за один проход по строке, в ответ — имена сработавших.
+
+Файл сигнатур: одна на строку, "#" — комментарий; "имя<TAB>шаблон" или просто шаблон
+(тогда имя = шаблон). Сравнение с учётом регистра, шаблоны — литералы.
+При изменении файла автомат пересобирается в фоновом потоке и подменяется целиком;
+пока идёт сборка, поиск работает по старому.
+"""
+import logging, os, threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# до стольких шаблонов быстрее str.__contains__ по каждому (C-цикл), автомат строим, но не используем
+SIGNATURES_SMALL_SET = int(os.environ.get("SIGNATURES_SMALL_SET", "32"))
+
+log = logging.getLogger("signatures")
+
+
+def read_signatures(path: str) -> List[Tuple[str, str]]:
+    out = []
+    with open(path, encoding="utf-8") as fh:
+        for raw in fh:
+            line = raw.rstrip("\r\n")
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            name, sep, pattern = line.partition("\t")
+            out.append((name, pattern) if sep and pattern else (line, line))
+    return out
+
+
+class Automaton:
+    """Ахо—Корасик: goto — dict на состояние, fail-ссылки, out — индексы шаблонов (с учётом fail-цепочки)."""
+    __slots__ = ("names", "goto", "fail", "out", "literals")
+
+    def __init__(self, patterns: List[Tuple[str, str]], small_set: int = SIGNATURES_SMALL_SET):
+        self.names = [name for name, _p in patterns]
+        self.literals = tuple((i, p) for i, (_n, p) in enumerate(patterns) if p) \
+            if len(patterns) <= small_set else None
+        goto: List[Dict[str, int]] = [{}]
+        out: List[Tuple[int, ...]] = [()]
+        for idx, (_name, pattern) in enumerate(patterns):
+            if not pattern:
+                continue
+            s = 0
+            for ch in pattern:
+                nxt = goto[s].get(ch)
+                if nxt is None:
+                    nxt = goto[s][ch] = len(goto)
+                    goto.append({})
+                    out.append(())
+                s = nxt
+            out[s] += (idx,)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            s = queue.popleft()
+            for ch, t in goto[s].items():
+                queue.append(t)
+                f = fail[s]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[t] = goto[f].get(ch, 0)
+                if out[fail[t]]:
+                    out[t] += out[fail[t]]
+        self.goto, self.fail, self.out = goto, fail, out
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def search(self, text: str) -> List[str]:
+        """Имена всех сигнатур, встретившихся в text (в порядке файла, без повторов)."""
+        if self.literals is not None:
+            names = self.names
+            return [names[i] for i, p in self.literals if p in text]
+        goto, fail, out = self.goto, self.fail, self.out
+        root = goto[0]
+        s = 0
+        found = None
+        for ch in text:
+            if s == 0:
+                s = root.get(ch, 0)
+            else:
+                while True:
+                    nxt = goto[s].get(ch)
+                    if nxt is not None:
+                        s = nxt
+                        break
+                    s = fail[s]
+                    if s == 0:
+                        s = root.get(ch, 0)
+                        break
+            if out[s]:
+                if found is None:
+                    found = set()
+                found.update(out[s])
+        if found is None:
+            return []
+        names = self.names
+        return [names[i] for i in sorted(found)]
+
+
+class SignatureSet:
+    """Файл сигнатур + текущий автомат. find() не блокируется пересборкой."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.automaton = Automaton([])
+        self.mtime: Optional[float] = None
+        self.builds = 0
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._building = False
+        self._rebuild()  # первая сборка синхронно — правило работает сразу
+
+    def find(self, text: str) -> List[str]:
+        return self.automaton.search(text)
+
+    def maybe_rebuild(self) -> bool:
+        """Если файл изменился — запускает сборку в фоне. True, если сборка запущена."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        with self._lock:
+            if mtime == self.mtime or self._building:
+                return False
+            self._building = True
+        threading.Thread(target=self._rebuild, name="signatures-rebuild", daemon=True).start()
+        return True
+
+    def _rebuild(self):
+        mtime = None
+        try:
+            mtime = os.stat(self.path).st_mtime
+            automaton = Automaton(read_signatures(self.path))
+        except (OSError, ValueError) as e:
+            self.error = f"{type(e).__name__}: {e}"
+            log.error("signatures: cannot load %s, keeping previous set: %s", self.path, self.error)
+        else:
+            self.automaton = automaton  # подмена одной ссылкой
+            self.error = None
+            self.builds += 1
+            log.info("signatures: %d patterns from %s", len(automaton), self.path)
+        finally:
+            if mtime is not None:
+                self.mtime = mtime  # ту же ошибку не повторяем до следующего изменения файла
+            with self._lock:
+                self._building = False
+
+    def stats(self) -> dict:
+        return {"path": self.path, "patterns": len(self.automaton), "states": len(self.automaton.goto),
+                "builds": self.builds, "error": self.error}
+
+
+_sets: Dict[str, SignatureSet] = {}
+_sets_lock = threading.Lock()
+
+
+def signature_set(path: str) -> SignatureSet:
+    """Один SignatureSet на файл: перезагрузка правил не пересобирает автомат заново."""
+    path = os.path.abspath(path)
+    with _sets_lock:
+        s = _sets.get(path)
+        if s is None:
+            s = _sets[path] = SignatureSet(path)
+        return s
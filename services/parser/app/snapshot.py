@@ -0,0 +1,182 @@
+# services/parser/app/snapshot.py
+"""
+Снимки состояния RuleEngine (окна правил, открытые агрегаты инцидентов, recent_incidents),
+чтобы рестарт или выкатка парсера не обнуляли окна и /incidents.
+
+Формат файла: MAGIC, затем кадры <длина, crc32> + zlib(pickle(часть)), последний — ("end", N).
+Пишется во временный файл, fsync, os.replace — как shipper.write_checkpoint: на диске
+всегда либо прежний снимок, либо новый целиком. Файл без "end" или с битым кадром
+отбрасывается целиком, парсер стартует с пустым состоянием.
+
+Не останавливаем /ingest: части состояния снимаются в event loop по RULE_SNAPSHOT_CHUNK
+ключей с отдачей управления между ними; каждая часть сразу сериализуется в bytes, и её
+кортежи тут же освобождаются — иначе миллионы живых кортежей запускают сборку GC по всей
+куче окон (сотни мс простоя). Сжатие, запись и fsync — в отдельном потоке.
+Снимок — доверенный локальный файл сервиса (pickle), а не формат обмена.
+"""
+import asyncio, logging, os, pickle, struct, time, zlib
+from typing import List, Optional
+
+RULE_SNAPSHOT_FILE = os.environ.get("RULE_SNAPSHOT_FILE", "/app/data/rules.snapshot")  # пусто — без снимков
+RULE_SNAPSHOT_INTERVAL = float(os.environ.get("RULE_SNAPSHOT_INTERVAL", "30"))         # сек
+RULE_SNAPSHOT_CHUNK = int(os.environ.get("RULE_SNAPSHOT_CHUNK", "1000"))               # ключей на часть
+
+MAGIC = b"SHAISNP1"
+_FRAME = struct.Struct("<II")  # длина, crc32 сжатых данных
+
+log = logging.getLogger("snapshot")
+
+
+def dump_part(part: tuple) -> bytes:
+    return pickle.dumps(part, pickle.HIGHEST_PROTOCOL)
+
+
+def write_snapshot(path: str, blobs: List[bytes]) -> int:
+    """Атомарно записывает части снимка (уже из dump_part); возвращает размер файла."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(MAGIC)
+        for blob in blobs + [dump_part(("end", len(blobs)))]:
+            data = zlib.compress(blob, 1)
+            fh.write(_FRAME.pack(len(data), zlib.crc32(data)))
+            fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+        size = fh.tell()
+    os.replace(tmp, path)
+    return size
+
+
+def read_snapshot(path: str) -> List[tuple]:
+    """Части снимка без завершающего "end". ValueError — если файл битый или неполный."""
+    parts = []
+    with open(path, "rb") as fh:
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a rules snapshot")
+        while True:
+            head = fh.read(_FRAME.size)
+            if len(head) < _FRAME.size:
+                raise ValueError(f"{path}: truncated after {len(parts)} parts")
+            n, crc = _FRAME.unpack(head)
+            data = fh.read(n)
+            if len(data) < n or zlib.crc32(data) != crc:
+                raise ValueError(f"{path}: corrupt part {len(parts)}")
+            part = pickle.loads(zlib.decompress(data))
+            if part[0] == "end":
+                if part[1] != len(parts):
+                    raise ValueError(f"{path}: expected {part[1]} parts, got {len(parts)}")
+                return parts
+            parts.append(part)
+
+
+class Snapshotter:
+    """Периодические снимки RuleEngine: restore() при старте, start()/stop() — в lifespan."""
+
+    def __init__(self, engine, path: str = RULE_SNAPSHOT_FILE, interval: float = RULE_SNAPSHOT_INTERVAL,
+                 chunk: int = RULE_SNAPSHOT_CHUNK):
+        self.engine = engine
+        self.path = path
+        self.interval = interval
+        self.chunk = chunk
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+
+        # метрики
+        self.saves = 0
+        self.last_bytes = 0
+        self.last_capture_ms = 0.0   # снятие и сериализация частей в event loop (с отдачей управления)
+        self.max_step_ms = 0.0       # самая долгая часть — столько event loop был занят подряд
+        self.last_write_ms = 0.0
+        self.last_saved_at: Optional[float] = None
+        self.restored: Optional[dict] = None
+        self.error: Optional[str] = None
+
+    def restore(self) -> Optional[dict]:
+        """Поднимает состояние из снимка, если он есть. Битый снимок — в лог, стартуем с пустым."""
+        if not self.path or not os.path.exists(self.path):
+            return None
+        t0 = time.perf_counter()
+        try:
+            # снимок прежней версии может не распаковаться или не лечь на нынешние классы
+            # (AttributeError, TypeError, ModuleNotFoundError ...) — любая ошибка не должна ронять старт
+            self.restored = self.engine.restore_parts(read_snapshot(self.path))
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            log.error("cannot restore rules state from %s, starting empty: %s", self.path, self.error)
+            self.engine.reset_state()  # restore_parts мог успеть перенести часть снимка
+            self.restored = None
+            return None
+        self.restored["ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+        log.info("restored rules state from %s: %s", self.path, self.restored)
+        return self.restored
+
+    async def save(self) -> int:
+        t0 = time.perf_counter()
+        blobs: List[bytes] = []
+        step_max = 0.0
+        it = self.engine.snapshot_parts(self.chunk)
+        while True:
+            s0 = time.perf_counter()
+            part = next(it, None)
+            if part is None:
+                break
+            blobs.append(dump_part(part))
+            del part
+            step_max = max(step_max, time.perf_counter() - s0)
+            await asyncio.sleep(0)  # между частями обслуживаем /ingest
+        t1 = time.perf_counter()
+        size = await asyncio.to_thread(write_snapshot, self.path, blobs)
+        self.last_capture_ms = (t1 - t0) * 1000.0
+        self.max_step_ms = max(self.max_step_ms, step_max * 1000.0)
+        self.last_write_ms = (time.perf_counter() - t1) * 1000.0
+        self.last_bytes = size
+        self.last_saved_at = time.time()
+        self.saves += 1
+        self.error = None
+        return size
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                break
+            try:
+                await self.save()
+            except Exception as e:  # снимок не должен ронять сервис
+                self.error = f"{type(e).__name__}: {e}"
+                log.error("rules snapshot to %s failed: %s", self.path, self.error)
+
+    async def start(self):
+        if self.path and self.interval > 0:
+            self._stop = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дожидается текущего снимка и пишет последний — при плавной остановке окна не теряются."""
+        if self._task is not None:
+            self._stop.set()
+            await self._task
+            self._task = None
+        if self.path:
+            try:
+                await self.save()
+            except Exception as e:
+                log.error("final rules snapshot to %s failed: %s", self.path, e)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path or None,
+            "interval": self.interval,
+            "saves": self.saves,
+            "last_bytes": self.last_bytes,
+            "last_capture_ms": round(self.last_capture_ms, 3),
+            "max_step_ms": round(self.max_step_ms, 3),
+            "last_write_ms": round(self.last_write_ms, 3),
+            "last_saved_at": self.last_saved_at,
+            "restored": self.restored,
+            "error": self.error,
+        }
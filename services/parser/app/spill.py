@@ -0,0 +1,100 @@
+# services/parser/app/spill.py
+"""
+Durable, bounded FIFO of batches on disk for shipper.py.
+
+When the detector is down the shipper moves batches here and keeps reading;
+once it is back they are replayed oldest first. One file per batch,
+<seq>-<read_ms>.jsonl (JSONL lines as read; read_ms is when the batch's
+first line was read), written to a .tmp file, fsynced and renamed, so a
+batch is either fully in the queue or not at all. Files left by a previous
+run are picked up on start.
+"""
+import logging, os
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+SPILL_SUFFIX = ".jsonl"
+
+log = logging.getLogger("spill")
+
+
+class SpillQueue:
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.spilled = 0    # batches written since start
+        self.replayed = 0   # batches removed after the detector accepted them
+        self._items: Deque[Tuple[int, str, int, float]] = deque()  # (seq, path, size, read_at)
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if name.endswith(".tmp"):
+                os.unlink(path)  # crashed mid-write: the batch was never acknowledged to the reader
+                continue
+            seq, _, read_ms = name[:-len(SPILL_SUFFIX)].partition("-")
+            if not name.endswith(SPILL_SUFFIX) or not seq.isdigit() or not read_ms.isdigit():
+                continue
+            size = os.path.getsize(path)
+            self._items.append((int(seq), path, size, int(read_ms) / 1000.0))
+            self.bytes += size
+        self._next = self._items[-1][0] + 1 if self._items else 0
+        if self._items:
+            log.warning("spill: %d batch(es), %d bytes left from a previous run in %s",
+                        len(self._items), self.bytes, directory)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def full(self) -> bool:
+        return self.bytes >= self.max_bytes
+
+    def oldest(self) -> Optional[float]:
+        """Read time of the oldest queued batch."""
+        return self._items[0][3] if self._items else None
+
+    def push(self, lines: List[bytes], read_at: float):
+        seq = self._next
+        self._next += 1
+        path = os.path.join(self.directory, f"{seq:012d}-{int(read_at * 1000)}{SPILL_SUFFIX}")
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "wb") as fh:
+                fh.writelines(lines)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.unlink(tmp)  # e.g. ENOSPC: don't leave a partial file taking up the space
+            except OSError:
+                pass
+            raise
+        dfd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dfd)  # the rename itself must survive a crash before the input checkpoint moves
+        finally:
+            os.close(dfd)
+        size = os.path.getsize(path)
+        self._items.append((seq, path, size, read_at))
+        self.bytes += size
+        self.spilled += 1
+
+    def peek(self) -> Optional[Tuple[List[bytes], float]]:
+        """(lines, read_at) of the oldest batch, without removing it."""
+        if not self._items:
+            return None
+        _seq, path, _size, read_at = self._items[0]
+        with open(path, "rb") as fh:
+            return fh.readlines(), read_at
+
+    def pop(self):
+        _seq, path, size, _read_at = self._items.popleft()
+        os.unlink(path)
+        self.bytes -= size
+        self.replayed += 1
+
+    def stats(self) -> dict:
+        return {"batches": len(self._items), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "spilled": self.spilled, "replayed": self.replayed}
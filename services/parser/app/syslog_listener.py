@@ -0,0 +1,214 @@
+# services/parser/app/syslog_listener.py
+"""
+Приём syslog напрямую (без HTTP): RFC 3164 / RFC 5424 по UDP и TCP
+(octet counting по RFC 6587, плюс построчный non-transparent framing).
+Сообщения приводятся к строке, понятной detect_and_parse, копятся в буфер
+и отдаются обработчику пачками.
+"""
+import asyncio, logging, os
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from parser_normalizer import FORMATS
+
+SYSLOG_HOST = os.environ.get("SYSLOG_HOST", "0.0.0.0")
+SYSLOG_UDP_PORT = int(os.environ.get("SYSLOG_UDP_PORT", "5514"))      # 0 = выключен
+SYSLOG_TCP_PORT = int(os.environ.get("SYSLOG_TCP_PORT", "5514"))      # 0 = выключен
+SYSLOG_BATCH = int(os.environ.get("SYSLOG_BATCH", "500"))
+SYSLOG_FLUSH_INTERVAL = float(os.environ.get("SYSLOG_FLUSH_INTERVAL", "0.2"))
+SYSLOG_QUEUE_MAX = int(os.environ.get("SYSLOG_QUEUE_MAX", "50000"))   # сверх — дропаем
+SYSLOG_MAX_MSG = int(os.environ.get("SYSLOG_MAX_MSG", "65536"))
+
+MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+log = logging.getLogger("syslog")
+
+
+def _known_format(line: str) -> bool:
+    return any(sniff(line) for _name, sniff, _parse, _seconds in FORMATS)
+
+
+def _strip_pri(msg: str) -> str:
+    if msg.startswith("<"):
+        end = msg.find(">", 1, 6)
+        if end > 1 and msg[1:end].isdigit():
+            return msg[end + 1:]
+    return msg
+
+
+def _skip_sd(rest: str) -> str:
+    """Пропускает STRUCTURED-DATA RFC 5424 ('-' или [..][..]) и возвращает MSG."""
+    if rest.startswith("-"):
+        return rest[2:]
+    i, n = 0, len(rest)
+    while i < n and rest[i] == "[":
+        i += 1
+        quoted = False
+        while i < n and (quoted or rest[i] != "]"):
+            if rest[i] == "\\":
+                i += 1
+            elif rest[i] == '"':
+                quoted = not quoted
+            i += 1
+        i += 1
+    return rest[i + 1:] if i < n else ""
+
+
+def _from_5424(body: str) -> str:
+    # 1 TIMESTAMP HOSTNAME APP-NAME PROCID MSGID SD [MSG]
+    parts = body.split(" ", 6)
+    if len(parts) < 7:
+        return body
+    _ver, ts, host, app, procid, _msgid, rest = parts
+    msg = _skip_sd(rest).lstrip("\ufeff")
+    if _known_format(msg):
+        return msg
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00")).astimezone(timezone.utc)
+        stamp = f"{MONTH_NAMES[dt.month - 1]} {dt.day:>2} {dt:%H:%M:%S}"
+    except ValueError:
+        stamp = ts
+    tag = app if procid == "-" else f"{app}[{procid}]"
+    return f"{stamp} {host} {tag}: {msg}"
+
+
+def syslog_to_line(raw: str) -> str:
+    """
+    Приводит syslog-сообщение к строке для detect_and_parse:
+    RFC 3164 — просто срезаем <PRI> ('Sep 20 12:01:33 host sshd[1]: ...');
+    RFC 5424 — собираем такой же заголовок из TIMESTAMP/HOST/APP/PROCID.
+    Если в MSG лежит строка одного из наших форматов (firewall/app) — берём её.
+    """
+    body = _strip_pri(raw.rstrip("\r\n"))
+    if body.startswith("1 "):
+        return _from_5424(body)
+    if _known_format(body):
+        return body
+    # 3164 с нестандартным заголовком: пробуем MSG после 'TAG: '
+    i = body.find(": ")
+    if i != -1 and _known_format(body[i + 2:]):
+        return body[i + 2:]
+    return body
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: "SyslogServer"):
+        self.server = server
+
+    def datagram_received(self, data: bytes, addr):
+        self.server._offer("udp", data)
+
+    def error_received(self, exc):
+        self.server.stats["udp"]["errors"] += 1
+
+
+class SyslogServer:
+    """UDP/TCP syslog-листенеры с общим буфером и пакетной передачей в handler(lines)."""
+
+    def __init__(self, handler: Callable[[List[str]], Awaitable[object]], host: str = SYSLOG_HOST,
+                 udp_port: int = SYSLOG_UDP_PORT, tcp_port: int = SYSLOG_TCP_PORT,
+                 batch: int = SYSLOG_BATCH, flush_interval: float = SYSLOG_FLUSH_INTERVAL,
+                 queue_max: int = SYSLOG_QUEUE_MAX, max_msg: int = SYSLOG_MAX_MSG):
+        self.handler = handler
+        self.host = host
+        self.udp_port = udp_port
+        self.tcp_port = tcp_port
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.queue_max = queue_max
+        self.max_msg = max_msg
+
+        self.stats: Dict[str, Dict[str, int]] = {
+            "udp": {"received": 0, "dropped": 0, "bad_frames": 0, "errors": 0},
+            "tcp": {"received": 0, "dropped": 0, "bad_frames": 0, "errors": 0, "connections": 0},
+        }
+        self._buf: List[str] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._udp: Optional[asyncio.DatagramTransport] = None
+        self._tcp: Optional[asyncio.AbstractServer] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        if self.udp_port:
+            self._udp, _ = await loop.create_datagram_endpoint(
+                lambda: _UDPProtocol(self), local_addr=(self.host, self.udp_port))
+            log.info("syslog UDP listening on %s:%d", self.host, self.udp_port)
+        if self.tcp_port:
+            self._tcp = await asyncio.start_server(self._handle_tcp, self.host, self.tcp_port)
+            log.info("syslog TCP listening on %s:%d", self.host, self.tcp_port)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._udp is not None:
+            self._udp.close()
+        if self._tcp is not None:
+            self._tcp.close()
+            await self._tcp.wait_closed()
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+
+    def snapshot(self) -> dict:
+        return {"buffered": len(self._buf), **{k: dict(v) for k, v in self.stats.items()}}
+
+    def _offer(self, name: str, data: bytes):
+        st = self.stats[name]
+        st["received"] += 1
+        if len(self._buf) >= self.queue_max:
+            st["dropped"] += 1
+            return
+        self._buf.append(syslog_to_line(data.decode("utf-8", errors="ignore")))
+        if len(self._buf) >= self.batch:
+            self._wake.set()
+
+    async def _drain(self):
+        if not self._buf:
+            return
+        lines, self._buf = self._buf, []
+        try:
+            await self.handler(lines)
+        except Exception:
+            log.exception("syslog batch handler failed; %d lines lost", len(lines))
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self._drain()
+        await self._drain()
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        st = self.stats["tcp"]
+        st["connections"] += 1
+        try:
+            while True:
+                first = await reader.readexactly(1)
+                if first.isdigit():
+                    # octet counting: "LEN SP MSG"
+                    digits = first + (await reader.readuntil(b" "))[:-1]
+                    if not digits.isdigit() or int(digits) > self.max_msg:
+                        st["bad_frames"] += 1
+                        break
+                    msg = await reader.readexactly(int(digits))
+                elif first in (b"\n", b"\r", b"\0"):
+                    continue
+                else:
+                    # non-transparent framing: сообщение до \n
+                    msg = first + await reader.readuntil(b"\n")
+                self._offer("tcp", msg)
+        except asyncio.IncompleteReadError:
+            pass
+        except asyncio.LimitOverrunError:
+            st["bad_frames"] += 1
+        except ConnectionError:
+            st["errors"] += 1
+        finally:
+            writer.close()
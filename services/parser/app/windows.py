@@ -0,0 +1,256 @@
+# services/parser/app/windows.py
+"""
+Скользящие окна для RuleEngine.
+
+CounterWindow — счётчик событий за окно на кольцевом буфере корзин фиксированной
+ширины: память на ключ O(window/resolution), добавление и счёт — O(1) амортизированно
+(кол-во обнулённых корзин за всё время не больше числа прошедших корзин).
+Корзин на одну больше, чем window/resolution, поэтому окно получается от window
+до window+resolution: по сравнению с точным deque может учесть чуть больше, но не меньше.
+
+KeyedWindows — окна по ключам (IP, пара src/dst, ...) с вытеснением: ключ без
+событий дольше idle секунд (его окно уже пусто) удаляется при sweep(watermark),
+а при превышении max_keys вытесняются самые давно не обновлявшиеся ключи.
+
+Снимок окна (dump) — список (t, x), которые при повторной подаче в add(t, x) нового
+окна дают то же состояние: так снимок не зависит от внутреннего устройства окна
+и переживает смену разрешения корзин или RULE_SCAN_MAX_PORTS.
+"""
+import math, os
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Generic, Hashable, Iterable, Iterator, List, Tuple, TypeVar
+
+RULE_WINDOW_RESOLUTION = float(os.environ.get("RULE_WINDOW_RESOLUTION", "1.0"))  # сек на корзину
+RULE_WINDOW_MAX_BUCKETS = int(os.environ.get("RULE_WINDOW_MAX_BUCKETS", "60"))    # длинные окна — шире корзины
+
+
+def bucket_width(window: float, resolution: float = RULE_WINDOW_RESOLUTION,
+                 max_buckets: int = RULE_WINDOW_MAX_BUCKETS) -> float:
+    return max(resolution, window / max_buckets)
+
+
+class CounterWindow:
+    __slots__ = ("width", "n", "counts", "head", "total", "lo", "hi")
+
+    def __init__(self, window: float, width: float = 0.0):
+        self.width = width or bucket_width(window)
+        self.n = int(math.ceil(window / self.width)) + 1
+        self.counts = [0] * self.n
+        self.head = None   # номер самой новой корзины (t // width)
+        self.total = 0
+        self.lo, self.hi = 1.0, 0.0  # границы корзины head по времени (пусто, пока head нет)
+
+    def _advance(self, b: int):
+        n = self.n
+        if b - self.head >= n:
+            if self.total:
+                self.counts[:] = [0] * n
+                self.total = 0
+        else:
+            counts = self.counts
+            for i in range(self.head + 1, b + 1):
+                j = i % n
+                if counts[j]:
+                    self.total -= counts[j]
+                    counts[j] = 0
+        self._set_head(b)
+
+    def _set_head(self, b: int):
+        self.head = b
+        self.lo = b * self.width
+        self.hi = self.lo + self.width
+
+    def add(self, t: float, k: int = 1) -> int:
+        """Учитывает k событий в момент t (epoch-сек) и возвращает сумму за окно."""
+        if self.lo <= t < self.hi:
+            # частый случай: та же корзина, что и у предыдущего события
+            self.counts[self.head % self.n] += k
+        else:
+            b = int(t // self.width)
+            head = self.head
+            if head is None:
+                self._set_head(b)
+            elif b > head:
+                self._advance(b)
+            elif b <= head - self.n:
+                return self.total  # старше окна — не учитываем
+            self.counts[b % self.n] += k
+        self.total += k
+        return self.total
+
+    def dump(self) -> List[Tuple[float, int]]:
+        """Непустые корзины как (середина корзины, счёт)."""
+        if self.head is None:
+            return []
+        head, n, w, counts = self.head, self.n, self.width, self.counts
+        if not self.total:
+            return []
+        if counts[head % n] == self.total:  # частый случай: всё в последней корзине
+            return [((head + 0.5) * w, self.total)]
+        # корзина по индексу j: head - (head - j) % n
+        return sorted(((head - (head - j) % n + 0.5) * w, c) for j, c in enumerate(counts) if c)
+
+    def count(self, now: float) -> int:
+        """Сумма за окно, заканчивающееся в now."""
+        if self.head is not None:
+            b = int(now // self.width)
+            if b > self.head:
+                self._advance(b)
+        return self.total
+
+    def __len__(self) -> int:
+        return self.total
+
+
+class DistinctWindow:
+    """
+    Число различных значений за окно (порт-скан): deque (t, value) + мультимножество
+    value -> сколько раз встречается в окне. Счёт — len(counts), O(1).
+    """
+    __slots__ = ("window", "events", "counts")
+
+    def __init__(self, window: float):
+        self.window = window
+        self.events: Deque[Tuple[float, Hashable]] = deque()
+        self.counts: Dict[Hashable, int] = {}
+
+    def add(self, t: float, value: Hashable) -> int:
+        events, counts = self.events, self.counts
+        events.append((t, value))
+        counts[value] = counts.get(value, 0) + 1
+        lim = t - self.window
+        while events[0][0] < lim:
+            _t, old = events.popleft()
+            c = counts[old] - 1
+            if c:
+                counts[old] = c
+            else:
+                del counts[old]
+        return len(counts)
+
+    def dump(self) -> List[Tuple[float, Hashable]]:
+        return list(self.events)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+
+class BoundedDistinctWindow:
+    """
+    Экономный вариант для очень широких сканов: храним только последнее время
+    каждого значения (LRU), не больше cap штук. Память O(min(различных, cap))
+    вместо O(событий); при переполнении счёт упирается в cap («не меньше cap»).
+    """
+    __slots__ = ("window", "cap", "last_seen")
+
+    def __init__(self, window: float, cap: int):
+        self.window = window
+        self.cap = cap
+        self.last_seen: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def add(self, t: float, value: Hashable) -> int:
+        seen = self.last_seen
+        last = seen.get(value)
+        if last is None or t >= last:
+            seen[value] = t
+            seen.move_to_end(value)
+        lim = t - self.window
+        while seen and next(iter(seen.values())) < lim:
+            seen.popitem(last=False)
+        while len(seen) > self.cap:
+            seen.popitem(last=False)
+        return len(seen)
+
+    def dump(self) -> List[Tuple[float, Hashable]]:
+        return [(t, v) for v, t in self.last_seen.items()]
+
+    def __len__(self) -> int:
+        return len(self.last_seen)
+
+
+W = TypeVar("W")
+
+
+class KeyedWindows(Generic[W]):
+    """
+    OrderedDict key -> [окно, время последнего события], упорядоченный по этому времени
+    (LRU). Поэтому sweep смотрит только в начало: O(1 + удалённых).
+    Событие из прошлого (t меньше последнего) порядок не меняет.
+    """
+    __slots__ = ("factory", "idle", "max_keys", "items", "evicted_idle", "evicted_cap")
+
+    def __init__(self, factory: Callable[[], W], idle: float, max_keys: int = 0):
+        self.factory = factory
+        self.idle = idle
+        self.max_keys = max_keys      # 0 = без лимита
+        self.items: "OrderedDict[Hashable, list]" = OrderedDict()
+        self.evicted_idle = 0
+        self.evicted_cap = 0
+
+    def touch(self, key: Hashable, t: float) -> W:
+        """Окно для key (создаётся при первом обращении); отмечает событие в момент t."""
+        items = self.items
+        it = items.get(key)
+        if it is None:
+            w = self.factory()
+            items[key] = [w, t]
+            if self.max_keys and len(items) > self.max_keys:
+                items.popitem(last=False)
+                self.evicted_cap += 1
+            return w
+        if t > it[1]:
+            it[1] = t
+            items.move_to_end(key)
+        return it[0]
+
+    def sweep(self, watermark: float) -> int:
+        """Удаляет ключи без событий за последние idle секунд до watermark."""
+        items = self.items
+        lim = watermark - self.idle
+        n = 0
+        while items:
+            _key, (_w, last) = next(iter(items.items()))
+            if last >= lim:
+                break
+            items.popitem(last=False)
+            n += 1
+        self.evicted_idle += n
+        return n
+
+    def dump(self, chunk: int = 5000) -> Iterator[List[tuple]]:
+        """
+        Снимок частями по chunk ключей: (key, время последнего события, dump окна), в порядке LRU.
+        Между частями вызывающий может отдать управление — каждое окно снимается целиком.
+        """
+        items = self.items
+        keys = list(items)  # только ключи: без лишних живых кортежей (key, it) на всю карту
+        for i in range(0, len(keys), chunk):
+            # ключ, вытесненный между частями, пропускаем
+            yield [(key, it[1], it[0].dump()) for key in keys[i:i + chunk] for it in (items.get(key),) if it is not None]
+
+    def restore(self, key: Hashable, last: float, pairs: Iterable[tuple]):
+        """Восстанавливает ключ из снимка (в конец LRU), переигрывая dump окна."""
+        w = self.factory()
+        for t, x in pairs:
+            w.add(t, x)
+        self.items[key] = [w, last]
+        self.items.move_to_end(key)
+        if self.max_keys and len(self.items) > self.max_keys:
+            self.items.popitem(last=False)
+            self.evicted_cap += 1
+
+    def get(self, key: Hashable):
+        it = self.items.get(key)
+        return it[0] if it is not None else None
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.items
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self.items)
+
+    def stats(self) -> dict:
+        return {"live": len(self.items), "evicted_idle": self.evicted_idle, "evicted_cap": self.evicted_cap}
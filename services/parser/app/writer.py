@@ -0,0 +1,197 @@
+# services/parser/app/writer.py
+import asyncio, json, logging, os, time
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional
+
+WRITER_QUEUE_MAX = int(os.environ.get("WRITER_QUEUE_MAX", "50000"))          # событий в очереди
+WRITER_FLUSH_BYTES = int(os.environ.get("WRITER_FLUSH_BYTES", str(1 << 20)))  # сброс по объёму
+WRITER_FLUSH_INTERVAL = float(os.environ.get("WRITER_FLUSH_INTERVAL", "0.2")) # сброс по времени, сек
+WRITER_FSYNC = os.environ.get("WRITER_FSYNC", "none")                          # none | always | interval
+WRITER_FSYNC_INTERVAL = float(os.environ.get("WRITER_FSYNC_INTERVAL", "1.0"))
+
+_STOP = object()
+
+log = logging.getLogger("writer")
+
+
+class JsonlWriter:
+    """
+    Групповая запись JSONL (group commit).
+    Обработчики кладут (path, obj) в ограниченную очередь, фоновая задача
+    копит их и пишет одним write() на файл — по объёму (flush_bytes) или
+    по времени (flush_interval). Файлы держим открытыми всё время жизни.
+    Вместо файла под ключом path можно зарегистрировать sink (add_sink) —
+    объект с append(lines) -> bytes, sync() и close(), например SegmentedLog.
+    Ошибка записи (ENOSPC, EACCES, нет каталога) теряет только записи этого
+    пути в этом сбросе: она логируется и считается в errors/dropped, задача
+    живёт дальше, файл откроется заново при следующем сбросе.
+    """
+
+    def __init__(self, max_queue: int = WRITER_QUEUE_MAX, flush_bytes: int = WRITER_FLUSH_BYTES,
+                 flush_interval: float = WRITER_FLUSH_INTERVAL, fsync: str = WRITER_FSYNC,
+                 fsync_interval: float = WRITER_FSYNC_INTERVAL,
+                 json_default: Optional[Callable[[Any], Any]] = None):
+        if fsync not in ("none", "always", "interval"):
+            raise ValueError(f"unknown fsync policy: {fsync}")
+        self.max_queue = max_queue
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.json_default = json_default  # сериализация не-dict объектов (NormalizedEvent)
+
+        self._q: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._files: Dict[str, BinaryIO] = {}
+        self._sinks: Dict[str, Any] = {}
+        self._last_fsync = time.monotonic()
+
+        # метрики
+        self.flushes = 0
+        self.records = 0
+        self.bytes = 0
+        self.errors = 0    # неудачные записи (путь x сброс) и несериализуемые объекты
+        self.dropped = 0   # записи, потерянные из-за них
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    async def start(self):
+        self._q = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописывает всё, что уже в очереди, и закрывает файлы."""
+        if self._task is None:
+            return
+        await self._q.put(_STOP)
+        await self._task
+        self._task = None
+        for fh in self._files.values():
+            if self.fsync != "none":
+                os.fsync(fh.fileno())
+            fh.close()
+        self._files.clear()
+        for sink in self._sinks.values():
+            if self.fsync != "none":
+                sink.sync()
+            sink.close()
+
+    def add_sink(self, path: str, sink: Any):
+        """Записи для path пойдут в sink.append(lines) вместо файла."""
+        self._sinks[path] = sink
+
+    async def write(self, path: str, objs: Iterable[Any]):
+        """Ставит объекты в очередь; при заполненной очереди ждёт (backpressure).
+        Если фоновая задача умерла, бросает RuntimeError, а не ждёт вечно."""
+        q, task = self._q, self._task
+        if task is None or task.done():
+            raise RuntimeError("writer is not running")
+        for obj in objs:
+            await q.put((path, obj))
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._q.qsize() if self._q else 0,
+            "queue_max": self.max_queue,
+            "flushes": self.flushes,
+            "records": self.records,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+            "fsync": self.fsync,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._q.get()
+            if item is _STOP:
+                break
+            pending: Dict[str, List[str]] = {}
+            size = 0
+            deadline = loop.time() + self.flush_interval
+            while True:
+                path, obj = item
+                try:
+                    s = json.dumps(obj, ensure_ascii=False, default=self.json_default) + "\n"
+                except (TypeError, ValueError) as e:
+                    self.errors += 1
+                    self.dropped += 1
+                    log.error("writer: cannot serialize a record for %s: %s", path, e)
+                else:
+                    pending.setdefault(path, []).append(s)
+                    size += len(s)
+                if size >= self.flush_bytes:
+                    break
+                try:
+                    item = self._q.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._q.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+            await asyncio.to_thread(self._flush, pending)
+
+    def _open(self, path: str) -> BinaryIO:
+        fh = self._files.get(path)
+        if fh is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            fh = self._files[path] = open(path, "ab")
+        return fh
+
+    def _discard(self, path: str):
+        """Закрывает файл после ошибки записи: при следующем сбросе он откроется заново."""
+        fh = self._files.pop(path, None)
+        if fh is not None:
+            try:
+                fh.close()  # может снова упасть на дописывании буфера
+            except OSError:
+                pass
+
+    def _flush(self, pending: Dict[str, List[str]]):
+        t0 = time.perf_counter()
+        now = time.monotonic()
+        do_fsync = self.fsync == "always" or (
+            self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval)
+        for path, lines in pending.items():
+            sink = self._sinks.get(path)
+            try:
+                if sink is not None:
+                    n = sink.append(lines)
+                    if do_fsync:
+                        sink.sync()
+                else:
+                    fh = self._open(path)
+                    data = "".join(lines).encode("utf-8")
+                    fh.write(data)
+                    fh.flush()
+                    if do_fsync:
+                        os.fsync(fh.fileno())
+                    n = len(data)
+            except Exception as e:
+                self.errors += 1
+                self.dropped += len(lines)
+                log.error("writer: %d record(s) for %s lost: %s", len(lines), path, e)
+                if sink is None:
+                    self._discard(path)
+                continue
+            self.records += len(lines)
+            self.bytes += n
+        if do_fsync:
+            self._last_fsync = now
+
+        ms = (time.perf_counter() - t0) * 1000.0
+        self.flushes += 1
+        self.last_flush_ms = ms
+        self.max_flush_ms = max(self.max_flush_ms, ms)
+        self._total_flush_ms += ms
@@ -0,0 +1,61 @@
+"""Общие корпуса строк для бенчмарков: берём реальные генераторы из log-generator."""
+import os
+import random
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(HERE, "..", "app")
+GEN_DIR = os.path.join(HERE, "..", "..", "log-generator")
+for p in (APP_DIR, GEN_DIR):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+import generator_auth  # noqa: E402
+import generator_fw  # noqa: E402
+import generator_app  # noqa: E402
+
+
+def auth_lines(n: int, seed: int = 1):
+    random.seed(seed)
+    return [generator_auth.gen_normal() for _ in range(n)]
+
+
+def fw_lines(n: int, seed: int = 2):
+    random.seed(seed)
+    return generator_fw.gen_normal(n)
+
+
+def app_lines(n: int, seed: int = 3):
+    random.seed(seed)
+    return [generator_app.gen_normal() for _ in range(n)]
+
+
+def mixed_lines(n: int, fw_share: float = 0.8, seed: int = 4):
+    """Смесь как в проде: в основном firewall, остальное auth/app поровну."""
+    n_fw = int(n * fw_share)
+    n_auth = (n - n_fw) // 2
+    n_app = n - n_fw - n_auth
+    lines = fw_lines(n_fw) + auth_lines(n_auth) + app_lines(n_app)
+    random.seed(seed)
+    random.shuffle(lines)
+    return lines
+
+
+def brute_lines(n: int, attacker: str = "203.0.113.7", seed: int = 5):
+    """SSH brute force с одного IP (сценарий brute генератора)."""
+    random.seed(seed)
+    return [generator_auth.gen_brute(attacker) for _ in range(n)]
+
+
+def scan_lines(n: int, attacker: str = "198.51.100.9", target: str = "10.0.0.5", seed: int = 6):
+    """Порт-скан одной пары src→dst (сценарий scan генератора)."""
+    random.seed(seed)
+    return generator_fw.gen_scan(n, attacker, target)
+
+
+def retime(events, rate: float, start_ms: int = 1_700_000_000_000):
+    """Генераторы ставят настенное время; растягиваем события на заданный поток, событий/сек."""
+    step = 1000.0 / rate
+    for i, ev in enumerate(events):
+        ev.ts_epoch_ms = start_ms + int(i * step)
+    return events
@@ -0,0 +1,27 @@
+"""Стоимость генерации event_id: uuid4 против uuid7 и snowflake.
+
+    python bench/bench_event_ids.py [--n 1000000]
+"""
+import argparse
+import time
+
+import _corpus  # noqa: F401  (sys.path на app/)
+from parser_normalizer import EVENT_ID_GENERATORS
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--n", type=int, default=1_000_000)
+    args = ap.parse_args()
+    for name, gen in EVENT_ID_GENERATORS.items():
+        best = float("inf")
+        for _ in range(3):
+            t0 = time.perf_counter()
+            for _ in range(args.n):
+                gen()
+            best = min(best, time.perf_counter() - t0)
+        print(f"{name:<10} {args.n / best:>12,.0f} ids/s  {best / args.n * 1e9:>6.0f} ns/id  e.g. {gen()}")
+
+
+if __name__ == "__main__":
+    main()
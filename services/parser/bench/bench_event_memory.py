@@ -0,0 +1,37 @@
+"""Память на удержание N нормализованных событий: dict (как в JSON) против NormalizedEvent.
+
+    python bench/bench_event_memory.py [--n 1000000]
+"""
+import argparse
+import gc
+import tracemalloc
+
+import _corpus
+from parser_normalizer import detect_and_parse
+
+
+def measure(name: str, build, n: int):
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    print(f"{name:<16} {n:>9} events  {used / 2**20:>9.1f} MiB  {used / n:>7.0f} B/event")
+    del kept
+    gc.collect()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--n", type=int, default=1_000_000)
+    args = ap.parse_args()
+    lines = [l for l in _corpus.mixed_lines(args.n * 11 // 10) if detect_and_parse(l)[0]][:args.n]
+
+    # строки строим заранее: меряем удержание событий, а не исходный корпус
+    measure("dict", lambda: [detect_and_parse(l)[1].to_dict() for l in lines], args.n)
+    measure("NormalizedEvent", lambda: [detect_and_parse(l)[1] for l in lines], args.n)
+
+
+if __name__ == "__main__":
+    main()
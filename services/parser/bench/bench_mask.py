@@ -0,0 +1,51 @@
+"""Микробенчмарк маскирования секретов: старые два re.sub против одной
+альтернации с префильтром, на корпусах auth / fw / app.
+
+    python bench/bench_mask.py [--n 200000]
+"""
+import argparse
+import re
+import time
+
+import _corpus
+from parser_normalizer import APP_RE, _mask_secrets
+
+
+def legacy_mask(text: str) -> str:
+    """Прежняя реализация: два прохода re.sub на каждую строку."""
+    if not text:
+        return text
+    text = re.sub(r'(password|passwd|pwd)\s*=\s*\S+', r'\1=***', text, flags=re.I)
+    text = re.sub(r'(api[_-]?key|token|secret)\s*=\s*[A-Za-z0-9_\-]{6,}', r'\1=***', text, flags=re.I)
+    return text
+
+
+def run(name: str, texts, repeat: int = 3):
+    res = {}
+    for label, fn in (("legacy", legacy_mask), ("single", _mask_secrets)):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for t in texts:
+                fn(t)
+            best = min(best, time.perf_counter() - t0)
+        res[label] = len(texts) / best
+    same = all(legacy_mask(t) == _mask_secrets(t) for t in texts)
+    print(f"{name:<8} {len(texts):>8} msgs  legacy {res['legacy']:>12,.0f}/s  "
+          f"single {res['single']:>12,.0f}/s  x{res['single'] / res['legacy']:.1f}  same={same}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--n", type=int, default=200_000)
+    args = ap.parse_args()
+    # маскируется то же, что и в парсере: для app — только message
+    app = [m.group("message") if m else ln for ln in _corpus.app_lines(args.n) for m in (APP_RE.match(ln),)]
+    run("auth", _corpus.auth_lines(args.n))
+    run("fw", _corpus.fw_lines(args.n))
+    run("app", app)
+    run("secrets", [f"user login password={i} api_key=abcdef{i}" for i in range(args.n)])
+
+
+if __name__ == "__main__":
+    main()
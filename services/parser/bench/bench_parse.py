@@ -0,0 +1,38 @@
+"""Микробенчмарк detect_and_parse: строк/сек по форматам и на смешанном потоке.
+
+    python bench/bench_parse.py [--n 200000]
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import _corpus
+from parser_normalizer import detect_and_parse
+
+
+def run(name: str, lines, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        # старый код печатал на stdout — глушим, чтобы мерить разбор, а не терминал
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            for ln in lines:
+                detect_and_parse(ln)
+            best = min(best, time.perf_counter() - t0)
+    print(f"{name:<8} {len(lines):>8} lines  {len(lines) / best:>12,.0f} lines/s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--n", type=int, default=200_000)
+    args = ap.parse_args()
+    run("auth", _corpus.auth_lines(args.n))
+    run("fw", _corpus.fw_lines(args.n))
+    run("app", _corpus.app_lines(args.n))
+    run("mixed", _corpus.mixed_lines(args.n))
+    run("garbage", ["not a log line at all %d" % i for i in range(args.n)])
+
+
+if __name__ == "__main__":
+    main()
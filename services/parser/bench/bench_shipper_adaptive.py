@@ -0,0 +1,131 @@
+"""Сквозная задержка shipper.py (запись строки -> ответ /score) при фиксированной пачке
+против --slo (размер пачки и flush interval подстраиваются под время ответа детектора).
+
+Заглушка /score отвечает за постоянную часть + --cost-per-event * n мс: у настоящего детектора
+каждый вызов заново считает признаки по всем IP, поэтому мелкие пачки под нагрузкой дороги.
+Вход — фазы «тихо / всплеск / тихо» по --phase сек: во всплеске фиксированная пачка 200
+не успевает, очередь и задержка растут; с --slo пачка растёт, пока пачки режутся полными,
+и снова уменьшается, когда поток стихает. Сценарии (--cases):
+  fast — вызов 40 мс, всплеск 3000 ev/s;
+  slow — вызов 600 мс, больше половины SLO: пачка всё равно должна расти, а не сжиматься;
+  heavy — 1 мс на событие, всплеск больше, чем детектор может принять: пачка растёт,
+          пока вызов не упрётся в SLO, и дальше не растёт (без этой границы вызов
+          уходил бы за секунды).
+
+    python bench/bench_shipper_adaptive.py [--cases fast,slow,heavy] [--phase 5] [--slo 1] [--modes fixed,slo]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import _corpus
+
+SHIPPER = os.path.join(_corpus.APP_DIR, "shipper.py")
+# мс на вызов, мс на событие (None — --cost-per-event), ev/s по фазам
+CASES = {"fast": (40.0, None, "20,3000,20"), "slow": (600.0, None, "20,1000,20"), "heavy": (40.0, 1.0, "20,1500,20")}
+
+
+class Stub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # иначе ответы keep-alive ждут delayed ACK
+    cost_fixed = cost_per_event = 0.0
+    lock = threading.Lock()
+    latencies = []  # (фаза, сек)
+    sizes = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        events = json.loads(body)["events"]
+        time.sleep(self.cost_fixed + self.cost_per_event * len(events))
+        now = time.time()
+        with self.lock:
+            Stub.sizes.append(len(events))
+            Stub.latencies.extend((ev["phase"], now - ev["bench_t"]) for ev in events)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(p * len(xs)))] if xs else float("nan")
+
+
+def write_phases(path: str, rates, phase: float) -> int:
+    """Дописывает строки пачками по 10 мс с заданной скоростью; возвращает число строк."""
+    n = 0
+    with open(path, "a") as fh:
+        for p, rate in enumerate(rates):
+            start, base = time.time(), n
+            while (now := time.time()) - start < phase:
+                due = base + int((now - start) * rate)
+                while n < due:
+                    fh.write(json.dumps({"i": n, "phase": p, "bench_t": time.time()}) + "\n")
+                    n += 1
+                fh.flush()
+                time.sleep(0.01)
+    return n
+
+
+def run(mode: str, port: int, rates, args):
+    Stub.latencies, Stub.sizes = [], []
+    d = tempfile.mkdtemp(prefix="bench-shipper-")
+    path = os.path.join(d, "normalized.jsonl")
+    open(path, "w").close()
+    extra = ["--slo", str(args.slo)] if mode == "slo" else []
+    proc = subprocess.Popen(
+        [sys.executable, SHIPPER, "--file", path, "--checkpoint", os.path.join(d, "cp"),
+         "--ml", f"http://127.0.0.1:{port}/score", "--batch", "200", "--flush-interval", "0.5"] + extra,
+        cwd=_corpus.APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(1.0)  # старт интерпретатора и импорты
+        total = write_phases(path, rates, args.phase)
+        deadline = time.time() + 120
+        while len(Stub.latencies) < total and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        proc.terminate()
+        proc.wait()
+    print(f"  {mode:<5} received={len(Stub.latencies)}/{total}  requests={len(Stub.sizes):<4} "
+          f"batch min/median/max={min(Stub.sizes)}/{pct(Stub.sizes, .5)}/{max(Stub.sizes)}")
+    for p, rate in enumerate(rates):
+        lat = [x * 1000 for ph, x in Stub.latencies if ph == p]
+        print(f"        phase {p} ({rate:>6,.0f} ev/s)  p50={pct(lat, .5):8.0f} ms  p95={pct(lat, .95):8.0f} ms  "
+              f"max={max(lat, default=0):8.0f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--cases", default="fast,slow,heavy", help=", ".join(CASES))
+    ap.add_argument("--phase", type=float, default=5.0, help="seconds per phase")
+    ap.add_argument("--cost-per-event", type=float, default=0.2, help="ms per event in a call")
+    ap.add_argument("--slo", type=float, default=1.0)
+    ap.add_argument("--modes", default="fixed,slo")
+    args = ap.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for case in args.cases.split(","):
+        cost_fixed, cost_per_event, rates = CASES[case]
+        cost_per_event = args.cost_per_event if cost_per_event is None else cost_per_event
+        Stub.cost_fixed, Stub.cost_per_event = cost_fixed / 1000.0, cost_per_event / 1000.0
+        print(f"{case}: /score cost {cost_fixed:.0f} ms + {cost_per_event} ms/event, phases {rates} ev/s "
+              f"x {args.phase:.0f}s, batch 200 / flush 0.5s, --slo {args.slo}")
+        for mode in args.modes.split(","):
+            run(mode, server.server_address[1], [float(r) for r in rates.split(",")], args)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
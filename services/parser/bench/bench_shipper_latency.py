@@ -0,0 +1,110 @@
+"""Задержка shipper.py от записи строки в normalized.jsonl до её прихода на /score:
+ожидание через inotify против прежнего опроса (--watch poll, --poll-interval 0.5).
+
+Поднимает заглушку /score в этом процессе, запускает shipper.py подпроцессом на
+временном файле и дописывает строки с меткой времени записи с паузами --gap
+(больше --flush-interval, чтобы мерить ожидание, а не накопление пачки).
+Заодно — сколько раз shipper просыпается, пока файл не меняется (--idle сек).
+
+    python bench/bench_shipper_latency.py [--n 30] [--gap 0.6] [--idle 5] [--modes inotify,poll]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import _corpus
+
+SHIPPER = os.path.join(_corpus.APP_DIR, "shipper.py")
+
+
+class Stub(BaseHTTPRequestHandler):
+    latencies = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        now = time.time()
+        for ev in json.loads(body)["events"]:
+            self.latencies.append(now - ev["bench_t"])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def ctx_switches(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as fh:
+        for line in fh:
+            if line.startswith("voluntary_ctxt_switches"):
+                return int(line.split()[1])
+    return 0
+
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(p * len(xs)))]
+
+
+def run(mode: str, port: int, args):
+    Stub.latencies = []
+    d = tempfile.mkdtemp(prefix="bench-shipper-")
+    path = os.path.join(d, "normalized.jsonl")
+    open(path, "w").close()
+    proc = subprocess.Popen(
+        [sys.executable, SHIPPER, "--file", path, "--checkpoint", os.path.join(d, "cp"),
+         "--ml", f"http://127.0.0.1:{port}/score", "--watch", mode,
+         "--flush-interval", str(args.flush_interval), "--poll-interval", str(args.poll_interval)],
+        cwd=_corpus.APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(1.0)  # старт интерпретатора и импорты
+        random.seed(3)
+        with open(path, "a") as fh:
+            for i in range(args.n):
+                time.sleep(args.gap * random.uniform(0.9, 1.3))
+                fh.write(json.dumps({"i": i, "bench_t": time.time()}) + "\n")
+                fh.flush()
+        deadline = time.time() + 5
+        while len(Stub.latencies) < args.n and time.time() < deadline:
+            time.sleep(0.05)
+        before = ctx_switches(proc.pid)
+        time.sleep(args.idle)
+        idle = (ctx_switches(proc.pid) - before) / args.idle
+    finally:
+        proc.terminate()
+        proc.wait()
+    lat = [x * 1000 for x in Stub.latencies]
+    print(f"  {mode:<8} shipped={len(lat):>3}/{args.n}  p50={pct(lat, .5):7.1f} ms  p95={pct(lat, .95):7.1f} ms  "
+          f"max={max(lat):7.1f} ms  idle wakeups={idle:5.1f}/s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--n", type=int, default=30)
+    ap.add_argument("--gap", type=float, default=0.6)
+    ap.add_argument("--idle", type=float, default=5.0)
+    ap.add_argument("--flush-interval", type=float, default=0.5)
+    ap.add_argument("--poll-interval", type=float, default=0.5)
+    ap.add_argument("--modes", default="inotify,poll")
+    args = ap.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"append -> /score, {args.n} lines, gap ~{args.gap}s, flush-interval {args.flush_interval}s, "
+          f"poll-interval {args.poll_interval}s")
+    for mode in args.modes.split(","):
+        run(mode, server.server_address[1], args)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
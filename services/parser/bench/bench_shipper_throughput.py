@@ -0,0 +1,128 @@
+"""Пропускная способность shipper.py против заглушки /score, отвечающей через --rtt мс
+(время скоринга детектора): прежний последовательный цикл (--inflight 1) против
+асинхронного конвейера с N пачками в полёте; суффикс r — режим --raw (строки как есть,
+gzip NDJSON в /score-ndjson). Кроме ev/s — CPU самого shipper и байты на проводе.
+
+Файл заранее заполнен --n нормализованными событиями смешанного корпуса; мерится время
+от первого запроса до прихода последнего события, затем проверяется, что чекпоинт
+дошёл до конца файла и заглушка получила каждое событие.
+
+    python bench/bench_shipper_throughput.py [--n 40000] [--rtt 20] [--configs 1,4,8,1r,8r]
+"""
+import argparse
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import _corpus
+from event import json_default
+from parser_normalizer import detect_and_parse
+
+SHIPPER = os.path.join(_corpus.APP_DIR, "shipper.py")
+
+
+class Stub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive для тех, кто его держит
+    disable_nagle_algorithm = True  # как uvicorn; иначе заголовки и тело ответа ждут delayed ACK
+    rtt = 0.0
+    lock = threading.Lock()
+    seen = set()
+    requests = 0
+    first_at = last_at = 0.0
+    wire_bytes = 0
+
+    def do_POST(self):
+        with self.lock:
+            Stub.first_at = Stub.first_at or time.time()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/score-ndjson"):
+            ids = [json.loads(ln)["event_id"] for ln in gzip.decompress(body).splitlines()]
+        else:
+            ids = [ev["event_id"] for ev in json.loads(body)["events"]]
+        time.sleep(self.rtt)
+        with self.lock:
+            Stub.wire_bytes += len(body)
+            Stub.seen.update(ids)
+            Stub.requests += 1
+            Stub.last_at = time.time()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def make_input(path: str, n: int) -> int:
+    events = [ev for ok, ev in map(detect_and_parse, _corpus.mixed_lines(n)) if ok]
+    with open(path, "w", encoding="utf-8") as fh:
+        for ev in events:
+            fh.write(json.dumps(ev.to_dict(), ensure_ascii=False, default=json_default) + "\n")
+    return len(events)
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as fh:
+        fields = fh.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+
+
+def run(config: str, path: str, total: int, port: int, args):
+    Stub.seen, Stub.requests, Stub.first_at, Stub.wire_bytes = set(), 0, 0.0, 0
+    raw = config.endswith("r")
+    inflight = int(config.rstrip("r"))
+    cp = path + f".cp{config}"
+    t0 = time.time()
+    proc = subprocess.Popen(
+        [sys.executable, SHIPPER, "--file", path, "--checkpoint", cp, "--ml", f"http://127.0.0.1:{port}/score",
+         "--batch", str(args.batch), "--inflight", str(inflight)] + (["--raw"] if raw else []),
+        cwd=_corpus.APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = t0 + args.timeout
+        while len(Stub.seen) < total and time.time() < deadline:
+            time.sleep(0.02)
+        dt = Stub.last_at - Stub.first_at  # без старта интерпретатора
+        size = os.path.getsize(path)
+        while time.time() < deadline and (not os.path.exists(cp) or open(cp).read().strip() != str(size)):
+            time.sleep(0.02)
+        checkpoint = open(cp).read().strip()
+        cpu = cpu_seconds(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+    print(f"  {config:<4} {total / dt:>9,.0f} ev/s  {dt:6.2f}s  shipper cpu {cpu:5.2f}s  "
+          f"wire {Stub.wire_bytes / 1e6:6.1f} MB  requests={Stub.requests:<4} "
+          f"received={len(Stub.seen)}/{total}  checkpoint at end: {checkpoint == str(size)}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--n", type=int, default=40_000)
+    ap.add_argument("--rtt", type=float, default=20.0, help="ms per /score call")
+    ap.add_argument("--batch", type=int, default=200)
+    ap.add_argument("--configs", default="1,4,8,1r,8r", help="in-flight batches, r = --raw")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    args = ap.parse_args()
+
+    Stub.rtt = args.rtt / 1000.0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    d = tempfile.mkdtemp(prefix="bench-shipper-")
+    path = os.path.join(d, "normalized.jsonl")
+    total = make_input(path, args.n)
+    print(f"{total} events ({os.path.getsize(path) / 1e6:.1f} MB), batch {args.batch}, /score rtt {args.rtt:.0f} ms")
+    for config in args.configs.split(","):
+        run(config, path, total, server.server_address[1], args)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Микробенчмарк сигнатур app_suspicious_payload: прежний any(s in msg) по кортежу
+против автомата Ахо—Корасик, на сообщениях app-корпуса и наборах из 4 / 1000 / 5000 сигнатур.
+
+    python bench/bench_signatures.py [--n 50000] [--sizes 4,1000,5000]
+"""
+import argparse
+import random
+import string
+import time
+
+import _corpus
+from parser_normalizer import APP_RE
+from signatures import Automaton
+
+BASE = ["Unauthorized", "<script>", "evil()", "EvilClass"]
+
+
+def make_signatures(n: int, seed: int = 7):
+    """Первые четыре — прежние, остальные — случайные токены вида IOC (8..24 символа)."""
+    random.seed(seed)
+    alphabet = string.ascii_letters + string.digits + "_./<>()$"
+    sigs = BASE[:n]
+    while len(sigs) < n:
+        sigs.append("".join(random.choice(alphabet) for _ in range(random.randint(8, 24))))
+    return sigs
+
+
+def run(msgs, sigs, repeat: int = 3):
+    needles = tuple(sigs)
+
+    def naive(m):
+        return [s for s in needles if s in m]
+
+    t0 = time.perf_counter()
+    auto = Automaton([(s, s) for s in sigs], small_set=0)
+    build = time.perf_counter() - t0
+    default = Automaton([(s, s) for s in sigs])  # малые наборы — str.__contains__ по каждому
+
+    res = {}
+    for label, fn in (("naive", naive), ("automaton", auto.search), ("default", default.search)):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for m in msgs:
+                fn(m)
+            best = min(best, time.perf_counter() - t0)
+        res[label] = len(msgs) / best
+    same = all(sorted(naive(m)) == sorted(auto.search(m)) for m in msgs)
+    hits = sum(1 for m in msgs if auto.search(m))
+    print(f"{len(sigs):>6} sigs  build {build * 1000:>7.1f} ms  {len(auto.goto):>7} states  "
+          f"naive {res['naive']:>10,.0f}/s  automaton {res['automaton']:>10,.0f}/s  "
+          f"default {res['default']:>10,.0f}/s  x{res['default'] / res['naive']:.1f}  hits={hits}  same={same}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--n", type=int, default=50_000)
+    ap.add_argument("--sizes", default="4,1000,5000")
+    args = ap.parse_args()
+    msgs = [m.group("message") if m else ln for ln in _corpus.app_lines(args.n) for m in (APP_RE.match(ln),)]
+    # ~1% сообщений с прежними сигнатурами, чтобы было что находить
+    for i in range(0, len(msgs), 100):
+        msgs[i] += " payload contains suspicious payload: <script>evil()</script>"
+    for size in (int(x) for x in args.sizes.split(",")):
+        run(msgs, make_signatures(size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Окна RuleEngine на сценариях brute и scan генераторов, растянутых на поток --rate событий/сек:
+ - счётчики: deque меток времени (как было) против CounterWindow (корзины);
+ - уникальные порты port_scan: пересборка set по deque (как было, квадратично — только
+   первые --legacy-n событий) против DistinctWindow и BoundedDistinctWindow.
+
+    python bench/bench_windows.py [--n 300000] [--rate 2000] [--legacy-n 20000]
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from collections import deque
+
+import _corpus
+from parser_normalizer import detect_and_parse
+from rules import CRITICAL_PORTS, RuleEngine
+from windows import BoundedDistinctWindow, CounterWindow, DistinctWindow
+
+
+class DequeWindow:
+    """Прежняя схема: deque времён + _drop_old на каждое событие."""
+    __slots__ = ("window", "dq")
+
+    def __init__(self, window: float):
+        self.window = window
+        self.dq = deque()
+
+    def add(self, t: float) -> int:
+        dq = self.dq
+        dq.append(t)
+        while dq and (t - dq[0]) > self.window:
+            dq.popleft()
+        return len(dq)
+
+
+class SetRebuildWindow:
+    """Прежний port_scan: deque (t, port) и len({p for _t, p in dq}) на каждое событие."""
+    __slots__ = ("window", "dq")
+
+    def __init__(self, window: float):
+        self.window = window
+        self.dq = deque()
+
+    def add(self, t: float, port: int) -> int:
+        dq = self.dq
+        dq.append((t, port))
+        while dq and (t - dq[0][0]) > self.window:
+            dq.popleft()
+        return len({p for _t, p in dq})
+
+
+def events_for(lines, rate):
+    return _corpus.retime([ev for ok, ev in map(detect_and_parse, lines) if ok], rate)
+
+
+def feed(cls, stream, window: float):
+    windows = {}
+    last = 0
+    for key, *args in stream:
+        w = windows.get(key)
+        if w is None:
+            w = windows[key] = cls(window)
+        last = w.add(*args)
+    return windows, last
+
+
+def run_window(name: str, cls, stream, window: float):
+    # время — без tracemalloc, память — отдельным прогоном под ним
+    gc.collect()
+    t0 = time.perf_counter()
+    windows, last = feed(cls, stream, window)
+    dt = time.perf_counter() - t0
+    del windows
+    gc.collect()
+    tracemalloc.start()
+    windows, _ = feed(cls, stream, window)
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"  {name:<14} {len(stream) / dt:>12,.0f} upd/s  keys={len(windows):<4} "
+          f"mem={mem / 1024:>9.1f} KiB  last_count={last}")
+
+
+def run_engine(name: str, events):
+    eng = RuleEngine()
+    t0 = time.perf_counter()
+    fired = sum(len(eng.process(ev)) for ev in events)
+    dt = time.perf_counter() - t0
+    print(f"  {'RuleEngine':<14} {len(events) / dt:>12,.0f} ev/s   incidents={fired}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--n", type=int, default=300_000)
+    ap.add_argument("--rate", type=float, default=2_000.0)
+    ap.add_argument("--legacy-n", type=int, default=20_000)
+    args = ap.parse_args()
+
+    brute = events_for(_corpus.brute_lines(args.n), args.rate)
+    stream = [(ev.source_ip, ev.ts_epoch_ms / 1000.0) for ev in brute if ev.outcome == "failed"]
+    print(f"brute: failed_by_ip, 60s window, {len(stream)} fails")
+    run_window("deque", DequeWindow, stream, 60.0)
+    run_window("CounterWindow", CounterWindow, stream, 60.0)
+    run_engine("brute", brute)
+
+    scan = events_for(_corpus.scan_lines(args.n), args.rate)
+    stream = [(ev.source_ip, ev.ts_epoch_ms / 1000.0) for ev in scan
+              if ev.action == "deny" and ev.dest_port in CRITICAL_PORTS]
+    pairs = [((ev.source_ip, ev.dest_ip), ev.ts_epoch_ms / 1000.0, ev.dest_port) for ev in scan]
+    print(f"scan: scan_by_srcdst unique ports, 30s window, {len(pairs)} events")
+    run_window("set rebuild", SetRebuildWindow, pairs[:args.legacy_n], 30.0)
+    run_window("DistinctWindow", DistinctWindow, pairs, 30.0)
+    run_window("Bounded(256)", lambda w: BoundedDistinctWindow(w, 256), pairs, 30.0)
+
+    print(f"scan: denies_by_ip, 60s window, {len(stream)} critical denies")
+    run_window("deque", DequeWindow, stream, 60.0)
+    run_window("CounterWindow", CounterWindow, stream, 60.0)
+    run_engine("scan", scan)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+# services/parser/tests/conftest.py
+"""Модули сервиса лежат плоско в app/ и импортируют друг друга по имени — как при запуске из app/."""
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
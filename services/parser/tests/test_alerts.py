@@ -0,0 +1,64 @@
+# services/parser/tests/test_alerts.py
+from alerts import AlertAggregator
+
+
+def build(at="2026-01-01T00:00:00Z", kind="ssh_bruteforce"):
+    return lambda: {"kind": kind, "at": at, "base_event": {"id": "e1"}, "extra": {"n": 1}}
+
+
+def test_first_hit_opens_incident():
+    agg = AlertAggregator(enabled=True, update_interval=60, close_after=120)
+    inc = agg.hit("ssh_bruteforce", "1.2.3.4", 0.0, build())
+    assert inc["phase"] == "open" and inc["hits"] == 1 and inc["base_event"] == {"id": "e1"}
+    assert agg.stats()["open"] == 1
+
+
+def test_hits_within_update_interval_are_suppressed():
+    agg = AlertAggregator(enabled=True, update_interval=60, close_after=120)
+    opened = agg.hit("ssh_bruteforce", "1.2.3.4", 0.0, build())
+    assert agg.hit("ssh_bruteforce", "1.2.3.4", 10.0, build()) is None
+    upd = agg.hit("ssh_bruteforce", "1.2.3.4", 61.0, build("2026-01-01T00:01:01Z"))
+    assert upd["phase"] == "update" and upd["hits"] == 3
+    assert upd["incident_id"] == opened["incident_id"]
+    assert upd["first_at"] == "2026-01-01T00:00:00Z" and upd["last_at"] == "2026-01-01T00:01:01Z"
+    assert agg.suppressed == 1
+
+
+def test_expire_closes_after_quiet_period():
+    agg = AlertAggregator(enabled=True, update_interval=60, close_after=120)
+    opened = agg.hit("ssh_bruteforce", "1.2.3.4", 0.0, build())
+    agg.hit("ssh_bruteforce", "1.2.3.4", 30.0, build())
+    assert agg.expire(100.0) == []
+    closed = agg.expire(151.0)
+    assert len(closed) == 1
+    c = closed[0]
+    assert c["phase"] == "close" and c["incident_id"] == opened["incident_id"]
+    assert c["hits"] == 2 and c["base_event"] is None and c["extra"]["duration_s"] == 30.0
+    assert agg.stats()["open"] == 0
+    assert agg.hit("ssh_bruteforce", "1.2.3.4", 200.0, build())["phase"] == "open"
+
+
+def test_expire_uses_each_rules_clock():
+    agg = AlertAggregator(enabled=True, update_interval=60, close_after=120)
+    agg.hit("port_scan", "a", 1000.0, build(kind="port_scan"))
+    agg.hit("ssh_bruteforce", "b", 10.0, build())
+    # часы auth отстают: общий watermark закрыл бы и ssh_bruteforce, хотя у него прошло 90 с
+    closed = agg.expire(1200.0, {"ssh_bruteforce": 100.0})
+    assert [c["kind"] for c in closed] == ["port_scan"]
+    assert list(agg.open) == [("ssh_bruteforce", "b")]
+
+
+def test_max_open_closes_oldest():
+    agg = AlertAggregator(enabled=True, update_interval=60, close_after=120, max_open=1)
+    first = agg.hit("ssh_bruteforce", "a", 0.0, build())
+    agg.hit("ssh_bruteforce", "b", 1.0, build())
+    assert [c["incident_id"] for c in agg.pending_close()] == [first["incident_id"]]
+    assert [c["incident_id"] for c in agg.expire(1.0)] == [first["incident_id"]]
+    assert agg.pending_close() == []
+
+
+def test_disabled_passes_every_hit_through():
+    agg = AlertAggregator(enabled=False)
+    assert agg.hit("ssh_bruteforce", "a", 0.0, build())["base_event"] == {"id": "e1"}
+    assert "phase" not in agg.hit("ssh_bruteforce", "a", 1.0, build())
+    assert agg.stats()["open"] == 0
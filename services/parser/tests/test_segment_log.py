@@ -0,0 +1,79 @@
+# services/parser/tests/test_segment_log.py
+import os
+
+from segment_log import SegmentReader, SegmentedLog, list_segments, segment_path
+
+
+def lines(*ids):
+    return [f'{{"i": {i}}}\n' for i in ids]
+
+
+def test_append_rolls_by_size(tmp_path):
+    log = SegmentedLog(str(tmp_path), segment_bytes=30, roll_sec=0, retention_bytes=0, retention_sec=0)
+    log.append(lines(*range(6)))  # по 9 байт: 4 строки на сегмент (≥ 30 — переход)
+    log.close()
+    assert list_segments(str(tmp_path)) == [0, 1]
+    assert os.path.getsize(segment_path(str(tmp_path), 0)) == 36
+
+
+def test_reader_crosses_into_next_segment(tmp_path):
+    log = SegmentedLog(str(tmp_path), segment_bytes=30, roll_sec=0, retention_bytes=0, retention_sec=0)
+    log.append(lines(*range(6)))
+    reader = SegmentReader(str(tmp_path))
+    got, pos = reader.read((0, 0), 100)
+    assert got == [s.encode() for s in lines(*range(6))]
+    assert pos == (1, 18)
+    log.append(lines(6))
+    got, pos = reader.read(pos, 100)
+    assert got == [b'{"i": 6}\n'] and pos == (1, 27)
+
+
+def test_reader_waits_for_partial_line_in_active_segment(tmp_path):
+    path = segment_path(str(tmp_path), 0)
+    with open(path, "wb") as fh:
+        fh.write(b'{"i": 0}\n{"i": 1')
+    reader = SegmentReader(str(tmp_path))
+    got, pos = reader.read((0, 0), 100)
+    assert got == [b'{"i": 0}\n'] and pos == (0, 9)
+    with open(path, "ab") as fh:
+        fh.write(b'}\n')
+    got, pos = reader.read(pos, 100)
+    assert got == [b'{"i": 1}\n'] and pos == (0, 18)
+
+
+def test_reader_skips_partial_tail_of_closed_segment(tmp_path):
+    with open(segment_path(str(tmp_path), 0), "wb") as fh:
+        fh.write(b'{"i": 0}\n{"i": 1')  # хвост так и не дописали, журнал перешёл на следующий сегмент
+    with open(segment_path(str(tmp_path), 1), "wb") as fh:
+        fh.write(b'{"i": 2}\n')
+    reader = SegmentReader(str(tmp_path))
+    got, pos = reader.read((0, 0), 100)
+    assert got == [b'{"i": 0}\n', b'{"i": 2}\n']
+    assert pos == (1, 9)
+    assert reader.partial_tails == 1
+
+
+def test_recover_drops_torn_last_record(tmp_path):
+    log = SegmentedLog(str(tmp_path), roll_sec=0, retention_bytes=0, retention_sec=0)
+    log.append(lines(0, 1))
+    log.close()
+    with open(segment_path(str(tmp_path), 0), "ab") as fh:
+        fh.write(b'{"i": 2')
+    log = SegmentedLog(str(tmp_path), roll_sec=0, retention_bytes=0, retention_sec=0)
+    log.open()
+    assert log.records == 2 and log.size == 18
+    log.append(lines(3))
+    log.close()
+    got, _ = SegmentReader(str(tmp_path)).read((0, 0), 100)
+    assert got == [b'{"i": 0}\n', b'{"i": 1}\n', b'{"i": 3}\n']
+
+
+def test_resolve_skips_segments_removed_by_retention(tmp_path):
+    log = SegmentedLog(str(tmp_path), segment_bytes=30, roll_sec=0, retention_bytes=40, retention_sec=0)
+    log.append(lines(*range(12)))
+    log.close()
+    reader = SegmentReader(str(tmp_path))
+    first = list_segments(str(tmp_path))[0]
+    assert first > 0
+    assert reader.resolve((0, 5)) == (first, 0)
+    assert reader.skipped_segments == first
@@ -0,0 +1,46 @@
+# services/parser/tests/test_shipper.py
+from shipper import MIN_FLUSH_INTERVAL, BatchController, OrderedCheckpoint, read_checkpoint
+
+
+def test_checkpoint_moves_over_contiguous_prefix_only(tmp_path):
+    path = str(tmp_path / "cp")
+    cp = OrderedCheckpoint(path, 0)
+    assert not cp.ack(1, 200)
+    assert read_checkpoint(path) == 0
+    assert cp.ack(0, 100)
+    assert cp.position == 200 and cp.next_seq == 2
+    assert read_checkpoint(path) == 200
+
+
+def test_failed_batch_holds_checkpoint_but_not_later_batches(tmp_path):
+    path = str(tmp_path / "cp")
+    cp = OrderedCheckpoint(path, 0)
+    assert cp.ack(0, 100)
+    assert not cp.ack(1, None)
+    assert cp.next_seq == 2  # batch 2 is no longer waiting on batch 1
+    assert not cp.ack(2, 300)
+    assert cp.next_seq == 3 and cp.position == 100
+    assert read_checkpoint(path) == 100
+
+
+def test_controller_fixed_without_slo():
+    c = BatchController(200, 0.5)
+    c.observe(200, 0.1, True)
+    assert (c.batch, c.flush_interval) == (200, 0.5)
+    assert c.latency == 0.1
+
+
+def test_controller_grows_while_full_and_shrinks_when_idle():
+    c = BatchController(200, 0.5, slo=1.0, min_batch=50)
+    c.observe(200, 0.1, True)
+    assert c.batch == 250
+    c.observe(10, 0.1, False)
+    assert c.batch == 125
+
+
+def test_controller_stops_growing_at_the_slo():
+    c = BatchController(200, 0.5, slo=1.0, min_batch=50)
+    c.observe(200, 0.8 - MIN_FLUSH_INTERVAL, True)
+    assert c.batch == 200
+    c.observe(200, 0.9, True)
+    assert c.batch == 200  # held, not shrunk
@@ -0,0 +1,55 @@
+# services/parser/tests/test_spill.py
+import errno
+import os
+
+import pytest
+
+from spill import SpillQueue
+
+
+def test_fifo_and_byte_accounting(tmp_path):
+    q = SpillQueue(str(tmp_path), max_bytes=10)
+    q.push([b"a\n", b"b\n"], 1.5)
+    q.push([b"c\n"], 2.0)
+    assert len(q) == 2 and q.bytes == 6 and q.oldest() == 1.5
+    assert q.peek() == ([b"a\n", b"b\n"], 1.5)
+    q.pop()
+    assert q.peek() == ([b"c\n"], 2.0) and q.bytes == 2
+    q.pop()
+    assert q.peek() is None and q.oldest() is None
+    assert q.stats() == {"batches": 0, "bytes": 0, "max_bytes": 10, "spilled": 2, "replayed": 2}
+
+
+def test_full_at_max_bytes(tmp_path):
+    q = SpillQueue(str(tmp_path), max_bytes=4)
+    q.push([b"ab\n"], 1.0)
+    assert not q.full()
+    q.push([b"c\n"], 1.0)
+    assert q.full()
+
+
+def test_survives_restart_and_drops_tmp_files(tmp_path):
+    q = SpillQueue(str(tmp_path), max_bytes=100)
+    q.push([b"a\n"], 1.0)
+    q.push([b"b\n"], 2.0)
+    (tmp_path / "000000000009-3000.jsonl.tmp").write_bytes(b"torn")
+    q = SpillQueue(str(tmp_path), max_bytes=100)
+    assert len(q) == 2 and q.oldest() == 1.0
+    assert not any(n.endswith(".tmp") for n in os.listdir(tmp_path))
+    q.push([b"c\n"], 3.0)  # numbering continues after the files found on start
+    q.pop()
+    q.pop()
+    assert q.peek() == ([b"c\n"], 3.0)
+
+
+def test_failed_write_leaves_queue_unchanged(tmp_path, monkeypatch):
+    q = SpillQueue(str(tmp_path), max_bytes=100)
+
+    def no_space(fd):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(os, "fsync", no_space)
+    with pytest.raises(OSError):
+        q.push([b"a\n"], 1.0)
+    assert len(q) == 0 and q.bytes == 0
+    assert os.listdir(tmp_path) == []
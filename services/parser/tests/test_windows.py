@@ -0,0 +1,91 @@
+# services/parser/tests/test_windows.py
+from windows import CounterWindow, KeyedWindows
+
+
+def test_counter_window_counts_within_window():
+    w = CounterWindow(10, width=1)
+    assert w.add(100.0) == 1
+    assert w.add(100.5) == 2
+    assert w.add(105.0, 3) == 5
+    assert len(w) == 5
+
+
+def test_counter_window_expires_old_buckets():
+    w = CounterWindow(10, width=1)
+    w.add(100.0)
+    w.add(105.0)
+    # окно от window до window+resolution: 100 ещё может считаться на 110, но не на 112
+    assert w.count(112.0) == 1
+    assert w.count(200.0) == 0
+    assert w.add(200.0) == 1
+
+
+def test_counter_window_ignores_events_older_than_window():
+    w = CounterWindow(10, width=1)
+    w.add(100.0)
+    assert w.add(50.0) == 1
+
+
+def test_counter_window_late_event_inside_window_counts():
+    w = CounterWindow(10, width=1)
+    w.add(100.0)
+    assert w.add(95.0) == 2
+    assert w.count(106.5) == 1  # корзина 95 вышла из окна, 100 — ещё нет
+
+
+def test_counter_window_dump_replays_to_same_state():
+    w = CounterWindow(10, width=1)
+    for t in (100.0, 100.2, 103.0, 107.9):
+        w.add(t)
+    copy = CounterWindow(10, width=1)
+    for t, k in w.dump():
+        copy.add(t, k)
+    assert copy.dump() == w.dump()
+    assert copy.count(108.0) == w.count(108.0) == 4
+
+
+def test_keyed_windows_creates_once_per_key():
+    kw = KeyedWindows(lambda: CounterWindow(10, width=1), idle=10)
+    a = kw.touch("a", 1.0)
+    assert kw.touch("a", 2.0) is a
+    assert len(kw) == 1 and "a" in kw and kw.get("b") is None
+
+
+def test_keyed_windows_sweep_removes_idle_keys_in_lru_order():
+    kw = KeyedWindows(lambda: CounterWindow(10, width=1), idle=10)
+    kw.touch("a", 0.0)
+    kw.touch("b", 5.0)
+    kw.touch("a", 8.0)  # a снова свежий: в конец LRU
+    assert kw.sweep(16.0) == 1
+    assert list(kw) == ["a"]
+    assert kw.sweep(100.0) == 1
+    assert len(kw) == 0
+    assert kw.stats()["evicted_idle"] == 2
+
+
+def test_keyed_windows_past_event_does_not_refresh_key():
+    kw = KeyedWindows(lambda: CounterWindow(10, width=1), idle=10)
+    kw.touch("a", 10.0)
+    kw.touch("b", 12.0)
+    kw.touch("a", 5.0)
+    assert list(kw) == ["a", "b"]
+
+
+def test_keyed_windows_max_keys_evicts_least_recent():
+    kw = KeyedWindows(lambda: CounterWindow(10, width=1), idle=10, max_keys=2)
+    for i, key in enumerate("abc"):
+        kw.touch(key, float(i))
+    assert list(kw) == ["b", "c"]
+    assert kw.stats()["evicted_cap"] == 1
+
+
+def test_keyed_windows_dump_and_restore():
+    kw = KeyedWindows(lambda: CounterWindow(10, width=1), idle=10)
+    kw.touch("a", 1.0).add(1.0)
+    kw.touch("b", 2.0).add(2.0, 2)
+    restored = KeyedWindows(lambda: CounterWindow(10, width=1), idle=10)
+    for chunk in kw.dump(chunk=1):
+        for key, last, pairs in chunk:
+            restored.restore(key, last, pairs)
+    assert list(restored) == ["a", "b"]
+    assert len(restored.get("b")) == 2